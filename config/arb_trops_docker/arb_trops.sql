@@ -244,6 +244,20 @@ SELECT create_hypertable(
     chunk_time_interval => INTERVAL '1 day'
 );
 
+-- histogram of one stage (exchange, feed, bus, decode, callbacks, total) per
+-- instrument and event type, durations in microseconds
+ALTER TABLE latencies ADD COLUMN IF NOT EXISTS instr_id INTEGER;
+ALTER TABLE latencies ADD COLUMN IF NOT EXISTS stage VARCHAR(255);
+ALTER TABLE latencies ADD COLUMN IF NOT EXISTS count INTEGER;
+ALTER TABLE latencies ADD COLUMN IF NOT EXISTS mean_us DOUBLE PRECISION;
+ALTER TABLE latencies ADD COLUMN IF NOT EXISTS p50_us DOUBLE PRECISION;
+ALTER TABLE latencies ADD COLUMN IF NOT EXISTS p90_us DOUBLE PRECISION;
+ALTER TABLE latencies ADD COLUMN IF NOT EXISTS p99_us DOUBLE PRECISION;
+ALTER TABLE latencies ADD COLUMN IF NOT EXISTS max_us DOUBLE PRECISION;
+ALTER TABLE latencies ADD COLUMN IF NOT EXISTS buckets JSONB;
+
+CREATE INDEX IF NOT EXISTS latencies_instr_time_idx ON latencies(instr_id, time DESC);
+
 
 
 -- ███████╗████████╗██████╗  █████╗ ████████╗███████╗ ██████╗██╗   ██╗     ██╗███╗   ██╗███████╗ ██████╗ ███████╗
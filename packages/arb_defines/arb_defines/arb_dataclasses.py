@@ -1,9 +1,11 @@
 import math
 import time
 import uuid
+import heapq
 
 from uuid import UUID
 from typing import Optional
+from bisect import bisect_left, insort
 from collections import defaultdict
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta, timezone
@@ -17,6 +19,11 @@ from arb_defines.defines import *
 from arb_defines.status import StatusEnum
 
 ORDER_FINAL_STATUS = [CANCELED, REJECTED, CLOSED, FILLED]
+# an order status never goes back to an earlier one of this list
+ORDER_STATUS_PROGRESSION = [
+    None, NEW, UNKNOWN, OPEN, CANCEL, PARTIAL, CANCELED, CANCEL_REJECTED,
+    REJECTED, FILLED, CLOSED, EXPIRED, FAILED
+]
 
 
 @dataclass
@@ -283,11 +290,8 @@ class Order:
             curr = curr.order_status
         prev = prev.lower()
         curr = curr.lower()
-        order = [
-            None, NEW, UNKNOWN, OPEN, CANCEL, PARTIAL, CANCELED,
-            CANCEL_REJECTED, REJECTED, FILLED, CLOSED, EXPIRED, FAILED
-        ]
-        return max([prev, curr], key=lambda x: order.index(x))
+        return max([prev, curr],
+                   key=lambda x: ORDER_STATUS_PROGRESSION.index(x))
 
     @staticmethod
     def from_model(model):
@@ -397,13 +401,32 @@ class Latency:
     time: Optional[datetime] = None
     event_id: Optional[UUID] = None
     event_type: Optional[str] = None
+    # histogram of one stage of the market data path, see redis_manager.latency
+    instr_id: Optional[int] = None
+    stage: Optional[str] = None
+    count: Optional[int] = None
+    mean_us: Optional[float] = None
+    p50_us: Optional[float] = None
+    p90_us: Optional[float] = None
+    p99_us: Optional[float] = None
+    max_us: Optional[float] = None
+    buckets: Optional[dict] = None
 
     @staticmethod
     def from_model(model):
         return Latency(id=model.id,
                        time=model.time,
                        event_id=model.event_id,
-                       event_type=model.event_type)
+                       event_type=model.event_type,
+                       instr_id=model.instr_id,
+                       stage=model.stage,
+                       count=model.count,
+                       mean_us=model.mean_us,
+                       p50_us=model.p50_us,
+                       p90_us=model.p90_us,
+                       p99_us=model.p99_us,
+                       max_us=model.max_us,
+                       buckets=model.buckets)
 
 
 @dataclass
@@ -620,6 +643,84 @@ class OrderBook:
         return (ask - bid) * 2 / (bid + ask)
 
 
+def _levels_delta(previous: list, levels: list) -> list[list[float]]:
+    old = dict(previous)
+    new = dict(levels)
+    delta = [[price, qty] for price, qty in levels if old.get(price) != qty]
+    delta += [[price, 0] for price in old if price not in new]
+    return delta
+
+
+def _apply_levels(levels: list, delta: list, reverse: bool) -> list:
+    book = dict(levels)
+    for price, qty in delta:
+        if qty:
+            book[price] = qty
+        else:
+            book.pop(price, None)
+    return sorted(book.items(), reverse=reverse)
+
+
+@dataclass
+class OrderBookDelta:
+    """
+    Update of the l2 delta channel, changed levels are [price, qty] and a qty
+    of 0 removes the level. Snapshots carry every level of the book.
+    seq is incremented by the publisher on every update of the instrument.
+    """
+    instr_id: int
+    seq: int
+    bids: list = field(default_factory=list)
+    asks: list = field(default_factory=list)
+    snapshot: bool = False
+    timestamp: Optional[float] = None
+
+    @staticmethod
+    def from_snapshot(orderbook: OrderBook, seq: int) -> 'OrderBookDelta':
+        return OrderBookDelta(instr_id=orderbook.instr_id,
+                              seq=seq,
+                              bids=list(orderbook.bids),
+                              asks=list(orderbook.asks),
+                              snapshot=True,
+                              timestamp=orderbook.timestamp)
+
+    @staticmethod
+    def from_orderbooks(previous: OrderBook, orderbook: OrderBook,
+                        seq: int) -> 'OrderBookDelta':
+        return OrderBookDelta(instr_id=orderbook.instr_id,
+                              seq=seq,
+                              bids=_levels_delta(previous.bids,
+                                                 orderbook.bids),
+                              asks=_levels_delta(previous.asks,
+                                                 orderbook.asks),
+                              timestamp=orderbook.timestamp)
+
+    def to_orderbook(self) -> OrderBook:
+        return OrderBook(instr_id=self.instr_id,
+                         bids=[tuple(level) for level in self.bids],
+                         asks=[tuple(level) for level in self.asks],
+                         timestamp=self.timestamp)
+
+    def apply(self, orderbook: OrderBook) -> OrderBook:
+        """New OrderBook with the delta applied, orderbook is left untouched"""
+        return OrderBook(instr_id=self.instr_id,
+                         bids=_apply_levels(orderbook.bids,
+                                            self.bids,
+                                            reverse=True),
+                         asks=_apply_levels(orderbook.asks,
+                                            self.asks,
+                                            reverse=False),
+                         timestamp=self.timestamp)
+
+
+def instr_ids(instruments) -> set[int]:
+    """Instrument ids of a list of instruments or ids, None are ignored"""
+    return {
+        i if isinstance(i, int) else i.id
+        for i in instruments if i is not None
+    }
+
+
 @dataclass
 class AggrBook:
     """
@@ -659,11 +760,7 @@ class AggrBook:
         """
         tuple[float, float, InstrumentRedis]: (ask, asksize, instr)
         """
-        if not self.taker_buys:
-            return None, None, None
-        instr, ob = next(
-            filter(lambda x: x[0] not in excl_instrs, self.taker_buys),
-            (None, None))
+        instr, ob = self._best('taker_buys', excl_instrs)
         if instr is None:
             return None, None, None
         fee = (1 + instr.taker_fee.percent_value) if fees else 1
@@ -677,11 +774,7 @@ class AggrBook:
         """
         tuple[float, float, InstrumentRedis]: (bid, bidsize, instr)
         """
-        if not self.taker_sells:
-            return None, None, None
-        instr, ob = next(
-            filter(lambda x: x[0] not in excl_instrs, self.taker_sells),
-            (None, None))
+        instr, ob = self._best('taker_sells', excl_instrs)
         if instr is None:
             return None, None, None
         fee = (1 - instr.taker_fee.percent_value) if fees else 1
@@ -695,11 +788,7 @@ class AggrBook:
         """
         tuple[float, float, InstrumentRedis]: (bid, bidsize, instr)
         """
-        if not self.maker_buys:
-            return None, None, None
-        instr, ob = next(
-            filter(lambda x: x[0] not in excl_instrs, self.maker_buys),
-            (None, None))
+        instr, ob = self._best('maker_buys', excl_instrs)
         if instr is None:
             return None, None, None
         fee = (1 + instr.maker_fee.percent_value) if fees else 1
@@ -713,17 +802,23 @@ class AggrBook:
         """
         tuple[float, float, InstrumentRedis]: (ask, asksize, instr)
         """
-        if not self.maker_sells:
-            return None, None, None
-        instr, ob = next(
-            filter(lambda x: x[0] not in excl_instrs, self.maker_sells),
-            (None, None))
+        instr, ob = self._best('maker_sells', excl_instrs)
         if instr is None:
             return None, None, None
         fee = (1 - instr.maker_fee.percent_value) if fees else 1
         ask, asksize = ob.ask(limit)
         return ask * fee, asksize, instr
 
+    def _iter_side(self, side: str):
+        return getattr(self, side) or []
+
+    def _best(self, side: str,
+              excl_instrs) -> tuple[Instrument, OrderBook] | tuple[None, None]:
+        excl_ids = instr_ids(excl_instrs)
+        return next(
+            (x for x in self._iter_side(side) if x[0].id not in excl_ids),
+            (None, None))
+
     def hit_hit_spread(self, fees=True, excl_buys=[], excl_sells=[]):
         buy_side = self.taker_buy(fees=fees, excl_instrs=excl_buys)
         sell_side = self.taker_sell(fees=fees, excl_instrs=excl_sells)
@@ -788,7 +883,10 @@ class AggrBook:
             self.__update_maker_sell()
 
     def get_currency_rate(self, instr: Instrument):
-        ob = self.currencies.get(instr.quote)
+        return self.get_quote_rate(instr.quote)
+
+    def get_quote_rate(self, quote: str):
+        ob = self.currencies.get(quote)
         return ob.mid() if ob else 1
 
     def __get_ob_up(self):
@@ -838,6 +936,126 @@ class AggrBook:
             self.maker_sells = []
 
 
+@dataclass
+class IncrAggrBook(AggrBook):
+    """
+    AggrBook keeping each side ordered, an update only repositions the
+    updated instrument instead of sorting every orderbook.
+
+    Instruments are indexed per quote currency: a currency rate scales every
+    price of a group the same way so it never changes the order inside the
+    group, groups are merged when querying using the current rates.
+    Sides skipped by an update (taker or maker False) are repositioned when
+    they are next queried. The taker_buys, ... lists are not maintained, use
+    taker_buy(), ...
+    """
+    # side: (price, fee, fee sign, best first is the highest price)
+    SIDES = {
+        'taker_buys': (ASK, 'taker_fee', 1, False),
+        'taker_sells': (BID, 'taker_fee', -1, True),
+        'maker_buys': (BID, 'maker_fee', 1, False),
+        'maker_sells': (ASK, 'maker_fee', -1, True),
+    }
+    TAKER_SIDES = ('taker_buys', 'taker_sells')
+    MAKER_SIDES = ('maker_buys', 'maker_sells')
+
+    def __post_init__(self):
+        super().__post_init__()
+        # ties are kept in arrival order like a stable sort
+        self._seqs: dict[int, int] = {}
+        # side: quote: sorted [(key, seq, instr_id)]
+        self._indexes: dict[str, dict[str, list]] = {
+            side: defaultdict(list)
+            for side in self.SIDES
+        }
+        # (side, instr_id): (quote, entry)
+        self._entries: dict[tuple[str, int], tuple[str, tuple]] = {}
+        # side: instr_ids updated without repositioning them in the side
+        self._dirty: dict[str, set[int]] = {side: set() for side in self.SIDES}
+
+    def update_aggrbook(self,
+                        instr: Instrument,
+                        orderbook: OrderBook,
+                        taker=True,
+                        maker=True):
+        if instr.base in self.currencies:
+            self.currencies[instr.base] = orderbook
+            return
+
+        self.orderbooks[orderbook.instr_id] = instr, orderbook
+        sides = self._sides(taker, maker)
+        self._reindex(instr, orderbook, sides)
+        for side, dirty in self._dirty.items():
+            if side in sides:
+                dirty.discard(orderbook.instr_id)
+            else:
+                dirty.add(orderbook.instr_id)
+        self.timestamp = orderbook.timestamp
+
+    def compute_aggrbook(self, taker=True, maker=True):
+        sides = self._sides(taker, maker)
+        for side in sides:
+            self._indexes[side].clear()
+            self._dirty[side].clear()
+        self._entries = {
+            k: v
+            for k, v in self._entries.items() if k[0] not in sides
+        }
+        for instr, orderbook in self.orderbooks.values():
+            self._reindex(instr, orderbook, sides)
+
+    def _sides(self, taker: bool, maker: bool) -> tuple[str]:
+        return ((self.TAKER_SIDES if taker else ()) +
+                (self.MAKER_SIDES if maker else ()))
+
+    def _key(self, side: str, instr: Instrument, orderbook: OrderBook):
+        price_side, fee, sign, reverse = self.SIDES[side]
+        price, _ = orderbook.ask() if price_side == ASK else orderbook.bid()
+        key = price * (1 + sign * getattr(instr, fee).percent_value)
+        return -key if reverse else key
+
+    def _reindex(self, instr: Instrument, orderbook: OrderBook, sides):
+        instr_id = orderbook.instr_id
+        seq = self._seqs.setdefault(instr_id, len(self._seqs))
+        # compute every key first, a broken book leaves the indexes untouched
+        entries = [(side, (self._key(side, instr, orderbook), seq, instr_id))
+                   for side in sides]
+        for side, entry in entries:
+            old = self._entries.get((side, instr_id))
+            if old is not None:
+                quote, old_entry = old
+                index = self._indexes[side][quote]
+                del index[bisect_left(index, old_entry)]
+            insort(self._indexes[side][instr.quote], entry)
+            self._entries[(side, instr_id)] = (instr.quote, entry)
+
+    def _iter_side(self, side: str):
+        dirty = self._dirty[side]
+        while dirty:
+            instr_id = next(iter(dirty))
+            self._reindex(*self.orderbooks[instr_id], (side, ))
+            dirty.discard(instr_id)
+
+        groups = self._indexes[side]
+        if len(groups) == 1:
+            entries = next(iter(groups.values()))
+        else:
+            entries = heapq.merge(*[
+                self._scaled(index, self.get_quote_rate(quote))
+                for quote, index in groups.items()
+            ])
+
+        for _, _, instr_id in entries:
+            instr, orderbook = self.orderbooks[instr_id]
+            if instr.status.l2_book == StatusEnum.UP:
+                yield instr, orderbook
+
+    @staticmethod
+    def _scaled(index: list, rate: float):
+        for key, seq, instr_id in index:
+            yield key * rate, seq, instr_id
+
+
 @dataclass
 class AggrFundingRate:
     funding_rates: defaultdict[Instrument, FundingRate] = field(
@@ -1005,6 +1223,13 @@ class Candle:
             self.time, self.open, self.high, self.low, self.close, self.volume
         ]
 
+    @property
+    def timeframe(self) -> Optional[float]:
+        """Seconds covered, None without end_time"""
+        if self.end_time is None:
+            return None
+        return (self.end_time - self.time).total_seconds()
+
 
 @dataclass
 class Position:
@@ -35,13 +35,16 @@ INSTRUMENT_STATUS = 'instrument_status'
 EXCHANGE_STATUS = 'exchange_status'
 BOOK = 'book'
 ORDERBOOK = 'orderbook'
+L2_SNAPSHOT = 'l2_snapshot'
 BALANCE = 'balance'
 BALANCES = 'balances'
 POSITION = 'position'
 POSITIONS = 'positions'
 ORDERBOOK_UPDATE = 'orderbook_update'
+ORDERBOOK_DELTA = 'orderbook_delta'
 TRADE_UPDATE = 'trade_update'
 CANDLE_UPDATE = 'candle_update'
+CANDLE_BAR = 'candle_bar'
 LIQUIDATION_UPDATE = 'liquidation_update'
 BALANCE_UPDATE = 'balance_update'
 POSITION_UPDATE = 'position_update'
@@ -2,6 +2,7 @@ from datetime import datetime
 from dataclasses import dataclass
 
 from db_handler.wrapper import DBWrapper
+from db_handler.referential import get_referential
 from arb_defines.arb_dataclasses import Instrument
 
 
@@ -26,7 +27,8 @@ class InstrInfos:
             self.contract_types = [t.lower() for t in self.contract_types]
 
     def get_from_db(self, **kwargs) -> list[Instrument]:
-        db_wrapper = DBWrapper()
+        # local referential cache when available
+        db_wrapper = get_referential() or DBWrapper()
         instrs = db_wrapper.get_instruments(
             kwargs.get('bases', self.bases),
             kwargs.get('quotes', self.quotes),
@@ -41,7 +43,7 @@ class InstrInfos:
 
 
 def resolve_instruments_from_ids(instr_ids) -> list[Instrument]:
-    db_wrapper = DBWrapper()
+    db_wrapper = get_referential() or DBWrapper()
     return db_wrapper.get_instruments_with_ids(instr_ids)
 
 
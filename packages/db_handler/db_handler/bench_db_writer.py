@@ -0,0 +1,99 @@
+import time
+import uuid
+
+from datetime import datetime, timezone
+from argparse import ArgumentParser
+
+from arb_logger.logger import get_logger
+from db_handler.handler import DBHandler
+from db_handler.models import InstrumentModel, OrderModel, TradeExecModel
+
+LOGGER = get_logger('bench_db_writer', short=True)
+BENCH_PREFIX = 'bench_db_writer'
+
+
+def make_rows(instr_id: int, rows: int) -> tuple[list[dict], list[dict]]:
+    now = datetime.now(tz=timezone.utc)
+    orders, trades = [], []
+    for k in range(rows):
+        order_id = f'{BENCH_PREFIX}_{uuid.uuid4()}'
+        orders.append({
+            'id': order_id,
+            'time': now,
+            'instr_id': instr_id,
+            'exchange_order_id': order_id,
+            'order_type': 'limit',
+            'price': 100. + k,
+            'qty': 1.,
+            'order_status': 'filled',
+        })
+        trades.append({
+            'id': order_id,
+            'time': now,
+            'exchange_order_id': order_id,
+            'instr_id': instr_id,
+            'qty': 1.,
+            'price': 100. + k,
+            'fee': 0.01,
+            'order_type': 'limit',
+        })
+    return orders, trades
+
+
+def bench_single(db_handler: DBHandler, orders: list[dict],
+                 trades: list[dict]) -> float:
+    """Previous behaviour: one autocommit insert per event"""
+    start = time.perf_counter()
+    for order, trade in zip(orders, trades):
+        db_handler.db_wrapper.create_order(dict(order))
+        db_handler.db_wrapper.create_trade_exec(dict(trade))
+    return time.perf_counter() - start
+
+
+def bench_batched(db_handler: DBHandler, orders: list[dict],
+                  trades: list[dict]) -> float:
+    start = time.perf_counter()
+    for k in range(0, len(orders), db_handler.flush_rows):
+        db_handler._orders = orders[k:k + db_handler.flush_rows]
+        db_handler._trades_exec = trades[k:k + db_handler.flush_rows]
+        db_handler.flush()
+    return time.perf_counter() - start
+
+
+def clean():
+    TradeExecModel.delete().where(
+        TradeExecModel.id.startswith(BENCH_PREFIX)).execute()
+    OrderModel.delete().where(
+        OrderModel.id.startswith(BENCH_PREFIX)).execute()
+
+
+def main():
+    parser = ArgumentParser(
+        description='Rows/s written by DBHandler, one insert per event vs '
+        'batched COPY, against the local database. Rows are deleted after.')
+    parser.add_argument('-n', '--rows', type=int, default=5000)
+    parser.add_argument('--flush-rows', type=int, default=500)
+    parser.add_argument('--async-commit',
+                        action='store_true',
+                        help='batched writes without synchronous commit')
+    args = parser.parse_args()
+
+    instr_id = InstrumentModel.select(InstrumentModel.id).first().id
+    db_handler = DBHandler(flush_rows=args.flush_rows,
+                           synchronous_commit=not args.async_commit)
+    try:
+        single = bench_single(db_handler, *make_rows(instr_id, args.rows))
+        batched = bench_batched(db_handler, *make_rows(instr_id, args.rows))
+    finally:
+        clean()
+
+    # an order and a trade per event
+    rows = 2 * args.rows
+    LOGGER.info(f'{"mode":<10}{"rows":>8}{"seconds":>10}{"rows/s":>10}')
+    for mode, seconds in [('single', single), ('batched', batched)]:
+        LOGGER.info(f'{mode:<10}{rows:>8}{seconds:>10.2f}'
+                    f'{rows / seconds:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import os
+import time
+import tempfile
+import statistics
+import multiprocessing
+
+from argparse import ArgumentParser
+
+from arb_logger.logger import get_logger
+from arb_defines.defines import LINEAR
+from arb_defines.arb_dataclasses import Exchange, Fee, Instrument
+from db_handler.referential import REFERENTIAL_PATH, Referential
+
+LOGGER = get_logger('bench_referential', short=True)
+
+
+def synthetic_referential(instruments: int) -> Referential:
+    exchanges = [Exchange(id=k, feed_name=f'EXCHANGE{k}',
+                          exchange_name=f'exchange{k}') for k in range(20)]
+    fees = [Fee(id=k, exchange=e) for k, e in enumerate(exchanges)]
+    return Referential.from_instruments(exchanges, fees, [
+        Instrument(id=k,
+                   exchange=exchanges[k % 20],
+                   instr_code=f'CODE{k}',
+                   base=f'BASE{k // 20}',
+                   quote='USDT',
+                   instr_type='perpetual',
+                   contract_type=LINEAR,
+                   maker_fee=fees[k % 20],
+                   taker_fee=fees[k % 20],
+                   instr_status='active',
+                   feed_code=f'BASE{k // 20}-USDT-PERP')
+        for k in range(instruments)
+    ])
+
+
+def startup(mode: str, path: str, bases: list[str]) -> float:
+    """Seconds to resolve instruments as a process starting"""
+    start = time.perf_counter()
+    if mode == 'db':
+        from db_handler.wrapper import DBWrapper
+        DBWrapper().get_instruments(bases, ['USDT'])
+    else:
+        Referential.load(path).get_instruments(bases, ['USDT'])
+    return time.perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser(
+        description='Startup time to resolve instruments from the db or '
+        'from the local referential cache, with processes starting at once')
+    parser.add_argument('--mode', choices=['db', 'cache'], default='cache')
+    parser.add_argument('--path',
+                        default=None,
+                        help=f'cache to read, default {REFERENTIAL_PATH}')
+    parser.add_argument('--synthetic',
+                        type=int,
+                        default=0,
+                        metavar='N',
+                        help='benchmark a generated cache of N instruments')
+    parser.add_argument('--bases', nargs='+', default=['BTC', 'ETH'])
+    parser.add_argument('-p', '--processes', type=int, default=40)
+    args = parser.parse_args()
+
+    path = args.path or REFERENTIAL_PATH
+    if args.synthetic:
+        path = os.path.join(tempfile.mkdtemp(), 'referential.pickle')
+        synthetic_referential(args.synthetic).save(path)
+        args.bases = ['BASE1', 'BASE2']
+
+    with multiprocessing.get_context('spawn').Pool(args.processes) as pool:
+        start = time.perf_counter()
+        durations = pool.starmap(startup, [(args.mode, path, args.bases)] *
+                                 args.processes)
+        wall = time.perf_counter() - start
+    if args.synthetic:
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+
+    durations.sort()
+    LOGGER.info(f'{args.mode}: {args.processes} processes, '
+                f'p50 {statistics.median(durations) * 1e3:.1f}ms '
+                f'max {durations[-1] * 1e3:.1f}ms, wall {wall:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,21 @@
+import sys
 import atexit
+import signal
 
 from db_handler.handler import DBHandler
 
 
 def db_handler_invoke():
     db_handler = DBHandler()
-    db_handler.run()
 
-    def clean_exit(sig=None, frame=None):
-        # idk if it works actually
-        nonlocal db_handler
+    def clean_exit():
         db_handler.kill()
-        del db_handler
 
+    # registered before run which never returns, buffered rows are written
+    # on exit, SIGTERM exits through sys.exit so atexit runs
     atexit.register(clean_exit)
+    signal.signal(signal.SIGTERM, lambda sig, frame: sys.exit(0))
+    db_handler.run()
 
 
 def main():
@@ -1,15 +1,34 @@
+import os
+import time
+import threading
+import traceback
+
+from typing import Callable
 from dataclasses import asdict
 
 from arb_logger.logger import get_logger
 from db_handler.wrapper import DBWrapper
 from redis_manager.redis_handler import RedisHandler
-from arb_defines.arb_dataclasses import Balance, Order, Position, StrategyInfo, Trade
-from redis_manager.redis_events import BalanceEvent, OrderDBEvent, OrderEvent, OrderExchangeEvent, PositionEvent, StrategyInfoDBEvent, TradeExecEvent
+from arb_defines.arb_dataclasses import Balance, Latency, Order, Position, StrategyInfo, Trade
+from redis_manager.redis_events import BalanceEvent, LatencyDBEvent, OrderDBEvent, OrderEvent, OrderExchangeEvent, PositionEvent, StrategyInfoDBEvent, TradeExecEvent
+
+# buffered rows are written in one transaction when a buffer reaches
+# DB_FLUSH_ROWS rows or DB_FLUSH_SECONDS after the last flush
+DB_FLUSH_ROWS = int(os.getenv('ARB_DB_FLUSH_ROWS', '500'))
+DB_FLUSH_SECONDS = float(os.getenv('ARB_DB_FLUSH_SECONDS', '1'))
+# off: commits do not wait for the WAL to be on disk, a postgres crash can
+# lose the last flushes (never half of one)
+DB_SYNCHRONOUS_COMMIT = os.getenv('ARB_DB_SYNCHRONOUS_COMMIT', 'on') != 'off'
+# connection pool usage is logged every N seconds
+POOL_STATS_SECONDS = 60
 
 
 class DBHandler:
 
-    def __init__(self):
+    def __init__(self,
+                 flush_rows: int = DB_FLUSH_ROWS,
+                 flush_seconds: float = DB_FLUSH_SECONDS,
+                 synchronous_commit: bool = DB_SYNCHRONOUS_COMMIT):
         self.logger = get_logger(self.__class__.__name__, short=True)
         self.db_wrapper = DBWrapper(logger=self.logger)
         self.redis_handler: RedisHandler = RedisHandler(logger=self.logger)
@@ -17,6 +36,25 @@ class DBHandler:
         self._trades = []
         self._trades_len_limit = 300
 
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.synchronous_commit = synchronous_commit
+        self._buffer_lock = threading.Lock()
+        # flushes are serialized, the writer thread and kill may both flush
+        self._flush_lock = threading.Lock()
+        self._flush_needed = threading.Event()
+        self._orders: list[dict] = []
+        self._order_updates: list[dict] = []
+        self._trades_exec: list[dict] = []
+        self._strategy_infos: list[dict] = []
+        self._latencies: list[dict] = []
+        # only the latest position or balance of a key matters
+        self._positions: dict[int, dict] = {}
+        self._balances: dict[tuple, dict] = {}
+        self._writer = threading.Thread(target=self._write_loop,
+                                        name='db_writer',
+                                        daemon=True)
+
     def run(self):
         # we will not record these two in db because it will be too much data
         # keeping it in case we need to cherry save some later?
@@ -36,26 +74,103 @@ class DBHandler:
                                             self._on_order_db_event)
         self.redis_handler.subscribe_event(StrategyInfoDBEvent,
                                            self._on_strategy_info_db_event)
+        self.redis_handler.psubscribe_event(LatencyDBEvent,
+                                            self._on_latency_db_event)
 
+        self._writer.start()
         self.redis_handler.run()
 
     def kill(self):
         self.logger.info('kill, cleaning up, inserting missing data')
         self._insert_trades()
+        self.flush()
+
+    def _append(self, buffer: list[dict], row: dict):
+        with self._buffer_lock:
+            buffer.append(row)
+            size = len(buffer)
+        if size >= self.flush_rows:
+            self._flush_needed.set()
+
+    def _write_loop(self):
+        stats_time = time.time()
+        while True:
+            self._flush_needed.wait(self.flush_seconds)
+            self._flush_needed.clear()
+            try:
+                self.flush()
+            except Exception:
+                self.logger.error(traceback.format_exc())
+            if time.time() - stats_time >= POOL_STATS_SECONDS:
+                stats_time = time.time()
+                self.logger.info(f'db pool {self.db_wrapper.pool_stats()}')
+
+    def flush(self):
+        """Write all buffered rows in one transaction"""
+        with self._flush_lock:
+            with self._buffer_lock:
+                batches = [
+                    # orders before the updates which may target them
+                    (self._orders, self.db_wrapper.bulk_create_orders,
+                     self.db_wrapper.create_order),
+                    (self._order_updates,
+                     self.db_wrapper.bulk_create_or_update_orders,
+                     self.db_wrapper.create_or_update_order),
+                    (self._trades_exec,
+                     self.db_wrapper.bulk_create_trade_execs,
+                     self.db_wrapper.create_trade_exec),
+                    (self._strategy_infos,
+                     self.db_wrapper.bulk_create_strategy_infos,
+                     self.db_wrapper.create_strategy_info),
+                    (self._latencies, self.db_wrapper.bulk_create_latencies,
+                     self.db_wrapper.create_latency),
+                    (list(self._positions.values()),
+                     self.db_wrapper.bulk_create_or_update_positions,
+                     self.db_wrapper.create_or_update_position),
+                    (list(self._balances.values()),
+                     self.db_wrapper.bulk_create_or_update_balances,
+                     self.db_wrapper.create_or_update_balance),
+                ]
+                self._orders = []
+                self._order_updates = []
+                self._trades_exec = []
+                self._strategy_infos = []
+                self._latencies = []
+                self._positions = {}
+                self._balances = {}
+
+            batches = [batch for batch in batches if batch[0]]
+            if not batches:
+                return
+            try:
+                with self.db_wrapper.atomic(self.synchronous_commit):
+                    for rows, bulk_write, _ in batches:
+                        # bulk writers may drop keys of the rows
+                        bulk_write([dict(row) for row in rows])
+            except Exception:
+                self.logger.error('bulk write failed, writing rows one by '
+                                  f'one: {traceback.format_exc()}')
+                for rows, _, write in batches:
+                    self._write_rows(rows, write)
+
+    def _write_rows(self, rows: list[dict], write: Callable):
+        """Write rows one per transaction, rows failing are dropped"""
+        for row in rows:
+            try:
+                with self.db_wrapper.atomic(self.synchronous_commit):
+                    write(dict(row))
+            except Exception as e:
+                self.logger.error(f'dropping {row}: {e}')
 
     def _on_order_exchange_event(self, order: Order):
-        order = asdict(order)
-        self.db_wrapper.create_order(order)
+        self._append(self._orders, asdict(order))
 
     def _on_order_db_event(self, order: Order):
-        self.logger.info(f'{type(order)}')
-        self.logger.info(f'order: {order}')
-        order = asdict(order)
-        self.db_wrapper.create_or_update_order(order)
+        self.logger.debug(f'order: {order}')
+        self._append(self._order_updates, asdict(order))
 
     def _on_trade_exec_event(self, trade: Trade):
-        trade = asdict(trade)
-        self.db_wrapper.create_trade_exec(trade)
+        self._append(self._trades_exec, asdict(trade))
 
     def _on_trade_event(self, trade: Trade):
         trade = asdict(trade)
@@ -71,16 +186,31 @@ class DBHandler:
             self._insert_trades()
 
     def _on_strategy_info_db_event(self, strategy_info: StrategyInfo):
-        strategy_info = asdict(strategy_info)
-        self.db_wrapper.create_strategy_info(strategy_info)
+        self._append(self._strategy_infos, asdict(strategy_info))
+
+    def _on_latency_db_event(self, latency: Latency):
+        latency = asdict(latency)
+        if latency['id'] is None:
+            # generated by the database
+            del latency['id']
+        self._append(self._latencies, latency)
 
     def _on_position_event(self, position: Position):
         position = asdict(position)
-        self.db_wrapper.create_or_update_position(position)
+        with self._buffer_lock:
+            self._positions[position['instr_id']] = position
+            size = len(self._positions)
+        if size >= self.flush_rows:
+            self._flush_needed.set()
 
     def _on_balance_event(self, balance: Balance):
         balance = asdict(balance)
-        self.db_wrapper.create_or_update_balance(balance)
+        with self._buffer_lock:
+            self._balances[balance['exchange_id'],
+                           balance['currency']] = balance
+            size = len(self._balances)
+        if size >= self.flush_rows:
+            self._flush_needed.set()
 
     def _insert_trades(self):
         self.logger.debug(f'bulk inserting {len(self._trades)} trades')
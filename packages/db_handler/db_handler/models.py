@@ -1,31 +1,149 @@
+import os
+import time
+import threading
+
 from peewee import *
 from playhouse.postgres_ext import *
-
-#! NOT USING POOLED DB FOR NOW BECAUSE IT KEEP A CONNECTION OPEN ALL THE TIME (can't close it using db.close())
-# from playhouse.pool import PooledPostgresqlDatabase
-# database = PooledPostgresqlDatabase(
-#     'arb_trops_db',
-#     **{
-#         'host': 'localhost',
-#         'user': 'arb_trops',
-#         'password': 'root'
-#     },
-#     autorollback=True,
-#     max_connections=8,
-#     stale_timeout=300,
-# )
-
-
-def get_database():
-    return PostgresqlDatabase(
-        'arb_trops_db',
-        **{
-            'host': 'localhost',
-            'user': 'arb_trops',
-            'password': 'root'
-        },
-        autorollback=True,
-    )
+from playhouse.pool import MaxConnectionsExceeded, PooledPostgresqlDatabase
+
+# connections of the process wide pool, a thread keeps its connection until
+# it closes the database
+DB_POOL_SIZE = int(os.getenv('ARB_DB_POOL_SIZE', '8'))
+# seconds to wait for a free connection when all are in use
+DB_POOL_TIMEOUT = float(os.getenv('ARB_DB_POOL_TIMEOUT', '10'))
+# connections are recycled after this many seconds
+DB_POOL_STALE_SECONDS = int(os.getenv('ARB_DB_POOL_STALE_SECONDS', '300'))
+# idle connections are pinged before reuse after this many seconds
+DB_HEALTH_CHECK_SECONDS = float(
+    os.getenv('ARB_DB_HEALTH_CHECK_SECONDS', '30'))
+
+
+class ArbPooledDatabase(PooledPostgresqlDatabase):
+    """
+    Pool with health checks of idle connections, prepared statements kept
+    per connection, and checkout statistics.
+    """
+
+    def __init__(self, *args, health_check_seconds: float, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_seconds = health_check_seconds
+        self._local = threading.local()
+        # statistics and prepared statements, peewee 3.14 pools have no lock
+        self._stats_lock = threading.Lock()
+        # connection key -> (connection, names of its prepared statements)
+        self._prepared: dict[int, tuple] = {}
+        self._idle_since: dict[int, float] = {}
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_seconds': 0.,
+            'max_wait_seconds': 0.,
+            'health_check_failures': 0,
+        }
+
+    def connect(self, reuse_if_open=False):
+        self._local.waited = False
+        start = time.monotonic()
+        result = super().connect(reuse_if_open)
+        wait = time.monotonic() - start
+        with self._stats_lock:
+            self._stats['checkouts'] += 1
+            if self._local.waited:
+                self._stats['waits'] += 1
+                self._stats['wait_seconds'] += wait
+                self._stats['max_wait_seconds'] = max(
+                    self._stats['max_wait_seconds'], wait)
+        return result
+
+    def _connect(self):
+        try:
+            return super()._connect()
+        except MaxConnectionsExceeded:
+            self._local.waited = True
+            raise
+
+    def _is_closed(self, conn):
+        if super()._is_closed(conn):
+            return True
+        idle_since = self._idle_since.pop(self.conn_key(conn), None)
+        if (idle_since is None
+                or time.time() - idle_since < self.health_check_seconds):
+            return False
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return False
+        except Exception:
+            with self._stats_lock:
+                self._stats['health_check_failures'] += 1
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return True
+
+    def _close(self, conn, close_conn=False):
+        super()._close(conn, close_conn)
+        if not close_conn and not conn.closed:
+            self._idle_since[self.conn_key(conn)] = time.time()
+
+    def execute_prepared(self, name: str, sql: str, params: tuple):
+        """
+        Execute sql, with $1, $2... placeholders, as the prepared statement
+        name. It is prepared once per connection.
+        """
+        conn = self.connection()
+        key = self.conn_key(conn)
+        with self._stats_lock:
+            if self._prepared.get(key, (None, ))[0] is not conn:
+                # forget connections closed since
+                for k, (c, _) in list(self._prepared.items()):
+                    if c.closed:
+                        del self._prepared[k]
+                self._prepared[key] = (conn, set())
+            prepared = self._prepared[key][1]
+        if name not in prepared:
+            self.execute_sql(f'PREPARE {name} AS {sql}')
+            prepared.add(name)
+        placeholders = ', '.join([self.param] * len(params))
+        return self.execute_sql(f'EXECUTE {name}({placeholders})', params)
+
+    def pool_stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                'max_connections': self._max_connections,
+                'in_use': len(self._in_use),
+                'idle': len(self._connections),
+                'prepared_statements':
+                sum(len(names) for _, names in self._prepared.values()),
+                **self._stats,
+            }
+
+
+_database = None
+_database_lock = threading.Lock()
+
+
+def get_database() -> ArbPooledDatabase:
+    """Process wide pooled database"""
+    global _database
+    with _database_lock:
+        if _database is None:
+            _database = ArbPooledDatabase(
+                'arb_trops_db',
+                **{
+                    'host': 'localhost',
+                    'user': 'arb_trops',
+                    'password': 'root'
+                },
+                autorollback=True,
+                max_connections=DB_POOL_SIZE,
+                timeout=DB_POOL_TIMEOUT,
+                stale_timeout=DB_POOL_STALE_SECONDS,
+                health_check_seconds=DB_HEALTH_CHECK_SECONDS,
+            )
+        return _database
 
 
 class UnknownField(object):
@@ -39,10 +157,6 @@ class BaseModel(Model):
     class Meta:
         database = get_database()
 
-    def __del__(self):
-        # explicitly close the connection
-        self._meta.database.close()
-
 
 class ExchangeModel(BaseModel):
     exchange_name = CharField()
@@ -123,6 +237,15 @@ class LatencyModel(BaseModel):
     time = DateTimeField()
     event_id = UUIDField()
     event_type = CharField()
+    instr_id = IntegerField(null=True)
+    stage = CharField(null=True)
+    count = IntegerField(null=True)
+    mean_us = DoubleField(null=True)
+    p50_us = DoubleField(null=True)
+    p90_us = DoubleField(null=True)
+    p99_us = DoubleField(null=True)
+    max_us = DoubleField(null=True)
+    buckets = BinaryJSONField(null=True)
 
     class Meta:
         table_name = 'latencies'
@@ -0,0 +1,258 @@
+import os
+import time
+import pickle
+import hashlib
+import pathlib
+
+from typing import Optional
+from dataclasses import fields
+from datetime import datetime, timezone
+
+from arb_logger.logger import get_logger
+from arb_defines.defines import LINEAR
+from arb_defines.arb_dataclasses import Exchange, Fee, Instrument
+
+LOGGER = get_logger('referential', short=True)
+
+# local copy of the referential written by load_codes
+REFERENTIAL_PATH = os.getenv(
+    'ARB_REFERENTIAL_CACHE',
+    str(pathlib.Path.home() / '.cache' / 'arb_trops' / 'referential.pickle'))
+# older caches are ignored, load_codes runs daily
+REFERENTIAL_MAX_AGE_HOURS = float(
+    os.getenv('ARB_REFERENTIAL_MAX_AGE_HOURS', '36'))
+# layout of the file, bumped when Referential changes
+REFERENTIAL_FORMAT = 1
+# unknown codes are not looked up again in the db for this long
+UNKNOWN_CODE_SECONDS = 60
+
+
+# instruments are stored as rows of their fields, exchange and fees by id,
+# much faster to load than the dataclasses
+INSTR_FIELDS = tuple(f.name for f in fields(Instrument))
+_ID = INSTR_FIELDS.index('id')
+_EXCHANGE = INSTR_FIELDS.index('exchange')
+_MAKER_FEE = INSTR_FIELDS.index('maker_fee')
+_TAKER_FEE = INSTR_FIELDS.index('taker_fee')
+_INSTR_CODE = INSTR_FIELDS.index('instr_code')
+_FEED_CODE = INSTR_FIELDS.index('feed_code')
+_BASE = INSTR_FIELDS.index('base')
+_QUOTE = INSTR_FIELDS.index('quote')
+_INSTR_TYPE = INSTR_FIELDS.index('instr_type')
+_CONTRACT_TYPE = INSTR_FIELDS.index('contract_type')
+_INSTR_STATUS = INSTR_FIELDS.index('instr_status')
+
+
+def _instr_row(instr: Instrument) -> tuple:
+    row = [getattr(instr, name) for name in INSTR_FIELDS]
+    for k in [_EXCHANGE, _MAKER_FEE, _TAKER_FEE]:
+        row[k] = row[k].id if row[k] is not None else None
+    return tuple(row)
+
+
+class Referential:
+    """
+    Exchanges, fees and instruments of every status with O(1) lookups by
+    id, instr_code and (exchange_id, feed_code). Instruments are built on
+    first access.
+    """
+
+    def __init__(self,
+                 exchanges: list[Exchange],
+                 fees: list[Fee],
+                 instr_rows: list[tuple],
+                 built: Optional[datetime] = None,
+                 version: Optional[str] = None):
+        self.exchanges: dict[int, Exchange] = {e.id: e for e in exchanges}
+        self.fees: dict[int, Fee] = {f.id: f for f in fees}
+        self.rows: dict[int, tuple] = {row[_ID]: row for row in instr_rows}
+        self.built = built or datetime.now(tz=timezone.utc)
+        self.version = version
+        self._instruments: dict[int, Instrument] = {}
+        self.exchange_ids: dict[str, int] = {
+            e.feed_name: e.id
+            for e in self.exchanges.values()
+        }
+        self.instr_ids: dict[str, int] = {
+            row[_INSTR_CODE]: row[_ID]
+            for row in self.rows.values()
+        }
+        self.feed_code_ids: dict[tuple[int, str], int] = {
+            (row[_EXCHANGE], row[_FEED_CODE]): row[_ID]
+            for row in self.rows.values()
+        }
+        # (exchange_id, feed_code) -> time it was not found in the db
+        self._unknown: dict[tuple[int, str], float] = {}
+
+    @classmethod
+    def from_instruments(cls, exchanges: list[Exchange], fees: list[Fee],
+                         instruments: list[Instrument]) -> 'Referential':
+        """Exchanges and fees of the instruments are added"""
+        exchanges = {e.id: e for e in exchanges}
+        fees = {f.id: f for f in fees}
+        for instr in instruments:
+            exchanges.setdefault(instr.exchange.id, instr.exchange)
+            for fee in [instr.maker_fee, instr.taker_fee]:
+                if fee is not None:
+                    fees.setdefault(fee.id, fee)
+        return cls(list(exchanges.values()), list(fees.values()),
+                   [_instr_row(i) for i in instruments])
+
+    @classmethod
+    def from_db(cls, db_wrapper) -> 'Referential':
+        return cls.from_instruments(db_wrapper.get_exchanges(),
+                                    db_wrapper.get_fees(),
+                                    db_wrapper.get_all_instruments())
+
+    @property
+    def age_hours(self) -> float:
+        return (datetime.now(tz=timezone.utc) -
+                self.built).total_seconds() / 3600
+
+    def _instrument(self, instr_id: int) -> Instrument:
+        instr = self._instruments.get(instr_id)
+        if instr is None:
+            kwargs = dict(zip(INSTR_FIELDS, self.rows[instr_id]))
+            kwargs['exchange'] = self.exchanges.get(kwargs['exchange'])
+            kwargs['maker_fee'] = self.fees.get(kwargs['maker_fee'])
+            kwargs['taker_fee'] = self.fees.get(kwargs['taker_fee'])
+            instr = self._instruments[instr_id] = Instrument(**kwargs)
+        return instr
+
+    def get_instrument(self, instr_id: int) -> Optional[Instrument]:
+        instr_id = int(instr_id)
+        return self._instrument(instr_id) if instr_id in self.rows else None
+
+    def get_instrument_from_code(self,
+                                 instr_code: str) -> Optional[Instrument]:
+        instr_id = self.instr_ids.get(instr_code)
+        return None if instr_id is None else self._instrument(instr_id)
+
+    def get_instrument_from_feed_code(
+            self, feed_code: str, exchange_id: int) -> Optional[Instrument]:
+        instr_id = self.feed_code_ids.get((exchange_id, feed_code))
+        return None if instr_id is None else self._instrument(instr_id)
+
+    def is_unknown(self, feed_code: str, exchange_id: int) -> bool:
+        """True if the code was recently not found in the db either"""
+        unknown_time = self._unknown.get((exchange_id, feed_code))
+        return (unknown_time is not None
+                and time.time() - unknown_time < UNKNOWN_CODE_SECONDS)
+
+    def set_unknown(self, feed_code: str, exchange_id: int):
+        self._unknown[exchange_id, feed_code] = time.time()
+
+    def add_instrument(self, instr: Instrument):
+        """Instrument found in the db after the cache was built"""
+        self.rows[instr.id] = _instr_row(instr)
+        self._instruments[instr.id] = instr
+        self.instr_ids[instr.instr_code] = instr.id
+        self.feed_code_ids[instr.exchange.id, instr.feed_code] = instr.id
+        self._unknown.pop((instr.exchange.id, instr.feed_code), None)
+
+    def get_instruments_with_ids(self, ids) -> list[Instrument]:
+        """Same as DBWrapper.get_instruments_with_ids"""
+        if not isinstance(ids, list):
+            ids = [ids]
+        ids = [int(id) for id in ids]
+        return [
+            self._instrument(id) for id in ids
+            if id in self.rows and self.rows[id][_INSTR_STATUS] == 'active'
+        ]
+
+    def get_instruments(self,
+                        base=None,
+                        quote=None,
+                        instr_type=None,
+                        exchange_name=None,
+                        contract_type=LINEAR,
+                        instr_status='active') -> list[Instrument]:
+        """Same filters as DBWrapper.get_instruments"""
+        if base and not isinstance(base, list):
+            base = [base]
+        if quote and not isinstance(quote, list):
+            quote = [quote]
+        if instr_type and not isinstance(instr_type, list):
+            instr_type = [instr_type]
+        if exchange_name and not isinstance(exchange_name, list):
+            exchange_name = [exchange_name]
+        if contract_type and not isinstance(contract_type, list):
+            contract_type = [contract_type]
+        exchange_ids = None
+        if exchange_name:
+            exchange_ids = set()
+            for name in exchange_name:
+                if name.upper() not in self.exchange_ids:
+                    raise ValueError(f'unknown exchange {name}')
+                exchange_ids.add(self.exchange_ids[name.upper()])
+
+        filters = [(_INSTR_STATUS, {instr_status})]
+        for k, values in [(_BASE, base), (_QUOTE, quote),
+                          (_INSTR_TYPE, instr_type), (_EXCHANGE, exchange_ids),
+                          (_CONTRACT_TYPE, contract_type)]:
+            if values:
+                filters.append((k, set(values)))
+        return [
+            self._instrument(row[_ID]) for row in self.rows.values()
+            if all(row[k] in values for k, values in filters)
+        ]
+
+    def save(self, path: str = REFERENTIAL_PATH):
+        """Written to a temporary file then renamed, readers never see a
+        partial file"""
+        state = {
+            'exchanges': list(self.exchanges.values()),
+            'fees': list(self.fees.values()),
+            'instr_rows': list(self.rows.values()),
+            'built': self.built,
+        }
+        data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        self.version = hashlib.sha1(data).hexdigest()[:12]
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as fd:
+            pickle.dump((REFERENTIAL_FORMAT, INSTR_FIELDS, self.version),
+                        fd,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+            fd.write(data)
+        os.replace(tmp_path, path)
+        LOGGER.info(f'referential {self.version} saved to {path}: '
+                    f'{len(self.exchanges)} exchanges, {len(self.fees)} '
+                    f'fees, {len(self.rows)} instruments')
+
+    @classmethod
+    def load(cls, path: str = REFERENTIAL_PATH) -> Optional['Referential']:
+        """None if missing, of another layout or too old"""
+        try:
+            with open(path, 'rb') as fd:
+                file_format, instr_fields, version = pickle.load(fd)
+                if (file_format != REFERENTIAL_FORMAT
+                        or instr_fields != INSTR_FIELDS):
+                    LOGGER.warning(f'referential {path} has another layout, '
+                                   'run load_codes --cache-only')
+                    return None
+                referential = cls(**pickle.load(fd), version=version)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            LOGGER.warning(f'cannot read referential {path}: {e}')
+            return None
+        if referential.age_hours > REFERENTIAL_MAX_AGE_HOURS:
+            LOGGER.warning(f'referential {path} built '
+                           f'{referential.age_hours:.0f}h ago, ignored')
+            return None
+        return referential
+
+
+_referential = None
+_referential_loaded = False
+
+
+def get_referential() -> Optional[Referential]:
+    """Referential of the process, loaded once, None without a usable cache"""
+    global _referential, _referential_loaded
+    if not _referential_loaded:
+        _referential = Referential.load()
+        _referential_loaded = True
+    return _referential
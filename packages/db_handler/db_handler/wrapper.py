@@ -1,12 +1,99 @@
-from peewee import prefetch
+import io
+import simplejson as json
+
+from contextlib import contextmanager
+
+from peewee import Model, prefetch
 from cryptofeed.defines import SPOT, BINANCE
 
 from arb_logger.logger import get_logger
 from arb_defines.defines import LINEAR
-from arb_defines.arb_dataclasses import Exchange, Fee, Instrument, Latency, Order, Trade, StrategyInfo
+from arb_defines.arb_dataclasses import ORDER_STATUS_PROGRESSION, Exchange, Fee, Instrument, Latency, Order, Trade, StrategyInfo
 from db_handler.models import BalanceModel, ExchangeModel, InstrumentModel, OrderModel, FeeModel, PositionModel, StrategyInfoModel, TradeExecModel, TradeModel, LatencyModel, get_database
 
 
+def _drop_keys(row: dict, *keys) -> dict:
+    for key in keys:
+        row.pop(key, None)
+    return row
+
+
+def _copy_text(value) -> str:
+    """Value in COPY text format"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, dict | list):
+        value = json.dumps(value, default=str)
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t').replace(
+        '\n', '\\n').replace('\r', '\\r'))
+
+
+def _merge_order(stored: dict, order: dict) -> dict:
+    """order row updating stored, same rules as _UPSERT_ORDERS_SQL"""
+    merged = dict(stored)
+    for key in [
+            'exchange_order_id', 'order_type', 'price', 'qty', 'event_type',
+            'event_key', 'time_open', 'time_ack_mkt', 'time_filled_mkt',
+            'time_cancel', 'time_canceled_mkt', 'time_rejected_mkt'
+    ]:
+        merged[key] = order.get(key) or stored.get(key)
+    if order.get('order_status') and stored.get('order_status'):
+        merged['order_status'] = Order.latest_status(order['order_status'],
+                                                     stored['order_status'])
+    else:
+        merged['order_status'] = (order.get('order_status')
+                                  or stored.get('order_status'))
+    merged['total_filled'] = max(order.get('total_filled') or 0,
+                                 stored.get('total_filled') or 0,
+                                 key=abs)
+    return merged
+
+
+# status rank is its position in ORDER_STATUS_PROGRESSION, 0 when unknown
+_STATUS_RANK = 'COALESCE(array_position($2::text[], lower({})), 0)'
+_UPSERT_ORDERS_SQL = f"""
+WITH new AS (
+    SELECT * FROM json_populate_recordset(NULL::orders, $1::json)
+), updated AS (
+    UPDATE orders o SET
+        exchange_order_id = COALESCE(n.exchange_order_id, o.exchange_order_id),
+        order_status = CASE
+            WHEN {_STATUS_RANK.format('n.order_status')}
+                >= {_STATUS_RANK.format('o.order_status')}
+            THEN COALESCE(lower(n.order_status), o.order_status)
+            ELSE o.order_status END,
+        order_type = COALESCE(NULLIF(n.order_type, ''), o.order_type),
+        price = COALESCE(NULLIF(n.price, 0), o.price),
+        qty = COALESCE(NULLIF(n.qty, 0), o.qty),
+        event_type = COALESCE(NULLIF(n.event_type, ''), o.event_type),
+        event_key = COALESCE(n.event_key, o.event_key),
+        time_open = COALESCE(n.time_open, o.time_open),
+        time_ack_mkt = COALESCE(n.time_ack_mkt, o.time_ack_mkt),
+        time_filled_mkt = COALESCE(n.time_filled_mkt, o.time_filled_mkt),
+        time_cancel = COALESCE(n.time_cancel, o.time_cancel),
+        time_canceled_mkt = COALESCE(n.time_canceled_mkt, o.time_canceled_mkt),
+        time_rejected_mkt = COALESCE(n.time_rejected_mkt, o.time_rejected_mkt),
+        total_filled = CASE
+            WHEN abs(COALESCE(n.total_filled, 0))
+                >= abs(COALESCE(o.total_filled, 0))
+            THEN COALESCE(n.total_filled, 0)
+            ELSE o.total_filled END
+    FROM new n
+    WHERE o.id = n.id OR o.exchange_order_id = n.exchange_order_id
+    RETURNING n.id
+)
+INSERT INTO orders SELECT * FROM new
+WHERE new.id NOT IN (SELECT id FROM updated)
+"""
+
+
+@contextmanager
+def _async_commit(database):
+    with database.atomic() as transaction:
+        database.execute_sql('SET LOCAL synchronous_commit TO OFF')
+        yield transaction
+
+
 class DBWrapper:
 
     def __init__(self, logger=None):
@@ -17,6 +104,19 @@ class DBWrapper:
         cursor = self.database.execute_sql(query, params)
         return cursor.fetchall()
 
+    def atomic(self, synchronous_commit: bool = True):
+        """
+        Transaction on the connection of the thread. Without synchronous
+        commit it returns before its WAL is flushed to disk: a server crash
+        can lose the last transactions, they are never half applied.
+        """
+        if synchronous_commit:
+            return self.database.atomic()
+        return _async_commit(self.database)
+
+    def pool_stats(self) -> dict:
+        return self.database.pool_stats()
+
     def create_exchange(self, exchange_name, feed_name):
         res = ExchangeModel.create(exchange_name=exchange_name,
                                    feed_name=feed_name)
@@ -78,7 +178,13 @@ class DBWrapper:
         return Instrument.from_model(res), is_new
 
     def get_all_instruments(self) -> list[InstrumentModel]:
-        return [Instrument.from_model(a) for a in InstrumentModel.select()]
+        # same joins as get_instruments, 2 queries in total
+        _instr_query = InstrumentModel.select(
+            InstrumentModel, ExchangeModel).join(ExchangeModel)
+        return [
+            Instrument.from_model(a)
+            for a in prefetch(_instr_query, FeeModel.select())
+        ]
 
     def get_instruments_with_ids(self, ids) -> list[InstrumentModel]:
         if not isinstance(ids, list):
@@ -265,60 +371,39 @@ class DBWrapper:
         return Order.from_model(res)
 
     def create_or_update_order(self, order: dict):
-        if 'instr' in order:
-            del order['instr']
-        if 'exchange_id' in order:
-            del order['exchange_id']
-
-        if order.get('id') and order.get('exchange_order_id'):
-            where_filter = (OrderModel.id == order.get('id')) | (
-                OrderModel.exchange_order_id == order.get('exchange_order_id'))
-        elif order.get('exchange_order_id'):
-            where_filter = OrderModel.exchange_order_id == order.get(
-                'exchange_order_id')
-        else:
-            where_filter = OrderModel.id == order.get('id')
-        order_db = OrderModel.get_or_none(where_filter)
-        if order_db is not None:
-            new_order = {
-                'exchange_order_id':
-                order.get('exchange_order_id', order_db.exchange_order_id),
-                'order_status':
-                Order.latest_status(order.get('order_status'),
-                                    order_db.order_status),
-                'order_type':
-                order.get('order_type') or order_db.order_type,
-                'price':
-                order.get('price') or order_db.price,
-                'qty':
-                order.get('qty') or order_db.qty,
-                'event_type':
-                order.get('event_type') or order_db.event_type,
-                'event_key':
-                order.get('event_key') or order_db.event_key,
-                'time_open':
-                order.get('time_open') or order_db.time_open,
-                'time_ack_mkt':
-                order.get('time_ack_mkt') or order_db.time_ack_mkt,
-                'time_filled_mkt':
-                order.get('time_filled_mkt') or order_db.time_filled_mkt,
-                'time_cancel':
-                order.get('time_cancel') or order_db.time_cancel,
-                'time_canceled_mkt':
-                order.get('time_canceled_mkt') or order_db.time_canceled_mkt,
-                'time_rejected_mkt':
-                order.get('time_rejected_mkt') or order_db.time_rejected_mkt,
-                'total_filled':
-                max(order.get('total_filled', 0),
-                    order_db.total_filled or 0,
-                    key=abs)
+        self.bulk_create_or_update_orders([order])
+
+    def bulk_create_or_update_orders(self, orders: list[dict]):
+        """
+        Insert the orders or merge them into the stored ones matching their
+        id or exchange_order_id, in one statement. orders is a hypertable
+        and updates of an order do not always carry its creation time, so
+        there is no unique index for an ON CONFLICT clause.
+        """
+        # an update statement can apply only one row to a stored order
+        merged: dict[str, dict] = {}
+        ids_by_exchange_order_id: dict[str, str] = {}
+        for order in orders:
+            row = {
+                field.column_name: order.get(field.column_name)
+                for field in OrderModel._meta.sorted_fields
             }
-            res = OrderModel.update(**new_order).where(where_filter).execute()
-
-            return res
-        else:
-            res = OrderModel.create(**order)
-            return Order.from_model(res)
+            row['id'] = str(row['id'])
+            key = row['id']
+            if key not in merged:
+                key = ids_by_exchange_order_id.get(row['exchange_order_id'],
+                                                   key)
+            if key in merged:
+                row = _merge_order(merged[key], row)
+            merged[key] = row
+            if row['exchange_order_id']:
+                ids_by_exchange_order_id[row['exchange_order_id']] = key
+        if not merged:
+            return
+        self.database.execute_prepared(
+            'arb_upsert_orders', _UPSERT_ORDERS_SQL,
+            (json.dumps(list(merged.values()), default=str),
+             ORDER_STATUS_PROGRESSION[1:]))
 
     def create_trade_exec(self, trade):
         if 'instr' in trade:
@@ -328,7 +413,7 @@ class DBWrapper:
         if 'trade_count' in trade:
             del trade['trade_count']
         res = TradeExecModel.create(**trade)
-        return TradeExecModel.from_model(res)
+        return Trade.from_model(res)
 
     def create_trade(self, trade):
         if 'instr' in trade:
@@ -341,6 +426,65 @@ class DBWrapper:
     def bulk_create_trades(self, trades):
         TradeModel.insert_many(trades).execute()
 
+    def copy_rows(self, model: Model, rows: list[dict]):
+        """
+        Insert rows with COPY, much faster than INSERT for append only tables.
+        Like Model.create, keys which are not fields are ignored and fields
+        with a python default get it when missing. Columns None in every row
+        are left out so they get their database default.
+        """
+        if not rows:
+            return
+        combined = model._meta.combined
+        fields = {
+            field.name: field
+            for field in model._meta.sorted_fields
+            if field.default is not None
+        }
+        for row in rows:
+            for key, value in row.items():
+                if value is not None and key in combined:
+                    fields.setdefault(combined[key].name, combined[key])
+
+        buffer = io.StringIO()
+        for row in rows:
+            values = []
+            for name, field in fields.items():
+                value = row.get(name, row.get(field.column_name))
+                if value is None and field.default is not None:
+                    value = (field.default()
+                             if callable(field.default) else field.default)
+                if value is not None and not isinstance(value, dict | list):
+                    value = field.db_value(value)
+                values.append(_copy_text(value))
+            buffer.write('\t'.join(values))
+            buffer.write('\n')
+        buffer.seek(0)
+
+        columns = ', '.join(f'"{f.column_name}"' for f in fields.values())
+        database = model._meta.database
+        with database.atomic():
+            cursor = database.cursor()
+            cursor.copy_expert(
+                f'COPY "{model._meta.table_name}" ({columns}) FROM STDIN',
+                buffer)
+
+    def bulk_create_orders(self, orders: list[dict]):
+        self.copy_rows(OrderModel,
+                       [_drop_keys(o, 'instr', 'exchange_id') for o in orders])
+
+    def bulk_create_trade_execs(self, trades: list[dict]):
+        self.copy_rows(TradeExecModel, [
+            _drop_keys(t, 'instr', 'exchange_id', 'trade_count')
+            for t in trades
+        ])
+
+    def bulk_create_strategy_infos(self, strategy_infos: list[dict]):
+        self.copy_rows(StrategyInfoModel, strategy_infos)
+
+    def bulk_create_latencies(self, latencies: list[dict]):
+        self.copy_rows(LatencyModel, latencies)
+
     def create_strategy_info(self, strategy_info):
         res = StrategyInfoModel.create(**strategy_info)
         return StrategyInfo.from_model(res)
@@ -366,3 +510,23 @@ class DBWrapper:
             conflict_target=[BalanceModel.exchange, BalanceModel.currency],
             preserve=[BalanceModel.currency, BalanceModel.qty]).execute()
         return exchange_id
+
+    def bulk_create_or_update_positions(self, positions: list[dict]):
+        """One upsert, at most one position per instrument"""
+        if not positions:
+            return
+        PositionModel.insert_many(positions).on_conflict(
+            conflict_target=[PositionModel.instr_id],
+            preserve=[
+                PositionModel.instr,
+                PositionModel.qty,
+                PositionModel.price,
+            ]).execute()
+
+    def bulk_create_or_update_balances(self, balances: list[dict]):
+        """One upsert, at most one balance per exchange and currency"""
+        if not balances:
+            return
+        BalanceModel.insert_many(balances).on_conflict(
+            conflict_target=[BalanceModel.exchange, BalanceModel.currency],
+            preserve=[BalanceModel.currency, BalanceModel.qty]).execute()
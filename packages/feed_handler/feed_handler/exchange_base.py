@@ -11,7 +11,9 @@ from cryptofeed.defines import L2_BOOK, TRADES, FUNDING, LIQUIDATIONS, ORDER_INF
 
 from arb_logger.logger import get_logger
 from arb_defines.arb_dataclasses import Instrument
+from db_handler.models import InstrumentModel
 from db_handler.wrapper import DBWrapper
+from db_handler.referential import Referential, get_referential
 from redis_manager.redis_manager import RedisManager
 
 
@@ -33,6 +35,7 @@ class ExchangeBase(ABC):
 
         self.feed: Feed = feed
         self.channels = channels
+        self._referential = None
 
         self._build_mapping(instruments)
         if not self.instruments:
@@ -50,6 +53,15 @@ class ExchangeBase(ABC):
                 f'{self.feed.id} has no callbacks found for {self.channels} channels'
             )
 
+    @property
+    def referential(self) -> Referential:
+        if self._referential is None:
+            # codes resolved from the db are added to it
+            self._referential = (get_referential()
+                                 or Referential.from_instruments(
+                                     [], [], self.instruments))
+        return self._referential
+
     def _build_mapping(self, instruments: list[Instrument]):
         self.feed_codes = []
         self.code_mapping = {}
@@ -101,8 +113,21 @@ class ExchangeBase(ABC):
         return self.redis_manager.get_instrument(instr_id)
 
     def _add_new_instr(self, feed_code: str) -> Instrument:
-        db = DBWrapper(logger=self.logger)
-        instr = db.get_instrument_from_feed_code(feed_code, self.exchange.id)
+        exchange_id = self._exchange_id
+        instr = self.referential.get_instrument_from_feed_code(
+            feed_code, exchange_id)
+        if instr is None:
+            # not in the db either a moment ago, do not query it per message
+            if self.referential.is_unknown(feed_code, exchange_id):
+                raise ValueError(f'unknown feed code {feed_code}')
+            db = DBWrapper(logger=self.logger)
+            try:
+                instr = db.get_instrument_from_feed_code(
+                    feed_code, exchange_id)
+            except InstrumentModel.DoesNotExist:
+                self.referential.set_unknown(feed_code, exchange_id)
+                raise ValueError(f'unknown feed code {feed_code}')
+            self.referential.add_instrument(instr)
         self.redis_manager.add_instrument(instr)
         self.code_mapping[feed_code] = instr.id
         return instr
@@ -85,7 +85,7 @@ class ExchangeWebsocket(ExchangeBase):
                        asks=asks,
                        timestamp=letimestamp)
 
-        instr.set_orderbook(ob)
+        instr.set_orderbook(ob, receipt_time=timestamp)
 
     async def on_trades_cb(self, trade, timestamp: float):
         # exchange: BINANCE_FUTURES symbol: BTC-USDT-PERP side: sell amount: 0.048 price: 38952.80 id: 1195950340 type: None timestamp: 1651660007.272 - (exchange_websocket.py:75)
@@ -100,7 +100,7 @@ class ExchangeWebsocket(ExchangeBase):
                       order_type=trade.type,
                       exchange_order_id=trade.id,
                       trade_count=self._get_trade_count(trade))
-        instr.set_last_trade(trade)
+        instr.set_last_trade(trade, receipt_time=timestamp)
 
     async def on_liquidations_cb(self, liquidation, timestamp):
         # exchange: BINANCE_FUTURES symbol: BTC-USDT-PERP side: buy quantity: 0.002 price: 39199.20 id: None status: filled timestamp: 1651665953.216
@@ -117,7 +117,7 @@ class ExchangeWebsocket(ExchangeBase):
                       time=liquidation.timestamp,
                       exchange_order_id=liquidation.id or 'liq',
                       is_liquidation=True)
-        instr.set_last_trade(trade, LiquidationEvent)
+        instr.set_last_trade(trade, LiquidationEvent, receipt_time=timestamp)
 
     async def on_candles_cb(self, _candle, timestamp: float):
         # exchange: BYBIT symbol: BTC-USDT-PERP start: 1681462500.0 stop: 1681462560.0 interval: 1m trades: True open: 30712.2 close: 30716.6 high: 30716.6 low: 30710 volume: 37.388 closed: False timestamp: 1681462560.321062
@@ -149,7 +149,7 @@ class ExchangeWebsocket(ExchangeBase):
                                    predicted_rate=predicted_rate,
                                    next_funding_time=next_funding_time,
                                    timestamp=timestamp)
-        instr.set_funding_rate(funding_rate)
+        instr.set_funding_rate(funding_rate, receipt_time=timestamp)
 
     def _get_rate(sefl, obj, instr):
         rate = float(obj.rate or 0)
@@ -43,6 +43,7 @@ class ExchangeWebsocketPro(ExchangeWebsocket):
                 self.logger.error(f'error on l2 book {instr.feed_code}: {e}')
                 continue
             else:
+                receipt_time = time.time()
                 instr = self.get_instr_from_code(orderbook['symbol'])
                 self._handle_status(instr, L2_BOOK)
 
@@ -55,7 +56,7 @@ class ExchangeWebsocketPro(ExchangeWebsocket):
                                asks=asks,
                                timestamp=letimestamp)
 
-                instr.set_orderbook(ob)
+                instr.set_orderbook(ob, receipt_time=receipt_time)
 
     async def on_trades_cb(self, instr):
         while True:
@@ -65,6 +66,7 @@ class ExchangeWebsocketPro(ExchangeWebsocket):
                 self.logger.error(f'error on trades {instr.feed_code}: {e}')
                 continue
             else:
+                receipt_time = time.time()
                 instr = self.get_instr_from_code(trades[0]['symbol'])
                 self._handle_status(instr, TRADES)
 
@@ -78,7 +80,7 @@ class ExchangeWebsocketPro(ExchangeWebsocket):
                                   order_type=trade['type'] or TAKER,
                                   exchange_order_id=trade['id'],
                                   trade_count=self._get_trade_count(trade))
-                    instr.set_last_trade(trade)
+                    instr.set_last_trade(trade, receipt_time=receipt_time)
 
     async def on_funding_cb(self, instr: Instrument):
         #! ONLY WORKS FOR BYBIT
@@ -1,6 +1,7 @@
 import argparse
 
 from db_handler.wrapper import DBWrapper
+from db_handler.referential import Referential
 from load_codes.base_loader import BaseLoader
 from load_codes.exchanges.okx_loader import OKXLoader
 from load_codes.exchanges.woo_loader import WooLoader
@@ -56,11 +57,15 @@ exchanges = [
 def loader(args):
     db_wrapper = DBWrapper()
 
-    for exchange in exchanges:
-        if args.exchanges is None or exchange.feed_code in args.exchanges:
-            e: BaseLoader = exchange(db_wrapper, args.bases, args.quotes,
-                                     args.types)
-            e.load_codes()
+    if not args.cache_only:
+        for exchange in exchanges:
+            if args.exchanges is None or exchange.feed_code in args.exchanges:
+                e: BaseLoader = exchange(db_wrapper, args.bases, args.quotes,
+                                         args.types)
+                e.load_codes()
+
+    # local copy used by resolvers and feed handlers instead of the db
+    Referential.from_db(db_wrapper).save()
 
 
 def main():
@@ -91,6 +96,9 @@ def main():
     parser.add_argument('--clean',
                         action='store_true',
                         help='clean DB by desactivating unknown codes')
+    parser.add_argument('--cache-only',
+                        action='store_true',
+                        help='only rebuild the local referential cache')
 
     args = parser.parse_args()
     loader(args)
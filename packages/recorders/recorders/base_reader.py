@@ -5,6 +5,7 @@ import pandas as pd
 
 from arb_logger.logger import get_logger
 from recorders.base_recorder import BaseRecorder
+from recorders.record_writer import TIMESTAMP, read_record
 from arb_utils.resolver import resolve_instruments
 from arb_utils.args_parser import instruments_args_parser
 
@@ -48,7 +49,23 @@ class BaseReader:
         if hasattr(self.class_small, 'columns'):
             return self.class_small.columns
 
+    def read_record(self):
+        """Arrow record written by the recorder, None for legacy days"""
+        table = read_record(self.path)
+        if table is None:
+            return None
+        df = table.to_pandas().set_index(TIMESTAMP)
+        df.index = pd.to_datetime(df.index, unit='s')
+        df.index.name = 'time'
+        # values repeated from the previous row are written as nulls
+        df.ffill(inplace=True)
+        return df
+
     def read(self):
+        df = self.read_record()
+        if df is not None:
+            return df
+
         is_prev_day = self.date.date() < datetime.now().date()
         if is_prev_day:
             df = pd.read_parquet(self.path)
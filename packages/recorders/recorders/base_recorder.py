@@ -1,7 +1,8 @@
 import os
-import csv
+import sys
 import time
 import atexit
+import signal
 
 from pathlib import Path
 from logging import Logger
@@ -12,6 +13,7 @@ from datetime import datetime, timezone
 from argparse import ArgumentParser
 from arb_logger.logger import get_logger
 from watchers.watcher_base import WatcherBase
+from recorders.record_writer import RecordWriter, record_schema
 
 LOGGER = get_logger('base_recorder', short=True)
 
@@ -32,15 +34,20 @@ class BaseRecorder(WatcherBase):
         self.current_day = defaultdict(
             lambda: datetime.now(tz=timezone.utc).day)
 
-        self.fds = {}
+        self.writers: dict[int, RecordWriter] = {}
         self.prev_event = {}
 
-        self.flush_thread = Thread(target=self.flush_fds, daemon=True)
+        self.flush_thread = Thread(target=self.flush_writers, daemon=True)
         self.flush_thread.start()
 
     def __del__(self):
-        self.close_fds()
-        LOGGER.info('Closed fds')
+        self.close_writers()
+        LOGGER.info('Closed writers')
+
+    @classmethod
+    def get_schema(cls):
+        return record_schema(cls.class_small.columns,
+                             getattr(cls.class_small, 'column_types', None))
 
     @staticmethod
     def get_record_path(recorder_type, instr_id, date: datetime = None):
@@ -49,56 +56,56 @@ class BaseRecorder(WatcherBase):
             tz=timezone.utc).strftime('%Y%m%d')
 
         extension = 'csv'
-        # since records are converted to parquet at the end of the day,
+        # legacy csv records are converted to parquet at the end of the day,
         # we need to change the extension for L2BookReader if reading past
         if date and date.date() < datetime.now().date():
             extension = 'parquet'
+        # recorders now write arrow parts next to it, see record_parts
 
         return Path(
             f'{base}/{recorder_type}/{today}/{recorder_type}_recorder_{instr_id}_{today}.{extension}'
         )
 
-    def flush_fds(self):
+    def flush_writers(self):
         last_minute = -1
         while True:
             if last_minute != datetime.now(tz=timezone.utc).minute:
                 last_minute = datetime.now(tz=timezone.utc).minute
-                LOGGER.info('Flushing fds')
-                for fd, _ in self.fds.values():
-                    fd.flush()
+                LOGGER.info('Flushing writers')
+                for writer in list(self.writers.values()):
+                    writer.flush()
             time.sleep(1)
 
-    def get_fd(self, instr_id):
-        fd, writer = self.fds.get(instr_id, (None, None))
-        if not fd:
-            fd, writer = self.open_fd(instr_id)
-            self.fds[instr_id] = fd, writer
-        return fd, writer
-
-    def close_fds(self):
-        self.logger.info('Closing fds')
-        for fd, _ in self.fds.values():
-            fd.close()
-        self.fds = {}
-
-    def open_fd(self, instr_id):
-        self.logger.info(f'Opening fd, writer for {instr_id}')
+    def get_writer(self, instr_id) -> RecordWriter:
+        writer = self.writers.get(instr_id)
+        if not writer:
+            writer = self.writers[instr_id] = self.open_writer(instr_id)
+        return writer
+
+    def close_writers(self):
+        self.logger.info('Closing writers')
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+
+    def open_writer(self, instr_id) -> RecordWriter:
         path = self.get_record_path(self.recorder_type, instr_id)
 
         if path.parent.exists() is False:
             path.parent.mkdir(parents=True)
 
-        fd = open(path, 'a')
-        writer = csv.writer(fd)
-        return fd, writer
+        writer = RecordWriter(path, self.get_schema())
+        self.logger.info(f'Opening writer {writer.path} for {instr_id}')
+        return writer
 
     def _check_day_change(self, instr_id, timestamp):
         if self.current_day[instr_id] != datetime.fromtimestamp(timestamp).day:
             self.current_day[instr_id] = datetime.fromtimestamp(timestamp).day
             self.logger.info(
-                f'Day changed for {instr_id}, closing fd, re-opening')
-            self.fds[instr_id][0].close()
-            self.fds[instr_id] = self.open_fd(instr_id)
+                f'Day changed for {instr_id}, closing writer, re-opening')
+            writer = self.writers.pop(instr_id, None)
+            if writer:
+                writer.close()
 
     def _check_new_values(self, event):
         prev_event = self.prev_event.get(event.instr_id, None)
@@ -124,8 +131,7 @@ class BaseRecorder(WatcherBase):
             if data is None:
                 return
             self._check_day_change(event.instr_id, data[0])
-            _, writer = self.get_fd(event.instr_id)
-            writer.writerow(data)
+            self.get_writer(event.instr_id).write(data)
 
 
 def start_recorder(recorder_type, args):
@@ -157,10 +163,12 @@ def main(recorder_class: BaseRecorder, logger: Logger):
         recorder = recorder_class()
 
         def clean_stop():
-            nonlocal recorder
-            del recorder
+            recorder.close_writers()
 
-        atexit.register(clean_stop, recorder_class.recorder_type, args)
+        # pending rows are written on exit, pkill sends SIGTERM which exits
+        # through sys.exit so atexit runs
+        atexit.register(clean_stop)
+        signal.signal(signal.SIGTERM, lambda sig, frame: sys.exit(0))
 
         return recorder.run()
     start_recorder(recorder_class.recorder_type, args)
@@ -0,0 +1,114 @@
+import os
+import time
+import shutil
+import tempfile
+import tracemalloc
+
+from pathlib import Path
+from argparse import ArgumentParser
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+from arb_logger.logger import get_logger
+from recorders.clean_records import CleanRecords, convert_file
+
+LOGGER = get_logger('bench_clean_records', short=True)
+
+
+def _l2_row(t, k, uneven):
+    # legacy files have fewer levels on some rows, starting with the first
+    depth = 9 if uneven and not k % 5 else 10
+    bids = [x for a in range(depth) for x in (100. - a, float(k % 3 + 1))]
+    asks = [x for a in range(depth) for x in (101. + a, 1.)]
+    return [t, 7, depth, depth] + bids + asks
+
+
+def _trades_row(t, k, uneven):
+    return [t, 7, float(k % 4), 100. + k % 2, k % 7 == 0, 1]
+
+
+def _funding_row(t, k, uneven):
+    next_funding = datetime.fromtimestamp(t - t % 28800 + 28800,
+                                          tz=timezone.utc)
+    return [t, 7, 1e-4 * (k // 50), 1e-4, next_funding if k % 11 else '']
+
+
+def _candles_row(t, k, uneven):
+    return [t, 100. + k % 5, 101., 99. + k % 3, 100., float(k % 10)]
+
+
+def write_sample(path: Path, kind: str, rows: int):
+    """csv as the legacy recorders wrote it"""
+    make_row = {
+        'l2': _l2_row,
+        'trades': _trades_row,
+        'funding': _funding_row,
+        'candles': _candles_row,
+    }[kind]
+    t = datetime.now(tz=timezone.utc).timestamp()
+    with open(path, 'w') as fd:
+        if kind == 'candles':
+            fd.write('time,open,high,low,close,volume\n')
+        for k in range(rows):
+            row = make_row(t + k * 0.1, k, 'uneven' in str(path.parent))
+            fd.write(','.join(str(v) for v in row) + '\n')
+
+
+def in_memory(cleaner: CleanRecords, path: Path, kind: str) -> pd.DataFrame:
+    """Previous conversion: whole file in memory"""
+    df = cleaner._clean_df(cleaner._load_df(path, kind), kind)
+    df.to_parquet(path.with_suffix('.ref.parquet'))
+    return pd.read_parquet(path.with_suffix('.ref.parquet'))
+
+
+def streamed(path: Path, kind: str, chunk_rows: int) -> pd.DataFrame:
+    convert_file(path, kind, chunk_rows)
+    return pd.read_parquet(path.with_suffix('.parquet'))
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def main():
+    parser = ArgumentParser(
+        description='Compares streamed CleanRecords conversion with the '
+        'in-memory one on generated csv records of every kind: same frame, '
+        'time and peak memory')
+    parser.add_argument('-n', '--rows', type=int, default=100000)
+    parser.add_argument('--chunk-rows', type=int, default=9973)
+    args = parser.parse_args()
+
+    base = Path(tempfile.mkdtemp())
+    os.environ['ARB_RECORDS_PATH'] = str(base)
+    day = (datetime.now() - timedelta(days=1)).strftime('%Y%m%d')
+    cleaner = CleanRecords()
+    try:
+        LOGGER.info(f'{"file":<10}{"rows":>8}{"memory s":>10}'
+                    f'{"stream s":>10}{"memory MB":>11}{"stream MB":>11}')
+        for name, kind in [('l2', 'l2'), ('uneven', 'l2'),
+                           ('trades', 'trades'), ('funding', 'funding'),
+                           ('candles', 'candles')]:
+            path = base / name / day / f'{kind}_recorder_7_{day}.csv'
+            path.parent.mkdir(parents=True)
+            write_sample(path, kind, args.rows)
+            ref, ref_s, ref_peak = measure(in_memory, cleaner, path, kind)
+            new, new_s, new_peak = measure(streamed, path, kind,
+                                           args.chunk_rows)
+            pd.testing.assert_frame_equal(ref, new)
+            LOGGER.info(f'{name:<10}{len(new):>8}{ref_s:>10.2f}{new_s:>10.2f}'
+                        f'{ref_peak / 1e6:>11.1f}{new_peak / 1e6:>11.1f}')
+        LOGGER.info('streamed output identical to the in-memory one')
+    finally:
+        shutil.rmtree(base)
+
+
+if __name__ == '__main__':
+    main()
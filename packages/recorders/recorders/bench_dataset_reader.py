@@ -0,0 +1,108 @@
+import os
+import time
+import random
+import shutil
+import tempfile
+
+from pathlib import Path
+from argparse import ArgumentParser
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+from arb_logger.logger import get_logger
+from recorders.base_recorder import BaseRecorder
+from recorders.record_writer import RecordWriter
+from recorders.trades_reader import TradesReader
+from recorders.dataset_reader import DatasetReader
+from recorders.trades_recorder import TradesRecorder, TradeSmall
+
+LOGGER = get_logger('bench_dataset_reader', short=True)
+
+
+def write_trades(day: datetime, instr_id: int, rows: int):
+    """Trades spread over the day, prices and sizes often repeated"""
+    path = BaseRecorder.get_record_path('trades', instr_id, day)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    writer = RecordWriter(path, TradesRecorder.get_schema())
+    price = 100.
+    for k in range(rows):
+        price += random.choice([-0.5, 0, 0, 0, 0.5])
+        trade = TradeSmall()
+        trade.time = day + timedelta(seconds=k * 86400 / rows)
+        trade.qty = float(random.randint(1, 3))
+        trade.price = price
+        trade.instr_id = instr_id
+        trade.is_liquidation = k % 97 == 0
+        writer.write(trade.to_list())
+    writer.close()
+
+
+def per_file(instr_ids, days, start, end, columns) -> pd.DataFrame:
+    """One BaseReader per instrument and day, then filtered"""
+    frames = []
+    for day in days:
+        for instr_id in instr_ids:
+            df = TradesReader(instr_id, date=day).read()
+            frames.append(df[(df.index >= start) & (df.index < end)])
+    df = pd.concat(frames)
+    df = df.iloc[df.index.argsort(kind='stable')]
+    return df[['instr_id'] + columns]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser(
+        description='Time to load some instruments over a few hours of a '
+        'multi-day trades dataset, with DatasetReader and with a loop of '
+        'TradesReader')
+    parser.add_argument('-i', '--instruments', type=int, default=50)
+    parser.add_argument('-d', '--days', type=int, default=3)
+    parser.add_argument('-n', '--rows', type=int, default=20000,
+                        help='trades per instrument and day')
+    parser.add_argument('--select', type=int, default=10,
+                        help='instruments read')
+    args = parser.parse_args()
+
+    base = Path(tempfile.mkdtemp())
+    os.environ['ARB_RECORDS_PATH'] = str(base)
+    random.seed(0)
+    first_day = (datetime.now(tz=timezone.utc) - timedelta(
+        days=args.days + 1)).replace(hour=0, minute=0, second=0,
+                                     microsecond=0, tzinfo=None)
+    days = [first_day + timedelta(days=k) for k in range(args.days)]
+    try:
+        for day in days:
+            for instr_id in range(1, args.instruments + 1):
+                write_trades(day, instr_id, args.rows)
+
+        instr_ids = list(range(1, args.select + 1))
+        columns = ['price', 'qty']
+        # from the middle of the first day to the middle of the last one
+        start = days[0] + timedelta(hours=12)
+        end = days[-1] + timedelta(hours=12)
+        reader = DatasetReader('trades', start, end, instr_ids, columns)
+
+        LOGGER.info(f'{"reader":<16}{"rows":>10}{"seconds":>10}'
+                    f'{"rows/s":>12}')
+        df, seconds = timed(reader.read)
+        LOGGER.info(f'{"dataset":<16}{len(df):>10}{seconds:>10.2f}'
+                    f'{len(df) / seconds:>12.0f}')
+        ref, seconds = timed(per_file, instr_ids, days,
+                             start, end, columns)
+        LOGGER.info(f'{"per file":<16}{len(ref):>10}{seconds:>10.2f}'
+                    f'{len(ref) / seconds:>12.0f}')
+
+        pd.testing.assert_frame_equal(ref, df, check_dtype=False)
+        LOGGER.info('same rows from both readers')
+    finally:
+        shutil.rmtree(base)
+
+
+if __name__ == '__main__':
+    main()
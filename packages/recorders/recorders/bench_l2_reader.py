@@ -0,0 +1,157 @@
+import os
+import time
+import random
+import shutil
+import tempfile
+
+from pathlib import Path
+from argparse import ArgumentParser
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+from pandas.errors import ParserError
+
+from arb_logger.logger import get_logger
+from recorders.base_recorder import BaseRecorder
+from recorders.clean_records import convert_file
+from recorders.record_writer import RecordWriter
+from recorders.l2_book_reader import L2BookReader
+from recorders.l2_book_recorder import L2BookRecorder, OrderBookSmall
+
+LOGGER = get_logger('bench_l2_reader', short=True)
+
+# instr_id of each sample, the reader picks the format from the files
+LEGACY_CSV, LEGACY_PARQUET, ARROW = 1, 2, 3
+
+
+def sample_books(rows: int, depth: int) -> list[OrderBookSmall]:
+    """Random walk, some sides shorter than depth, first one included"""
+    random.seed(0)
+    mid, t = 100., datetime.now(tz=timezone.utc).timestamp()
+    books = []
+    for k in range(rows):
+        mid += random.choice([-0.5, 0, 0, 0.5])
+        bid_depth = depth - 1 if k % 7 == 0 else depth
+        ask_depth = depth - 2 if k % 13 == 0 else depth
+        book = OrderBookSmall(
+            instr_id=0,
+            bids=[[mid - 0.5 - a, float(random.randint(1, 3))]
+                  for a in range(bid_depth)],
+            asks=[[mid + 0.5 + a, float(random.randint(1, 3))]
+                  for a in range(ask_depth)],
+            timestamp=t + k * 0.05)
+        books.append(book)
+    return books
+
+
+def write_legacy_csv(path: Path, books: list[OrderBookSmall], instr_id):
+    """Variable-length rows of the csv recorder"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as fd:
+        for book in books:
+            bids = [x for xs in book.bids for x in xs]
+            asks = [x for xs in book.asks for x in xs]
+            row = [book.timestamp, instr_id,
+                   len(book.bids),
+                   len(book.asks)] + bids + asks
+            fd.write(','.join(str(v) for v in row) + '\n')
+
+
+def write_arrow(path: Path, books: list[OrderBookSmall], instr_id):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    writer = RecordWriter(path, L2BookRecorder.get_schema())
+    for book in books:
+        book.instr_id = instr_id
+        writer.write(book.to_list())
+    writer.close()
+
+
+def legacy_read(path: Path) -> pd.DataFrame:
+    """Previous L2BookReader.read of a csv record"""
+    try:
+        df = pd.read_csv(path, index_col=0, header=None)
+    except ParserError as e:
+        col_len = int(e.args[0].split(' ')[-1])
+        df = pd.read_csv(path,
+                         index_col=0,
+                         header=None,
+                         names=list(range(col_len)))
+        df.columns = L2BookReader._get_columns(df)
+        L2BookReader._fix_uneven_cols(df)
+    df.index = pd.to_datetime(df.index, unit='s')
+    df.ffill(inplace=True)
+    return df
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser(
+        description='Time to load a day of 10 level books with '
+        'L2BookReader.read_arrays from each record format, and with the '
+        'previous pandas reader from legacy csv')
+    parser.add_argument('-n', '--rows', type=int, default=200000)
+    parser.add_argument('--depth', type=int, default=10)
+    parser.add_argument('--skip-legacy',
+                        action='store_true',
+                        help='skip the previous reader, slow on big files')
+    args = parser.parse_args()
+
+    base = Path(tempfile.mkdtemp())
+    os.environ['ARB_RECORDS_PATH'] = str(base)
+    today = datetime.now(tz=timezone.utc)
+    yesterday = today - timedelta(days=1)
+    try:
+        books = sample_books(args.rows, args.depth)
+        write_legacy_csv(
+            BaseRecorder.get_record_path('l2_book', LEGACY_CSV, today),
+            books, LEGACY_CSV)
+        csv_path = BaseRecorder.get_record_path('l2_book', LEGACY_PARQUET,
+                                                today)
+        write_legacy_csv(csv_path, books, LEGACY_PARQUET)
+        convert_file(csv_path, 'l2')
+        parquet_path = BaseRecorder.get_record_path('l2_book',
+                                                    LEGACY_PARQUET, yesterday)
+        parquet_path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(csv_path.with_suffix('.parquet'), parquet_path)
+        write_arrow(BaseRecorder.get_record_path('l2_book', ARROW, today),
+                    books, ARROW)
+
+        LOGGER.info(f'{"format":<16}{"rows":>8}{"seconds":>10}'
+                    f'{"rows/s":>12}')
+        arrays = {}
+        for name, instr_id, date in [('legacy csv', LEGACY_CSV, today),
+                                     ('legacy parquet', LEGACY_PARQUET,
+                                      yesterday), ('arrow', ARROW, today)]:
+            reader = L2BookReader(instr_id, date=date)
+            arrays[name], seconds = timed(reader.read_arrays)
+            LOGGER.info(f'{name:<16}{args.rows:>8}{seconds:>10.2f}'
+                        f'{args.rows / seconds:>12.0f}')
+        if not args.skip_legacy:
+            _, seconds = timed(
+                legacy_read,
+                BaseRecorder.get_record_path('l2_book', LEGACY_CSV, today))
+            LOGGER.info(f'{"previous csv":<16}{args.rows:>8}{seconds:>10.2f}'
+                        f'{args.rows / seconds:>12.0f}')
+
+        reference = arrays['arrow']
+        for name, other in arrays.items():
+            for side in ['times', 'bid_len', 'ask_len', 'bids', 'asks']:
+                # csv floats are parsed to the nearest ulp or so
+                np.testing.assert_allclose(getattr(reference, side),
+                                           getattr(other, side),
+                                           rtol=1e-15,
+                                           err_msg=f'{name} {side}')
+        LOGGER.info('same books from every format')
+    finally:
+        shutil.rmtree(base)
+
+
+if __name__ == '__main__':
+    main()
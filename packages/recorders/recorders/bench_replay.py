@@ -0,0 +1,142 @@
+import os
+import time
+import random
+import shutil
+import hashlib
+import tempfile
+
+from pathlib import Path
+from argparse import ArgumentParser
+from datetime import datetime, timedelta, timezone
+
+from arb_logger.logger import get_logger
+from redis_manager.redis_handler import RedisHandler
+from redis_manager.redis_events import FundingRateEvent, LiquidationEvent, OrderBookEvent, TradeEvent
+from recorders.replay import Replay
+from recorders.base_recorder import BaseRecorder
+from recorders.record_writer import RecordWriter
+from recorders.l2_book_recorder import L2BookRecorder
+from recorders.trades_recorder import TradesRecorder
+from recorders.funding_recorder import FundingRateRecorder
+
+LOGGER = get_logger('bench_replay', short=True)
+
+EVENTS = [OrderBookEvent, TradeEvent, LiquidationEvent, FundingRateEvent]
+
+
+def write_records(day: datetime,
+                  instr_id: int,
+                  books: int,
+                  trades: int,
+                  seconds: int = 3600,
+                  mid: float = 100.):
+    """Random walk books and trades over seconds, funding every 10 min"""
+    writers = {}
+    for recorder in [L2BookRecorder, TradesRecorder, FundingRateRecorder]:
+        path = BaseRecorder.get_record_path(recorder.recorder_type, instr_id,
+                                            day)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        writers[recorder.recorder_type] = RecordWriter(path,
+                                                       recorder.get_schema())
+
+    start = day.timestamp()
+    depth = L2BookRecorder.class_small.depth
+    mids = []
+    for k in range(books):
+        mid += random.choice([-0.5, 0, 0, 0.5])
+        mids.append(mid)
+        # timestamps are rounded to the ms, ties across instruments happen
+        t = round(start + k * seconds / books, 3)
+        row = [t, instr_id, depth, depth]
+        row += [x for a in range(depth) for x in (mid - 0.5 - a, 1. + a % 3)]
+        row += [x for a in range(depth) for x in (mid + 0.5 + a, 1. + a % 2)]
+        writers['l2_book'].write(row)
+    for k in range(trades):
+        t = round(start + k * seconds / trades, 3)
+        writers['trades'].write([
+            t, instr_id,
+            float(random.randint(1, 5)),
+            mids[k * books // trades] + random.choice([-0.5, 0.5]),
+            k % 101 == 0, 1
+        ])
+    for k in range(seconds // 600):
+        t = start + k * 600
+        writers['funding'].write([
+            t, instr_id, 1e-4 * k, 1e-4,
+            datetime.fromtimestamp(start + 28800, tz=timezone.utc)
+        ])
+    for writer in writers.values():
+        writer.close()
+
+
+def fingerprint(replay: Replay) -> tuple[int, str, bool]:
+    """Events, hash of their order, timestamps never going back"""
+    digest, count, ordered, last = hashlib.sha1(), 0, True, 0.
+    for timestamp, redis_event, payload in replay.events():
+        digest.update(f'{timestamp}{redis_event.__name__}'
+                      f'{payload.instr_id}'.encode())
+        ordered &= timestamp >= last
+        last = timestamp
+        count += 1
+    return count, digest.hexdigest(), ordered
+
+
+def main():
+    parser = ArgumentParser(
+        description='Replays an hour of generated books, trades and funding '
+        'of many instruments as fast as possible, in-process or to a local '
+        'redis-server, and checks the order is deterministic')
+    parser.add_argument('-i', '--instruments', type=int, default=20)
+    parser.add_argument('--books', type=int, default=20000,
+                        help='books per instrument')
+    parser.add_argument('--trades', type=int, default=5000,
+                        help='trades per instrument')
+    parser.add_argument('--speed',
+                        type=float,
+                        help='also replay the first minute at this speed')
+    parser.add_argument('--redis',
+                        action='store_true',
+                        help='publish to redis-server on localhost')
+    args = parser.parse_args()
+
+    base = Path(tempfile.mkdtemp())
+    os.environ['ARB_RECORDS_PATH'] = str(base)
+    random.seed(0)
+    day = (datetime.now(tz=timezone.utc) - timedelta(days=1)).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+    try:
+        for instr_id in range(1, args.instruments + 1):
+            write_records(day, instr_id, args.books, args.trades)
+        end = day + timedelta(hours=1)
+
+        first = fingerprint(Replay(day, end))
+        second = fingerprint(Replay(day, end, batch=997))
+        LOGGER.info(f'{first[0]} events, ordered: {first[2]}, same order '
+                    f'with another batch: {first == second}')
+
+        # in-process, a callback per event as a strategy would have
+        replay = Replay(day, end)
+        received = []
+        for redis_event in EVENTS:
+            replay.subscribe(redis_event, received.append)
+        replay.run()
+        received.clear()
+
+        if args.speed:
+            replay = Replay(day, day + timedelta(minutes=1),
+                            speed=args.speed)
+            start = time.perf_counter()
+            replay.run()
+            LOGGER.info(f'a minute at {args.speed}x in '
+                        f'{time.perf_counter() - start:.1f}s')
+
+        if args.redis:
+            replay = Replay(day, end, redis_handler=RedisHandler(
+                publish_batch=1000))
+            replay.run()
+    finally:
+        shutil.rmtree(base)
+
+
+if __name__ == '__main__':
+    main()
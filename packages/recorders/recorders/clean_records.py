@@ -1,10 +1,17 @@
 import os
+import json
 import traceback
 
 from pathlib import Path
+from typing import Optional
+from argparse import ArgumentParser
 from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 from tqdm import tqdm
 from pandas.errors import EmptyDataError, ParserError
@@ -13,47 +20,250 @@ from recorders.trades_reader import TradesReader
 from recorders.l2_book_reader import L2BookReader
 from recorders.funding_reader import FundingReader
 
+# rows parsed at once per file, memory of a worker is bounded by it
+CLEAN_CHUNK_ROWS = int(os.getenv('ARB_CLEAN_CHUNK_ROWS', '200000'))
+
+
+def _common_dtype(a, b):
+    """dtype read_csv infers for a column holding values of both dtypes"""
+    if a is None or a == b:
+        return b
+    if b is None:
+        return a
+    if all(
+            pd.api.types.is_numeric_dtype(d)
+            and not pd.api.types.is_bool_dtype(d) for d in [a, b]):
+        return np.result_type(a, b)
+    for d in [a, b]:
+        if pd.api.types.is_string_dtype(d) and d != object:
+            return d
+    return np.dtype(object)
+
+
+def _masked_dtype(dtype, has_na: bool):
+    """dtype of the column once mask has put NaNs in it"""
+    if not has_na:
+        return dtype
+    if pd.api.types.is_bool_dtype(dtype):
+        return np.dtype(object)
+    if pd.api.types.is_integer_dtype(dtype):
+        return np.dtype('float64')
+    return dtype
+
+
+def _read_chunks(path: Path, kind: str, chunk_rows: int, names=None):
+    if kind == 'candles':
+        return pd.read_csv(path.absolute(), index_col=0, chunksize=chunk_rows)
+    return pd.read_csv(path.absolute(),
+                       index_col=0,
+                       header=None,
+                       names=names,
+                       chunksize=chunk_rows)
+
+
+def _masked_chunks(path: Path, kind: str, chunk_rows: int, names=None):
+    """
+    Yields (raw, masked) chunks, mask(shift(1) == df) of the whole file:
+    the first row of a chunk is compared to the last one of the previous
+    """
+    tail = None
+    for chunk in _read_chunks(path, kind, chunk_rows, names):
+        if tail is None:
+            masked = chunk.mask(chunk.shift(1) == chunk)
+        else:
+            both = pd.concat([tail, chunk])
+            masked = both.mask(both.shift(1) == both).iloc[1:]
+        tail = chunk.iloc[-1:]
+        yield chunk, masked
+
+
+def _scan(path: Path, kind: str, chunk_rows: int, names=None):
+    """
+    First pass: dtypes the whole file would be read with, after the mask,
+    for the columns and the index
+    """
+    dtypes, has_na, index_dtype = {}, {}, None
+    for chunk, masked in _masked_chunks(path, kind, chunk_rows, names):
+        for column in chunk.columns:
+            # all-NaN chunks do not change what read_csv infers
+            if chunk[column].notna().any():
+                dtypes[column] = _common_dtype(dtypes.get(column),
+                                               chunk[column].dtype)
+            has_na[column] = (has_na.get(column, False)
+                              or bool(masked[column].isna().any()))
+        index_dtype = _common_dtype(index_dtype, chunk.index.dtype)
+    return {
+        column: _masked_dtype(dtypes.get(column, np.dtype('float64')),
+                              has_na[column])
+        for column in has_na
+    }, index_dtype
+
+
+def _arrow_schema(chunk: pd.DataFrame, dtypes: dict) -> pa.Schema:
+    schema = pa.Schema.from_pandas(chunk, preserve_index=True)
+    for k, field in enumerate(schema):
+        if not pa.types.is_null(field.type):
+            continue
+        # no value in the first chunk, typed from the rest of the file
+        dtype = dtypes.get(field.name)
+        if dtype is not None and pd.api.types.is_bool_dtype(dtype):
+            field_type = pa.bool_()
+        elif dtype is not None and pd.api.types.is_numeric_dtype(dtype):
+            field_type = pa.from_numpy_dtype(dtype)
+        else:
+            field_type = pa.string()
+        schema = schema.set(k, field.with_type(field_type))
+    return schema
+
+
+def convert_file(path: Path,
+                 kind: str,
+                 chunk_rows: int = CLEAN_CHUNK_ROWS) -> int:
+    """
+    Streams a csv record to parquet next to it, same frame as loading the
+    whole file then mask(shift(1) == df). Returns the number of rows.
+    """
+    names = None
+    try:
+        dtypes, index_dtype = _scan(path, kind, chunk_rows)
+    except ParserError as e:
+        if kind == 'candles':
+            raise
+        # uneven l2 rows, width of the offending row as in _load_df
+        col_len = int(e.args[0].split(' ')[-1])
+        names = list(range(col_len))
+        dtypes, index_dtype = _scan(path, kind, chunk_rows, names)
+
+    out_path = path.with_suffix('.parquet')
+    tmp_path = out_path.with_name(f'{out_path.name}.tmp')
+    writer, rows = None, 0
+    try:
+        for _, masked in _masked_chunks(path, kind, chunk_rows, names):
+            masked = masked.astype(dtypes)
+            masked.index = masked.index.astype(index_dtype)
+            named_dtypes = dict(
+                zip(CleanRecords._get_columns(masked, kind), dtypes.values()))
+            masked.columns = list(named_dtypes)
+            masked.index.name = 'timestamp'
+            if writer is None:
+                schema = _arrow_schema(masked, named_dtypes)
+                writer = pq.ParquetWriter(tmp_path, schema)
+            writer.write_table(
+                pa.Table.from_pandas(masked,
+                                     schema=schema,
+                                     preserve_index=True))
+            rows += len(masked)
+        if writer is None:
+            raise EmptyDataError(f'no rows in {path}')
+        writer.close()
+        os.replace(tmp_path, out_path)
+    finally:
+        if tmp_path.exists():
+            os.remove(tmp_path)
+    return rows
+
 
 class CleanRecords:
 
-    def __init__(self):
+    def __init__(self,
+                 day: Optional[datetime] = None,
+                 workers: Optional[int] = None,
+                 chunk_rows: int = CLEAN_CHUNK_ROWS):
         self.records_path = os.getenv('ARB_RECORDS_PATH')
 
         if self.records_path is None:
             raise ValueError('ARB_RECORDS_PATH is not set')
 
+        self.day = (day or datetime.now() - timedelta(days=1)).date()
+        self.workers = workers or os.cpu_count()
+        self.chunk_rows = chunk_rows
+        # files already converted, a killed run resumes after them
+        self.manifest_path = Path(
+            self.records_path
+        ) / f'clean_records_{self.day.strftime("%Y%m%d")}.manifest'
+
     def _get_all_record_files(self) -> list[Path]:
         """
         only get csv files in root path
         """
-        prev_day = datetime.now().date() - timedelta(days=1)
-        prev_day_str = prev_day.strftime('%Y%m%d')
+        day_str = self.day.strftime('%Y%m%d')
         files = [
-            p for p in Path(self.records_path).rglob(f'*{prev_day_str}*/*.csv')
+            p for p in Path(self.records_path).rglob(f'*{day_str}*/*.csv')
             if 'candles' in p.stem
             or self._get_file_date(p).date() < datetime.now().date()
         ]
         return files
 
+    def _load_manifest(self) -> dict[str, dict]:
+        if not self.manifest_path.exists():
+            return {}
+        with open(self.manifest_path, 'rb+') as fd:
+            data = fd.read()
+            # drop a line cut by a kill, new entries start on a new line
+            fd.truncate(data.rfind(b'\n') + 1)
+        done = {}
+        for line in data.splitlines()[:data.count(b'\n')]:
+            entry = json.loads(line)
+            done[entry['path']] = entry
+        return done
+
+    def _record_done(self, path: Path, rows: int):
+        stat = path.stat()
+        entry = {
+            'path': str(path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'rows': rows,
+        }
+        with open(self.manifest_path, 'a') as fd:
+            fd.write(json.dumps(entry) + '\n')
+            fd.flush()
+            os.fsync(fd.fileno())
+
+    @staticmethod
+    def _is_done(path: Path, entry: Optional[dict]) -> bool:
+        if not entry or not path.with_suffix('.parquet').exists():
+            return False
+        stat = path.stat()
+        return (entry['size'] == stat.st_size
+                and entry['mtime_ns'] == stat.st_mtime_ns)
+
     def clean_records(self):
-        for path in tqdm(self._get_all_record_files()):
-            kind = path.stem.split('_')[0]
+        done = self._load_manifest()
+        todo = []
+        for path in self._get_all_record_files():
+            if self._is_done(path, done.get(str(path))):
+                # converted before the previous run was killed
+                self._remove_csv(path, path.stem.split('_')[0])
+            else:
+                todo.append(path)
+        # largest first, the small ones fill the gaps at the end
+        todo.sort(key=lambda p: p.stat().st_size, reverse=True)
 
-            # print(f'cleaning {path}')
-            try:
-                df = self._load_df(path, kind)
-                df = self._clean_df(df, kind)
-            except EmptyDataError:
-                print(f'empty file {path}')
-                continue
-            except Exception as e:
-                print(f'error loading/cleaning {path}: {e}')
-                print(traceback.format_exc())
-                continue
-
-            self._save_df(df, path, kind)
+        with ProcessPoolExecutor(self.workers) as pool:
+            futures = {
+                pool.submit(convert_file, path,
+                            path.stem.split('_')[0], self.chunk_rows): path
+                for path in todo
+            }
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                path = futures[future]
+                kind = path.stem.split('_')[0]
+                try:
+                    rows = future.result()
+                except EmptyDataError:
+                    print(f'empty file {path}')
+                    continue
+                except Exception as e:
+                    print(f'error loading/cleaning {path}: {e}')
+                    print(traceback.format_exc())
+                    continue
+
+                self._record_done(path, rows)
+                self._remove_csv(path, kind)
 
     def _load_df(self, path: Path, kind):
+        """Whole file in memory, reference for convert_file"""
         if kind == 'candles':
             df = pd.read_csv(path.absolute(), index_col=0)
         else:
@@ -76,22 +286,16 @@ class CleanRecords:
         df.index.name = 'timestamp'
         return df
 
-    def _save_df(self, df: pd.DataFrame, path: Path, kind):
-        path = path.with_suffix(".parquet")
-        # print(f'saving {path}')
-        df.to_parquet(path)
-
-        # check if new file exists
-        if path.exists():
-            can_delete = kind == 'candles'
-            if kind != 'candles':
-                file_date = self._get_file_date(path)
-                can_delete = file_date.date() < datetime.now().date()
-                # print(f'removing {path.with_suffix(".csv")}')
-            if can_delete:
-                os.remove(path.with_suffix('.csv'))
-
-    def _get_columns(self, df, kind):
+    def _remove_csv(self, path: Path, kind):
+        can_delete = kind == 'candles'
+        if kind != 'candles':
+            file_date = self._get_file_date(path)
+            can_delete = file_date.date() < datetime.now().date()
+        if can_delete:
+            os.remove(path)
+
+    @staticmethod
+    def _get_columns(df, kind):
         if kind == 'l2':
             return L2BookReader._get_columns(df)
         if kind == 'candles':
@@ -103,13 +307,26 @@ class CleanRecords:
         else:
             raise ValueError(f'unknown kind {kind}')
 
-    def _get_file_date(self, path: Path):
+    @staticmethod
+    def _get_file_date(path: Path):
         date_str = path.stem.split('_')[-1]
         return datetime.strptime(date_str, '%Y%m%d')
 
 
 def main():
-    cleaner = CleanRecords()
+    parser = ArgumentParser(
+        description='Converts the csv records of a day to parquet')
+    parser.add_argument('--day',
+                        help='YYYYMMDD, default yesterday',
+                        type=lambda d: datetime.strptime(d, '%Y%m%d'))
+    parser.add_argument('-w',
+                        '--workers',
+                        type=int,
+                        help='processes, default one per cpu')
+    parser.add_argument('--chunk-rows', type=int, default=CLEAN_CHUNK_ROWS)
+    args = parser.parse_args()
+
+    cleaner = CleanRecords(args.day, args.workers, args.chunk_rows)
     cleaner.clean_records()
 
 
@@ -0,0 +1,187 @@
+import os
+
+from pathlib import Path
+from collections import deque
+from typing import Iterator, Optional
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from arb_logger.logger import get_logger
+from recorders.trades_reader import TradesReader
+from recorders.l2_book_reader import L2BookReader
+from recorders.funding_reader import FundingReader
+from recorders.record_writer import TIMESTAMP, read_record, record_parts
+
+LOGGER = get_logger('dataset_reader', short=True)
+
+# files read at once, arrow and parquet decoding release the gil
+DATASET_WORKERS = int(os.getenv('ARB_DATASET_WORKERS', '8'))
+
+READERS = {
+    reader.recorder_type: reader
+    for reader in [L2BookReader, TradesReader, FundingReader]
+}
+
+
+def to_timestamp(value) -> float:
+    """Seconds since epoch of a datetime, naive is UTC, YYYYMMDD or float"""
+    if isinstance(value, int | float):
+        return float(value)
+    if isinstance(value, str):
+        value = (datetime.strptime(value, '%Y%m%d')
+                 if value.isdigit() else datetime.fromisoformat(value))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class DatasetReader:
+    """
+    Records of many instruments over a time range from the
+    $ARB_RECORDS_PATH/{type}/{YYYYMMDD}/ layout, as one frame or as one
+    chunk per instrument and day.
+
+    Days and instruments are pruned from the file names. Arrow and parquet
+    files are memory mapped, only the timestamp and the requested columns
+    are decoded and arrow batches after end are not read. Repeated values
+    are filled per file before the time filter, rows keep the values set
+    before start.
+    """
+
+    def __init__(self,
+                 recorder_type: str,
+                 start,
+                 end=None,
+                 instr_ids: Optional[list[int]] = None,
+                 columns: Optional[list[str]] = None,
+                 workers: int = DATASET_WORKERS):
+        if recorder_type not in READERS:
+            raise ValueError(f'unknown recorder type {recorder_type}')
+        self.records_path = os.getenv('ARB_RECORDS_PATH')
+        if self.records_path is None:
+            raise ValueError('ARB_RECORDS_PATH is not set')
+
+        self.recorder_type = recorder_type
+        self.start = to_timestamp(start)
+        self.end = to_timestamp(end or datetime.now(tz=timezone.utc))
+        self.instr_ids = {int(i) for i in instr_ids} if instr_ids else None
+        self.columns = list(columns) if columns else None
+        self.workers = workers
+
+    def days(self) -> list[str]:
+        day = datetime.fromtimestamp(self.start, tz=timezone.utc).date()
+        last = datetime.fromtimestamp(self.end, tz=timezone.utc).date()
+        days = []
+        while day <= last:
+            days.append(day.strftime('%Y%m%d'))
+            day += timedelta(days=1)
+        return days
+
+    def files(self) -> list[tuple[str, int, Path]]:
+        """(day, instr_id, record path) of the range, in that order"""
+        prefix = f'{self.recorder_type}_recorder'
+        files = set()
+        for day in self.days():
+            day_path = Path(self.records_path) / self.recorder_type / day
+            if not day_path.is_dir():
+                continue
+            for path in day_path.iterdir():
+                # parts and formats of a record share the name
+                name = path.name.split('.')[0].rsplit('_', 2)
+                if len(name) != 3 or not name[1].isdigit():
+                    continue
+                name_prefix, instr_id, name_day = name
+                if name_prefix != prefix or name_day != day:
+                    continue
+                if self.instr_ids and int(instr_id) not in self.instr_ids:
+                    continue
+                files.add((day, int(instr_id),
+                           day_path / f'{prefix}_{instr_id}_{day}.csv'))
+        return sorted(files)
+
+    def _table_frame(self, table: pa.Table) -> pd.DataFrame:
+        timestamps = table.column(TIMESTAMP)
+        table = table.drop_columns([TIMESTAMP])
+        table = pa.table(
+            [pc.fill_null_forward(c) for c in table.columns],
+            names=table.column_names)
+        keep = pc.and_(pc.greater_equal(timestamps, self.start),
+                       pc.less(timestamps, self.end))
+        df = table.filter(keep).to_pandas()
+        df.index = pd.to_datetime(timestamps.filter(keep).to_numpy(),
+                                  unit='s')
+        return df
+
+    def _l2_frame(self, day: str, instr_id: int) -> pd.DataFrame:
+        """Levels realigned by the l2 reader, only those of columns"""
+        depth = None
+        if self.columns:
+            levels = [
+                int(c.rsplit('_', 1)[1]) for c in self.columns
+                if c.startswith(('bid_', 'ask_'))
+                and c.rsplit('_', 1)[1].isdigit()
+            ]
+            depth = max(levels, default=-1) + 1
+        reader = L2BookReader(instr_id,
+                              date=datetime.strptime(day, '%Y%m%d'))
+        arrays = reader.read_arrays(depth, self.end)
+        return arrays.between(self.start, self.end).to_frame()
+
+    def read_file(self, day: str, instr_id: int,
+                  path: Path) -> pd.DataFrame:
+        """Rows of the range of a (day, instr_id, path) of files()"""
+        parquet_path = path.with_suffix('.parquet')
+        if self.recorder_type == 'l2_book':
+            df = self._l2_frame(day, instr_id)
+        elif record_parts(path):
+            df = self._table_frame(read_record(path, self.columns, self.end))
+        elif parquet_path.exists():
+            columns = [TIMESTAMP] + self.columns if self.columns else None
+            df = self._table_frame(
+                pq.read_table(parquet_path, columns=columns,
+                              memory_map=True))
+        else:
+            df = None
+
+        if df is None:
+            reader = READERS[self.recorder_type](
+                instr_id, date=datetime.strptime(day, '%Y%m%d'))
+            df = reader.read()
+            df = df[(df.index >= pd.Timestamp(self.start, unit='s'))
+                    & (df.index < pd.Timestamp(self.end, unit='s'))]
+
+        if self.columns:
+            df = df[[c for c in self.columns if c in df.columns]]
+        df = df.drop(columns='instr_id', errors='ignore')
+        df.insert(0, 'instr_id', instr_id)
+        df.index.name = 'time'
+        return df
+
+    def iter_chunks(self) -> Iterator[pd.DataFrame]:
+        """One frame per instrument and day, at most workers read ahead"""
+        with ThreadPoolExecutor(self.workers) as pool:
+            pending = deque()
+            for file in self.files():
+                pending.append(pool.submit(self.read_file, *file))
+                if len(pending) < self.workers:
+                    continue
+                df = pending.popleft().result()
+                if len(df):
+                    yield df
+            while pending:
+                df = pending.popleft().result()
+                if len(df):
+                    yield df
+
+    def read(self) -> pd.DataFrame:
+        """Every row of the range, by time then instr_id"""
+        chunks = list(self.iter_chunks())
+        if not chunks:
+            return pd.DataFrame()
+        df = pd.concat(chunks)
+        return df.iloc[df.index.argsort(kind='stable')]
@@ -1,3 +1,7 @@
+from datetime import datetime, timezone
+
+import pyarrow as pa
+
 from cryptofeed.defines import *
 
 from arb_defines.defines import *
@@ -12,14 +16,24 @@ LOGGER = get_logger(process_name, short=True)
 
 class FundingRateSmall(FundingRate):
     columns = ['instrument', 'rate', 'predicted_rate', 'next_funding_time']
+    column_types = {
+        'instrument': pa.int64(),
+        'next_funding_time': pa.timestamp('us', tz='UTC'),
+    }
 
     def to_list(self):
+        next_funding_time = self.next_funding_time
+        if isinstance(next_funding_time, str):
+            next_funding_time = datetime.fromisoformat(next_funding_time)
+        elif isinstance(next_funding_time, int | float):
+            next_funding_time = datetime.fromtimestamp(next_funding_time,
+                                                       tz=timezone.utc)
         return [
             self.time.timestamp(),
             self.instr_id,
             self.rate,
             self.predicted_rate,
-            self.next_funding_time,
+            next_funding_time,
         ]
 
 
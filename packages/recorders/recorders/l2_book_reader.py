@@ -1,43 +1,167 @@
-import pandas as pd
-
-from datetime import datetime
+from typing import Optional
+from dataclasses import dataclass, fields
 
-from pandas.errors import ParserError
+import numpy as np
+import pandas as pd
 
 from arb_logger.logger import get_logger
 from arb_defines.arb_dataclasses import OrderBook
+from recorders.record_writer import read_record
+from recorders.l2_book_recorder import l2_columns
 from recorders.base_reader import BaseReader, main as base_main
 
 process_name = 'l2_book_reader'
 LOGGER = get_logger(process_name, short=True)
 
+# columns of a record row before the levels
+_TIME, _INSTR_ID, _BID_LEN, _ASK_LEN, _LEVELS = range(5)
+
+
+def _max_fields(path) -> int:
+    """Fields of the widest line of a csv, scanned by blocks"""
+    widest, carry = 0, 0
+    with open(path, 'rb') as fd:
+        while block := fd.read(1 << 26):
+            data = np.frombuffer(block, np.uint8)
+            commas = np.flatnonzero(data == ord(','))
+            newlines = np.flatnonzero(data == ord('\n'))
+            if not len(newlines):
+                carry += len(commas)
+                continue
+            ends = np.searchsorted(commas, newlines)
+            per_line = np.diff(ends, prepend=0)
+            per_line[0] += carry
+            widest = max(widest, int(per_line.max()) + 1)
+            carry = len(commas) - int(ends[-1])
+    return max(widest, carry + 1 if carry else 0)
+
+
+def _ffill(values: np.ndarray) -> np.ndarray:
+    """Forward fill of NaNs along the rows, per column"""
+    rows = np.where(np.isnan(values), 0, np.arange(len(values))[:, None])
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    return np.take_along_axis(values, rows, axis=0)
+
+
+@dataclass
+class L2Arrays:
+    """
+    Books of an instrument, levels best first. Levels beyond the length of
+    their side are NaN.
+    """
+    times: np.ndarray  # (n,) seconds
+    instr_id: np.ndarray  # (n,)
+    bid_len: np.ndarray  # (n,)
+    ask_len: np.ndarray  # (n,)
+    bids: np.ndarray  # (n, depth, 2) price, size
+    asks: np.ndarray  # (n, depth, 2) price, size
+
+    @property
+    def depth(self) -> int:
+        return self.bids.shape[1]
+
+    @classmethod
+    def from_rows(cls,
+                  values: np.ndarray,
+                  aligned_depth: Optional[int] = None,
+                  depth: Optional[int] = None) -> 'L2Arrays':
+        """
+        values are record rows, time, instr_id, bid_len, ask_len then the
+        levels. Asks follow the bid levels actually present in legacy rows,
+        or aligned_depth bid levels in fixed-width rows.
+        """
+        n = len(values)
+        bid_len = np.nan_to_num(values[:, _BID_LEN]).astype(np.int64)
+        ask_len = np.nan_to_num(values[:, _ASK_LEN]).astype(np.int64)
+        if depth is None:
+            depth = int(max(bid_len.max(initial=0), ask_len.max(initial=0)))
+        ask_start = _LEVELS + 2 * (bid_len if aligned_depth is None else
+                                   np.full(n, aligned_depth))
+
+        # room for the farthest level read, missing fields are NaN
+        width = int(ask_start.max(initial=_LEVELS)) + 2 * depth
+        if values.shape[1] < width:
+            values = np.hstack(
+                [values,
+                 np.full((n, width - values.shape[1]), np.nan)])
+
+        levels = np.arange(depth)
+        bid_cols = np.broadcast_to(_LEVELS + 2 * levels, (n, depth))
+        ask_cols = ask_start[:, None] + 2 * levels[None, :]
+        sides = []
+        for cols, lengths in [(bid_cols, bid_len), (ask_cols, ask_len)]:
+            side = np.stack([
+                np.take_along_axis(values, cols, axis=1),
+                np.take_along_axis(values, cols + 1, axis=1)
+            ],
+                            axis=2)
+            side[levels[None, :] >= lengths[:, None]] = np.nan
+            sides.append(side)
+
+        return cls(values[:, _TIME], values[:, _INSTR_ID], bid_len, ask_len,
+                   *sides)
+
+    def between(self, start: float, end: float) -> 'L2Arrays':
+        """Books from start to before end"""
+        keep = (self.times >= start) & (self.times < end)
+        return L2Arrays(*[getattr(self, f.name)[keep] for f in fields(self)])
+
+    def to_frame(self) -> pd.DataFrame:
+        """Same columns as the recorded rows"""
+        columns = np.column_stack([
+            self.instr_id, self.bid_len, self.ask_len,
+            self.bids.reshape(len(self.times), 2 * self.depth),
+            self.asks.reshape(len(self.times), 2 * self.depth)
+        ])
+        df = pd.DataFrame(columns,
+                          index=pd.to_datetime(self.times, unit='s'),
+                          columns=l2_columns(self.depth))
+        df.index.name = 'time'
+        return df
+
 
 class L2BookReader(BaseReader):
     recorder_type = 'l2_book'
     class_small = OrderBook
 
-    def read(self):
-        uneven_cols = False
-        if self.date.date() < datetime.now().date():
+    def read_arrays(self,
+                    depth: Optional[int] = None,
+                    end: Optional[float] = None) -> L2Arrays:
+        """
+        A day of books parsed straight to arrays, from the arrow record or
+        from legacy parquet / csv files. Only the depth first levels of the
+        arrow record are decoded, and its batches after end are not read.
+        """
+        columns = None if depth is None else l2_columns(depth)
+        table = read_record(self.path, columns, end)
+        if table is not None:
+            values = np.column_stack([
+                c.to_numpy(zero_copy_only=False).astype(np.float64)
+                for c in table.columns
+            ])
+            # padded to the recorder depth, or to depth when decoding fewer
+            # levels, repeated values are nulls
+            aligned_depth = (table.num_columns - _LEVELS) // 4
+            return L2Arrays.from_rows(_ffill(values), aligned_depth, depth)
+
+        if self.path.suffix == '.parquet':
             df = pd.read_parquet(self.path)
-        else:
-            try:
-                df = pd.read_csv(self.path, index_col=0, header=None)
-            except ParserError as e:
-                uneven_cols = True
-                col_len = int(e.args[0].split(' ')[-1])
-                df = pd.read_csv(self.path,
-                                 index_col=0,
-                                 header=None,
-                                 names=list(range(col_len)))
-        df.columns = self._get_columns(df)
-        df.index = pd.to_datetime(df.index, unit='s')
-        df.index.name = 'time'
-        if uneven_cols:
-            LOGGER.warning('Uneven columns, fixing')
-            self._fix_uneven_cols(df)
-        df.ffill(inplace=True)
-        return df
+            values = np.column_stack(
+                [df.index.to_numpy(np.float64),
+                 df.to_numpy(np.float64)])
+            # cleaned daily, repeated values are NaN
+            return L2Arrays.from_rows(_ffill(values), depth=depth)
+
+        # legacy rows have as many fields as levels
+        width = _max_fields(self.path)
+        values = pd.read_csv(self.path,
+                             header=None,
+                             names=list(range(width)),
+                             dtype=np.float64).to_numpy()
+        return L2Arrays.from_rows(values, depth=depth)
+
+    def read(self):
+        return self.read_arrays().to_frame()
 
     @staticmethod
     def _get_columns(df):
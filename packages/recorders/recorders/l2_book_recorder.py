@@ -1,6 +1,7 @@
+import os
 import logging
 
-import pandas as pd
+import pyarrow as pa
 
 from arb_logger.logger import get_logger
 from arb_defines.arb_dataclasses import OrderBook
@@ -10,15 +11,36 @@ from recorders.base_recorder import BaseRecorder, main as base_main
 process_name = 'l2_book_recorder'
 LOGGER = get_logger(process_name, short=True)
 
+# levels recorded per side, missing levels are NaN
+L2_RECORD_DEPTH = int(os.getenv('ARB_L2_RECORD_DEPTH', '10'))
+
+
+def l2_columns(depth: int) -> list[str]:
+    columns = ['instr_id', 'bid_len', 'ask_len']
+    for side in ['bid', 'ask']:
+        for a in range(depth):
+            columns.append(f'{side}_{a}')
+            columns.append(f'{side}_size_{a}')
+    return columns
+
 
 class OrderBookSmall(OrderBook):
+    depth = L2_RECORD_DEPTH
+    columns = l2_columns(L2_RECORD_DEPTH)
+    column_types = {
+        'instr_id': pa.int64(),
+        'bid_len': pa.int64(),
+        'ask_len': pa.int64(),
+    }
 
     def to_list(self):
-        bids = [x for xs in self.bids for x in xs]
-        asks = [x for xs in self.asks for x in xs]
-        return [self.timestamp, self.instr_id,
-                len(self.bids),
-                len(self.asks)] + bids + asks
+        bids = self.bids[:self.depth]
+        asks = self.asks[:self.depth]
+        row = [self.timestamp, self.instr_id, len(bids), len(asks)]
+        for levels in [bids, asks]:
+            row += [x for xs in levels for x in xs]
+            row += [float('nan')] * 2 * (self.depth - len(levels))
+        return row
 
 
 class L2BookRecorder(BaseRecorder):
@@ -0,0 +1,169 @@
+import os
+import threading
+
+from pathlib import Path
+from typing import Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# record batches are written every N rows or when the recorder flushes
+RECORD_FLUSH_ROWS = int(os.getenv('ARB_RECORD_FLUSH_ROWS', '10000'))
+# codec of the record batches, zstd or lz4
+RECORD_COMPRESSION = os.getenv('ARB_RECORD_COMPRESSION', 'zstd')
+
+RECORD_EXTENSION = 'arrow'
+# first column of every record, seconds since epoch
+TIMESTAMP = 'timestamp'
+
+
+def record_schema(columns: list[str],
+                  column_types: Optional[dict] = None) -> pa.Schema:
+    """timestamp then columns, float64 unless typed in column_types"""
+    column_types = column_types or {}
+    return pa.schema([(TIMESTAMP, pa.float64())] +
+                     [(c, column_types.get(c, pa.float64()))
+                      for c in columns])
+
+
+def record_parts(path: Path) -> list[Path]:
+    """
+    Arrow parts of a record, in write order: the record itself then one
+    part per restart of the recorder during the day
+    """
+    path = Path(path).with_suffix(f'.{RECORD_EXTENSION}')
+    parts = [(int(p.suffixes[-2][1:]), p)
+             for p in path.parent.glob(f'{path.stem}.*.{RECORD_EXTENSION}')
+             if p.suffixes[-2][1:].isdigit()]
+    return ([path] if path.exists() else []) + [p for _, p in sorted(parts)]
+
+
+def read_record(path: Path,
+                columns: Optional[list[str]] = None,
+                end: Optional[float] = None) -> Optional[pa.Table]:
+    """
+    Every complete batch of the parts of a record, None without readable
+    parts. A batch cut by a crash ends its part. Parts are memory mapped,
+    only the timestamp and columns are decoded and batches starting after
+    end are not read.
+    """
+    parts = record_parts(path)
+    if not parts:
+        return None
+    batches, schema, options = [], None, None
+    for part in parts:
+        with pa.memory_map(str(part)) as source:
+            try:
+                if columns and options is None:
+                    names = pa.ipc.open_stream(source).schema.names
+                    options = pa.ipc.IpcReadOptions(included_fields=[
+                        names.index(c) for c in [TIMESTAMP] + columns
+                        if c in names
+                    ])
+                    source.seek(0)
+                reader = pa.ipc.open_stream(source, options=options)
+            except (pa.ArrowInvalid, OSError):
+                continue
+            schema = schema or reader.schema
+            while True:
+                try:
+                    batch = reader.read_next_batch()
+                except StopIteration:
+                    break
+                except (pa.ArrowInvalid, OSError):
+                    break
+                if end is not None and batch.num_rows and batch.column(
+                        0)[0].as_py() >= end:
+                    break
+                batches.append(batch)
+    if schema is None:
+        # only parts written before their schema, by older writers
+        return None
+    return pa.Table.from_batches(batches, schema=schema)
+
+
+class RecordWriter:
+    """
+    Streams the rows of a record to compressed Arrow IPC record batches.
+    The stream format has no footer, a crash only loses the rows not yet
+    flushed.
+
+    Values equal to the one of the previous row are written as nulls, as
+    clean_records did with mask(shift(1) == df): readers ffill them.
+    """
+
+    def __init__(self,
+                 path: Path,
+                 schema: pa.Schema,
+                 flush_rows: int = RECORD_FLUSH_ROWS):
+        self.schema = schema
+        self.flush_rows = flush_rows
+        self.path = self._new_part(Path(path))
+        self.rows: list[list] = []
+        # last written value of every column but the timestamp
+        self.prev: Optional[list] = None
+        self.lock = threading.Lock()
+
+        self.sink = pa.OSFile(str(self.path), 'wb')
+        options = pa.ipc.IpcWriteOptions(compression=RECORD_COMPRESSION)
+        self.writer = pa.ipc.new_stream(self.sink, schema, options=options)
+        # the schema is only written with a batch, readers of a part opened
+        # but not flushed yet need it
+        self.writer.write_batch(pa.RecordBatch.from_pylist([], schema=schema))
+        self.sink.flush()
+
+    @staticmethod
+    def _new_part(path: Path) -> Path:
+        """A stream cannot be appended to, a restart writes a new part"""
+        path = path.with_suffix(f'.{RECORD_EXTENSION}')
+        part = 0
+        while path.exists():
+            part += 1
+            path = path.with_name(f'{path.stem.split(".")[0]}.{part}.'
+                                  f'{RECORD_EXTENSION}')
+        return path
+
+    def write(self, row: list):
+        with self.lock:
+            self.rows.append(row)
+            if len(self.rows) >= self.flush_rows:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if not self.rows:
+            return
+        rows, self.rows = self.rows, []
+        columns = [
+            pa.array(values, type=field.type)
+            for values, field in zip(zip(*rows), self.schema)
+        ]
+        last = [c[-1] for c in columns[1:]]
+        for k, column in enumerate(columns[1:], start=1):
+            columns[k] = self._mask_repeated(
+                column, self.prev[k - 1] if self.prev else None)
+        self.prev = last
+
+        self.writer.write_batch(
+            pa.RecordBatch.from_arrays(columns, schema=self.schema))
+        self.sink.flush()
+
+    @staticmethod
+    def _mask_repeated(column: pa.Array,
+                       prev: Optional[pa.Scalar]) -> pa.Array:
+        previous = pa.concat_arrays(
+            [pa.array([None if prev is None else prev.as_py()],
+                      type=column.type),
+             column[:-1]])
+        repeated = pc.fill_null(pc.equal(column, previous), False)
+        return pc.if_else(repeated, pa.nulls(len(column), column.type),
+                          column)
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.writer.close()
+            self.sink.close()
@@ -0,0 +1,347 @@
+import os
+import time
+
+from abc import ABC, abstractmethod
+from collections import defaultdict, deque
+from typing import Callable, Iterator, Optional
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from arb_logger.logger import get_logger
+from arb_utils.resolver import resolve_instruments
+from arb_utils.args_parser import instruments_args_parser
+from arb_defines.arb_dataclasses import FundingRate, OrderBook, Trade
+from redis_manager.redis_handler import RedisHandler
+from redis_manager.redis_events import FundingRateEvent, LiquidationEvent, OrderBookEvent, RedisEvent, TradeEvent
+from recorders.l2_book_reader import L2BookReader
+from recorders.dataset_reader import DatasetReader
+
+LOGGER = get_logger('replay', short=True)
+
+# rows taken from each source per merge step
+REPLAY_BATCH = int(os.getenv('ARB_REPLAY_BATCH', '4096'))
+# pipelined publishes when replaying to redis
+REPLAY_PUBLISH_BATCH = int(os.getenv('ARB_REPLAY_PUBLISH_BATCH', '1000'))
+
+# events with the same timestamp are replayed in this order of recorder type,
+# then by instr_id, then in recorded order
+REPLAY_TYPES = ['l2_book', 'trades', 'funding']
+
+
+class RecordedOrderBook(OrderBook):
+    """
+    OrderBook of a recorded row, its levels are converted to lists on first
+    use: most callbacks only read a few books or the top of the book
+    """
+
+    def __init__(self, instr_id: int, timestamp: float, levels: tuple,
+                 row: int, bid_len: int, ask_len: int):
+        self.instr_id = instr_id
+        self.timestamp = timestamp
+        # (bids, asks) arrays of the day
+        self._levels = levels
+        self._row = row
+        self._bid_len = bid_len
+        self._ask_len = ask_len
+        self._bids = None
+        self._asks = None
+
+    @property
+    def bids(self) -> list:
+        if self._bids is None:
+            self._bids = self._levels[0][self._row, :self._bid_len].tolist()
+        return self._bids
+
+    @bids.setter
+    def bids(self, bids: list):
+        self._bids = bids
+
+    @property
+    def asks(self) -> list:
+        if self._asks is None:
+            self._asks = self._levels[1][self._row, :self._ask_len].tolist()
+        return self._asks
+
+    @asks.setter
+    def asks(self, asks: list):
+        self._asks = asks
+
+
+class ReplaySource(ABC):
+    """
+    Recorded rows of one recorder type and instrument, loaded a day at a
+    time and sorted by timestamp
+    """
+    recorder_type = None
+
+    def __init__(self, reader: DatasetReader, instr_id: int,
+                 files: list[tuple]):
+        self.reader = reader
+        self.instr_id = instr_id
+        self.files = deque(files)
+        self.day = None
+        self.times = np.empty(0)
+        self.pos = 0
+
+    def advance(self) -> bool:
+        """False once every day is replayed"""
+        while self.pos >= len(self.times):
+            if not self.files:
+                return False
+            file = self.files.popleft()
+            self.day = file[0]
+            self.pos = 0
+            self.load(*file)
+        return True
+
+    @abstractmethod
+    def load(self, day: str, instr_id: int, path):
+        """Sets times and the columns of the rows of a file"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def event(self, row: int, timestamp: float) -> tuple[type[RedisEvent],
+                                                         object]:
+        raise NotImplementedError
+
+
+class FrameSource(ReplaySource):
+    """Source loading a file as a frame of the dataset reader"""
+
+    def load(self, day, instr_id, path):
+        df = self.reader.read_file(day, instr_id, path)
+        df = df.iloc[np.argsort(df.index.to_numpy(), kind='stable')]
+        self.times = df.index.to_numpy('datetime64[ns]').astype(
+            np.int64) / 1e9
+        self.load_frame(df)
+
+    @abstractmethod
+    def load_frame(self, df: pd.DataFrame):
+        """Sets the columns of the rows of a frame sorted by timestamp"""
+        raise NotImplementedError
+
+
+class L2BookSource(ReplaySource):
+    recorder_type = 'l2_book'
+
+    def load(self, day, instr_id, path):
+        # arrays straight from the record, without a frame
+        arrays = L2BookReader(
+            instr_id, date=datetime.strptime(day, '%Y%m%d')).read_arrays()
+        keep = np.flatnonzero((arrays.times >= self.reader.start)
+                              & (arrays.times < self.reader.end))
+        keep = keep[np.argsort(arrays.times[keep], kind='stable')]
+        self.times = arrays.times[keep]
+        self.bid_len = arrays.bid_len[keep].tolist()
+        self.ask_len = arrays.ask_len[keep].tolist()
+        self.levels = (arrays.bids[keep], arrays.asks[keep])
+
+    def event(self, row, timestamp):
+        return OrderBookEvent, RecordedOrderBook(self.instr_id, timestamp,
+                                                 self.levels, row,
+                                                 self.bid_len[row],
+                                                 self.ask_len[row])
+
+
+class TradesSource(FrameSource):
+    recorder_type = 'trades'
+
+    def load_frame(self, df: pd.DataFrame):
+        self.qty = df['qty'].to_numpy(np.float64).tolist()
+        self.price = df['price'].to_numpy(np.float64).tolist()
+        self.is_liquidation = df['is_liquidation'].to_numpy(bool).tolist()
+        self.trade_count = df['trade_count'].to_numpy(np.int64).tolist()
+
+    def event(self, row, timestamp):
+        is_liquidation = self.is_liquidation[row]
+        return (LiquidationEvent if is_liquidation else TradeEvent,
+                Trade(id=f'{self.instr_id}:{self.day}:{row}',
+                      time=timestamp,
+                      qty=self.qty[row],
+                      price=self.price[row],
+                      instr_id=self.instr_id,
+                      is_liquidation=is_liquidation,
+                      trade_count=self.trade_count[row]))
+
+
+class FundingSource(FrameSource):
+    recorder_type = 'funding'
+
+    def load_frame(self, df: pd.DataFrame):
+        self.rate = df['rate'].to_numpy(np.float64).tolist()
+        self.predicted_rate = df['predicted_rate'].to_numpy(
+            np.float64).tolist()
+        self.next_funding_time = [
+            None if pd.isna(t) else
+            t.to_pydatetime() if isinstance(t, pd.Timestamp) else t
+            for t in df['next_funding_time']
+        ]
+
+    def event(self, row, timestamp):
+        return FundingRateEvent, FundingRate(self.instr_id, self.rate[row],
+                                             self.predicted_rate[row],
+                                             self.next_funding_time[row],
+                                             timestamp)
+
+
+SOURCES = {
+    source.recorder_type: source
+    for source in [L2BookSource, TradesSource, FundingSource]
+}
+
+
+class Replay:
+    """
+    Replays recorded books, trades and funding rates of many instruments
+    as OrderBookEvent, TradeEvent (LiquidationEvent for liquidations) and
+    FundingRateEvent, to redis and/or to in-process callbacks.
+
+    Sources are k-way merged a window at a time: every source gives its
+    rows up to the earliest end of the next batch rows of the sources, the
+    window is sorted by (timestamp, recorder type, instr_id, recorded row).
+    The order only depends on the records. Payloads are built as they are
+    replayed and books convert their levels on first use. speed is a
+    multiple of the recorded pace, None replays as fast as possible.
+    """
+
+    def __init__(self,
+                 start,
+                 end=None,
+                 instr_ids: Optional[list[int]] = None,
+                 recorder_types: list[str] = REPLAY_TYPES,
+                 speed: Optional[float] = None,
+                 redis_handler: Optional[RedisHandler] = None,
+                 batch: int = REPLAY_BATCH):
+        for recorder_type in recorder_types:
+            if recorder_type not in SOURCES:
+                raise ValueError(f'unknown recorder type {recorder_type}')
+        self.speed = speed
+        self.redis_handler = redis_handler
+        self.batch = batch
+        self.callbacks: dict[type[RedisEvent],
+                             list[Callable]] = defaultdict(list)
+        self.counts = defaultdict(int)
+
+        self.sources: list[ReplaySource] = []
+        for recorder_type in sorted(recorder_types, key=REPLAY_TYPES.index):
+            reader = DatasetReader(recorder_type, start, end, instr_ids)
+            files = defaultdict(list)
+            for file in reader.files():
+                files[file[1]].append(file)
+            for instr_id in sorted(files):
+                self.sources.append(SOURCES[recorder_type](
+                    reader, instr_id, files[instr_id]))
+
+    def subscribe(self, redis_event: type[RedisEvent],
+                  callbacks: Callable | list[Callable]):
+        if not isinstance(callbacks, list):
+            callbacks = [callbacks]
+        self.callbacks[redis_event] += callbacks
+
+    def events(self) -> Iterator[tuple[float, type[RedisEvent], object]]:
+        """(timestamp, event, payload) in replay order"""
+        # rank of a source is its position, sources are sorted by type and id
+        active = [(rank, source)
+                  for rank, source in enumerate(self.sources)
+                  if source.advance()]
+        while active:
+            horizon = min(
+                source.times[min(source.pos + self.batch, len(source.times))
+                             - 1] for _, source in active)
+            times, ranks, rows = [], [], []
+            for rank, source in active:
+                stop = source.pos + int(
+                    np.searchsorted(source.times[source.pos:], horizon,
+                                    'right'))
+                times.append(source.times[source.pos:stop])
+                ranks.append(np.full(stop - source.pos, rank))
+                rows.append(np.arange(source.pos, stop))
+                source.pos = stop
+
+            times, ranks, rows = (np.concatenate(times),
+                                  np.concatenate(ranks),
+                                  np.concatenate(rows))
+            order = np.lexsort((rows, ranks, times))
+            # payloads are built as they are replayed
+            for timestamp, rank, row in zip(times[order].tolist(),
+                                            ranks[order].tolist(),
+                                            rows[order].tolist()):
+                yield (timestamp, *self.sources[rank].event(row, timestamp))
+            active = [(rank, source) for rank, source in active
+                      if source.advance()]
+
+    def publish(self, redis_event: type[RedisEvent], payload):
+        self.counts[redis_event] += 1
+        for callback in self.callbacks.get(redis_event, ()):
+            callback(payload)
+        if self.redis_handler:
+            self.redis_handler.publish_event(redis_event, payload)
+
+    def run(self) -> int:
+        """Replays every event, returns how many"""
+        wall_start, time_start = time.perf_counter(), None
+        for timestamp, redis_event, payload in self.events():
+            if self.speed:
+                if time_start is None:
+                    time_start = timestamp
+                delay = ((timestamp - time_start) / self.speed -
+                         (time.perf_counter() - wall_start))
+                if delay > 0:
+                    time.sleep(delay)
+            self.publish(redis_event, payload)
+        if self.redis_handler:
+            self.redis_handler.flush()
+
+        seconds = time.perf_counter() - wall_start
+        total = sum(self.counts.values())
+        for redis_event, count in self.counts.items():
+            LOGGER.info(f'{redis_event.__name__}: {count}')
+        LOGGER.info(f'Replayed {total} events in {seconds:.1f}s, '
+                    f'{total / max(seconds, 1e-9):.0f} events/s')
+        return total
+
+
+def main():
+    parser = instruments_args_parser(
+        description='Replays recorded books, trades and funding rates')
+    parser.add_argument('--start',
+                        required=True,
+                        help='YYYYMMDD or ISO time, UTC')
+    parser.add_argument('--end', help='YYYYMMDD or ISO time, default now')
+    parser.add_argument('-r',
+                        '--records',
+                        nargs='+',
+                        choices=REPLAY_TYPES,
+                        default=REPLAY_TYPES)
+    parser.add_argument('-s',
+                        '--speed',
+                        type=float,
+                        help='multiple of the recorded pace, default max')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--publish-batch',
+                        type=int,
+                        default=REPLAY_PUBLISH_BATCH)
+    args = parser.parse_args()
+
+    instr_ids = args.instr_ids
+    if not instr_ids and (args.bases or args.quotes or args.exchanges):
+        instr_ids = [i.id for i in resolve_instruments(args)]
+
+    redis_handler = RedisHandler(args.host,
+                                 args.port,
+                                 LOGGER,
+                                 publish_batch=args.publish_batch)
+    replay = Replay(args.start,
+                    args.end,
+                    instr_ids,
+                    args.records,
+                    args.speed,
+                    redis_handler=redis_handler)
+    replay.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,8 @@ import logging
 from typing import Optional
 from datetime import datetime
 
+import pyarrow as pa
+
 from cryptofeed.defines import *
 
 from arb_defines.defines import *
@@ -23,6 +25,11 @@ class TradeSmall:
     trade_count: int = 1
 
     columns = ['instr_id', 'qty', 'price', 'is_liquidation', 'trade_count']
+    column_types = {
+        'instr_id': pa.int64(),
+        'is_liquidation': pa.bool_(),
+        'trade_count': pa.int64(),
+    }
 
     def to_list(self):
         return [
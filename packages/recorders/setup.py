@@ -20,6 +20,7 @@ setup(
             'l2_book_recorder = recorders.l2_book_recorder:main',
             'clean_records = recorders.clean_records:main',
             'fold_records = recorders.fold_records:main',
+            'replay = recorders.replay:main',
         ]
     },
 )
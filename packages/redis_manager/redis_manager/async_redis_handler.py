@@ -0,0 +1,213 @@
+import os
+import time
+import asyncio
+import traceback
+
+from typing import Callable
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from redis.asyncio import Redis as AsyncRedis
+
+from redis_manager.redis_events import REDIS_ENCODING_ERRORS, WIRE_CODEC
+from redis_manager.redis_handler import RedisHandler
+
+# RedisManager uses AsyncRedisHandler instead of RedisHandler
+REDIS_ASYNC = os.getenv('ARB_REDIS_ASYNC', '0') == '1'
+# threads running deserialization and callbacks, more than 1 runs callbacks
+# of different channels concurrently: only for thread safe callbacks
+REDIS_WORKERS = int(os.getenv('ARB_REDIS_WORKERS', '1'))
+# pending messages of a lane at most, the oldest are dropped beyond
+MAX_PENDING = int(os.getenv('ARB_REDIS_MAX_PENDING', '10000'))
+
+
+class AsyncRedisHandler(RedisHandler):
+    """
+    RedisHandler reading the socket on an asyncio loop.
+
+    Messages are queued and handled (deserialize + callbacks) by worker
+    threads while the socket is always read. With one worker, the default,
+    callbacks run one at a time in the order messages arrived, as with
+    RedisHandler. With more workers messages are queued by channel, one
+    message of a channel at a time so the order within a channel is kept and
+    a slow callback only delays its channel, but callbacks of different
+    channels run concurrently and must be thread safe.
+
+    A conflated subscription only keeps its newest pending message, in place
+    of the previous one. A lane keeps MAX_PENDING messages at most: when its
+    callbacks fall that far behind the oldest are dropped and logged as
+    errors. Heartbeats are scheduled on the same loop, and run
+    by the workers.
+    """
+
+    def __init__(self,
+                 host='localhost',
+                 port=6379,
+                 logger=None,
+                 wire_codec=WIRE_CODEC,
+                 workers=REDIS_WORKERS):
+        super().__init__(host, port, logger, wire_codec)
+        self.async_redis_instance = AsyncRedis(
+            host=host,
+            port=port,
+            decode_responses=True,
+            encoding_errors=REDIS_ENCODING_ERRORS)
+        self.async_pubsub = self.async_redis_instance.pubsub()
+        self.workers = workers
+        self.executor: ThreadPoolExecutor = None
+        self.loop: asyncio.AbstractEventLoop = None
+
+        # pending messages by lane (channel, or '' with one worker), and
+        # lanes being handled
+        self.pending: dict[str, deque] = {}
+        # pending message of a conflated (pattern or channel, channel)
+        self._newest: dict[tuple, list] = {}
+        self._draining: dict[str, asyncio.Task] = {}
+        # messages dropped by channel, and by lane while it is behind
+        self.dropped = Counter()
+        self._behind: dict[str, int] = {}
+        self._heartbeats: list[tuple] = []
+        self._tasks: set[asyncio.Task] = set()
+
+    def _subscribe(self, *channels: str):
+        self._run_on_loop(self.async_pubsub.subscribe(*channels))
+
+    def _psubscribe(self, pattern: str):
+        self._run_on_loop(self.async_pubsub.psubscribe(pattern))
+
+    def _run_on_loop(self, coroutine):
+        """Before run, subscriptions are sent when the loop starts"""
+        if self.loop is None:
+            coroutine.close()
+        else:
+            asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def heartbeat_event(self,
+                        period: float,
+                        callback: Callable,
+                        is_pile=False,
+                        offset=0):
+        self._heartbeats.append((period, callback, is_pile, offset))
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._start_heartbeat, period,
+                                           callback, is_pile, offset)
+
+    def run(self):
+        asyncio.run(self.run_async())
+
+    async def run_async(self):
+        self.loop = asyncio.get_running_loop()
+        self.executor = ThreadPoolExecutor(self.workers,
+                                           thread_name_prefix='redis_worker')
+        self.logger.info(f'subscribed to channels {list(self.events.keys())}'
+                         f' with {self.workers} workers')
+
+        patterns = [c for c in self.events if c.endswith('*')]
+        channels = [c for c in self.events if not c.endswith('*')]
+        if patterns:
+            await self.async_pubsub.psubscribe(*patterns)
+        if channels:
+            await self.async_pubsub.subscribe(*channels)
+        for heartbeat in self._heartbeats:
+            self._start_heartbeat(*heartbeat)
+
+        if not self.events:
+            self.logger.warning('no events subscribed, will run forever')
+        while True:
+            async for message in self.async_pubsub.listen():
+                if message and message['type'] in ['message', 'pmessage']:
+                    self._dispatch(message)
+            # nothing subscribed yet
+            await asyncio.sleep(1)
+
+    def _create_task(self, coroutine) -> asyncio.Task:
+        task = self.loop.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _dispatch(self, message):
+        channel = message['channel']
+        key = message['pattern'] or channel
+        event_handler = self.events.get(key)
+        newest = None
+        if event_handler and event_handler.conflate:
+            newest = (key, channel)
+            pending_message = self._newest.get(newest)
+            if pending_message is not None:
+                # messages being handled are already out of pending
+                pending_message[0] = message
+                self.conflated[channel] += 1
+                return
+        pending_message = [message, newest]
+        if newest is not None:
+            self._newest[newest] = pending_message
+
+        lane = channel if self.workers > 1 else ''
+        pending = self.pending.get(lane)
+        if pending is None:
+            pending = self.pending[lane] = deque()
+        pending.append(pending_message)
+
+        if len(pending) > MAX_PENDING:
+            dropped, dropped_newest = pending.popleft()
+            if dropped_newest is not None:
+                del self._newest[dropped_newest]
+            self.dropped[dropped['channel']] += 1
+            if lane not in self._behind:
+                self._behind[lane] = 0
+                self.logger.error(
+                    f'{lane or "all channels"} has {MAX_PENDING} pending '
+                    f'messages, callbacks are too slow: dropping the oldest')
+            self._behind[lane] += 1
+
+        if lane not in self._draining:
+            self._draining[lane] = self._create_task(
+                self._drain(lane, pending))
+
+    async def _drain(self, lane: str, pending: deque):
+        while pending:
+            message, newest = pending.popleft()
+            if newest is not None:
+                del self._newest[newest]
+            await self.loop.run_in_executor(self.executor,
+                                            self._handle_message, message)
+        del self._draining[lane]
+        dropped = self._behind.pop(lane, 0)
+        if dropped:
+            self.logger.error(f'{lane or "all channels"} caught up, dropped '
+                              f'{dropped} messages, most dropped: '
+                              f'{self.dropped.most_common(3)}')
+        self._log_conflation()
+
+    def _start_heartbeat(self, period, callback, is_pile, offset):
+        self.logger.info(f'Start heartbeat {callback} every {period}s')
+        self._create_task(self._heartbeat(period, callback, is_pile, offset))
+
+    def _call_heartbeat(self, callback: Callable):
+        try:
+            callback()
+        except Exception:
+            self.logger.error(traceback.format_exc())
+
+    async def _heartbeat(self, period, callback: Callable, is_pile, offset):
+        """Same schedule as RedisManager._wrap_heartbeat_callback"""
+        start_time = (0 if is_pile else time.time()) + offset
+        first = True
+        while True:
+            last_time = time.time()
+            if not (first and is_pile):
+                self.logger.debug(f'Calling heartbeat callback {callback}')
+                await self.loop.run_in_executor(self.executor,
+                                                self._call_heartbeat, callback)
+            first = False
+            duration = time.time() - last_time
+            await asyncio.sleep(max(0.5 - duration, 0))
+
+            if duration > period:
+                self.logger.warning(
+                    f'Heartbeat callback {callback} took {duration:.2f} seconds, which is longer than period {period}'
+                )
+            else:
+                await asyncio.sleep(period -
+                                    ((time.time() - start_time) % period))
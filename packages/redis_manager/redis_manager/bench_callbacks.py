@@ -0,0 +1,57 @@
+import timeit
+
+from argparse import ArgumentParser
+
+from arb_logger.logger import get_logger
+from redis_manager.redis_events import OrderBookEvent
+from redis_manager.redis_handler import EventHandler, RedisHandler
+
+LOGGER = get_logger('bench_callbacks', short=True)
+
+
+def noop(payload):
+    pass
+
+
+def build_handler(profile: bool, callbacks: int) -> RedisHandler:
+    # not subscribed, messages are handled directly without redis
+    redis_handler = RedisHandler(logger=LOGGER, profile_callbacks=profile)
+    redis_handler.events[OrderBookEvent.channel] = EventHandler(
+        OrderBookEvent, [noop] * callbacks, deserialize=False)
+    return redis_handler
+
+
+def bench(redis_handler: RedisHandler, number: int) -> float:
+    message = {
+        'type': 'message',
+        'pattern': None,
+        'channel': OrderBookEvent.channel,
+        'data': '{}',
+    }
+    handle = redis_handler._handle_message
+    return timeit.timeit(lambda: handle(message), number=number) / number
+
+
+def main():
+    parser = ArgumentParser(
+        description='Overhead of callback profiling in RedisHandler')
+    parser.add_argument('-n', '--number', type=int, default=200000)
+    parser.add_argument('--callbacks', type=int, default=1)
+    args = parser.parse_args()
+
+    callbacks = [noop] * args.callbacks
+    direct = timeit.timeit(lambda: [c('{}') for c in callbacks],
+                           number=args.number) / args.number
+    disabled = bench(build_handler(False, args.callbacks), args.number)
+    enabled = bench(build_handler(True, args.callbacks), args.number)
+
+    LOGGER.info(f'{"mode":<20}{"ns/message":>12}{"overhead ns":>14}')
+    for mode, duration in [('callbacks only', direct),
+                           ('profiling disabled', disabled),
+                           ('profiling enabled', enabled)]:
+        LOGGER.info(f'{mode:<20}{duration * 1e9:>12.0f}'
+                    f'{(duration - disabled) * 1e9:>14.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import time
+import uuid
+import timeit
+
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+
+from arb_logger.logger import get_logger
+from arb_defines.arb_dataclasses import FundingRate, Order, OrderBook, Trade
+from redis_manager.redis_events import REDIS_ENCODING_ERRORS, WIRE_CODEC_BINARY, WIRE_CODEC_JSON, FundingRateEvent, OrderBookEvent, OrderEvent, RedisEvent, TradeEvent
+
+LOGGER = get_logger('bench_codec', short=True)
+
+
+def sample_payloads() -> list[tuple[RedisEvent, object]]:
+    now = time.time()
+    orderbook = OrderBook(instr_id=42,
+                          bids=[(30000.0 - i * 0.5, 1.0 + i)
+                                for i in range(10)],
+                          asks=[(30000.5 + i * 0.5, 1.0 + i)
+                                for i in range(10)],
+                          timestamp=now)
+    trade = Trade(time=now,
+                  qty=-0.012,
+                  price=30000.5,
+                  exchange_order_id='1195950340',
+                  instr_id=42,
+                  exchange_id=1)
+    funding_rate = FundingRate(instr_id=42,
+                               rate=0.0001,
+                               predicted_rate=0.00012,
+                               next_funding_time=datetime.now(tz=timezone.utc),
+                               timestamp=now)
+    order = Order(price=30000.0,
+                  qty=0.01,
+                  order_type='limit',
+                  instr_id=42,
+                  exchange_id=1,
+                  strat_id=1,
+                  event_type='mm_grid',
+                  event_key=uuid.uuid4(),
+                  time_open=datetime.now(tz=timezone.utc))
+    return [(OrderBookEvent, orderbook), (TradeEvent, trade),
+            (FundingRateEvent, funding_rate), (OrderEvent, order)]
+
+
+def bench_codec(redis_event: RedisEvent, payload, codec: str, number: int):
+    data = redis_event.encode(payload, codec)
+    size = len(data.encode() if isinstance(data, str) else data)
+    if isinstance(data, bytes):
+        # what subscribers receive from a decode_responses client
+        data = data.decode('utf-8', REDIS_ENCODING_ERRORS)
+
+    encode = timeit.timeit(lambda: redis_event.encode(payload, codec),
+                           number=number)
+    decode = timeit.timeit(lambda: redis_event.deserialize(data),
+                           number=number)
+    return size, encode / number * 1e6, decode / number * 1e6
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark redis wire codecs')
+    parser.add_argument('-n', '--number', type=int, default=20000)
+    args = parser.parse_args()
+
+    LOGGER.info(f'{"event":<18}{"codec":<8}{"size":>6}'
+                f'{"encode us":>12}{"decode us":>12}')
+    for redis_event, payload in sample_payloads():
+        for codec in [WIRE_CODEC_JSON, WIRE_CODEC_BINARY]:
+            size, encode, decode = bench_codec(redis_event, payload, codec,
+                                               args.number)
+            LOGGER.info(f'{redis_event.__name__:<18}{codec:<8}{size:>6}'
+                        f'{encode:>12.2f}{decode:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+import enum
+import simplejson as json
+import uuid
+import random
+import timeit
+import typing
+import dataclasses
+
+from unittest import mock
+from argparse import ArgumentParser
+from datetime import datetime, timedelta, timezone
+
+from dacite import from_dict
+
+from arb_logger.logger import get_logger
+from arb_defines.arb_dataclasses import ConnectionStatus
+from redis_manager.decoders import _is_union
+from redis_manager.redis_events import RedisEvent
+from redis_manager.bench_codec import sample_payloads
+
+LOGGER = get_logger('bench_decoders', short=True)
+
+# ids generated by __post_init__ when missing, pinned to compare decoders
+FIXED_UUID = uuid.UUID(int=0)
+
+
+def payload_events() -> dict[type, RedisEvent]:
+    """One event per payload class, the decoder is shared by payload class"""
+    events = {}
+    stack = list(RedisEvent.__subclasses__())
+    while stack:
+        redis_event = stack.pop()
+        stack.extend(redis_event.__subclasses__())
+        if redis_event.payload_decoder is not None:
+            events.setdefault(redis_event.payload_class, redis_event)
+    return events
+
+
+def random_value(rng: random.Random, type_, wrong_rate: float):
+    if rng.random() < wrong_rate:
+        return rng.choice([rng.random(), rng.randint(-5, 5), 'x', [], {}])
+
+    if _is_union(type_):
+        members = typing.get_args(type_)
+        if type(None) in members and rng.random() < 0.3:
+            return None
+        members = [m for m in members if m is not type(None)]
+        return random_value(rng, rng.choice(members), wrong_rate)
+
+    if dataclasses.is_dataclass(type_):
+        return random_data(rng, type_, wrong_rate)
+    if type_ is bool:
+        return rng.random() < 0.5
+    if type_ is int:
+        return rng.randint(0, 10**6)
+    if type_ is float:
+        return rng.uniform(-1e5, 1e5)
+    if type_ is str:
+        return rng.choice(['limit', 'market', 'UP', 'DOWN', 'binance'])
+    if type_ is uuid.UUID:
+        return str(uuid.UUID(int=rng.getrandbits(128)))
+    if type_ is datetime:
+        time = datetime(2022, 1, 1, tzinfo=timezone.utc) + timedelta(
+            microseconds=rng.getrandbits(40))
+        return time.isoformat()
+    if type_ is list:
+        return [[rng.uniform(0, 1e5), rng.uniform(0, 10)]
+                for _ in range(rng.randint(0, 10))]
+    if type_ is dict:
+        return {'key': rng.random()}
+    if isinstance(type_, type) and issubclass(type_, enum.Enum):
+        return rng.choice(list(type_)).name
+    raise ValueError(f'no random value for {type_}')
+
+
+def random_data(rng: random.Random, data_class, wrong_rate: float) -> dict:
+    """Random json like dict, fields with a default are sometimes missing"""
+    hints = typing.get_type_hints(data_class)
+    data = {}
+    for field in dataclasses.fields(data_class):
+        has_default = (field.default is not dataclasses.MISSING
+                       or field.default_factory is not dataclasses.MISSING)
+        if has_default and rng.random() < 0.2:
+            continue
+        data[field.name] = random_value(rng, hints[field.name], wrong_rate)
+    return data
+
+
+def state(obj):
+    """Comparable state, dataclass __eq__ only compares ids"""
+    if dataclasses.is_dataclass(obj):
+        return (type(obj), {
+            k: state(v)
+            for k, v in vars(obj).items()
+            # set to time.time() by the constructor
+            if not (isinstance(obj, ConnectionStatus) and k == 'timestamp')
+        })
+    if (isinstance(obj, datetime) and obj.tzinfo
+            and abs(datetime.now(tz=timezone.utc) - obj) < timedelta(minutes=1)):
+        # defaulted to now by __post_init__
+        return 'now'
+    if isinstance(obj, list | tuple):
+        return [state(v) for v in obj]
+    return obj
+
+
+def decode_state(decode, data):
+    try:
+        with mock.patch('uuid.uuid4', return_value=FIXED_UUID):
+            return True, state(decode(data))
+    except Exception:
+        return False, None
+
+
+def check_decoders(number: int, seed: int, wrong_rate: float) -> int:
+    """Decoded objects and failures must match dacite, returns mismatches"""
+    rng = random.Random(seed)
+    mismatches = 0
+    for payload_class, redis_event in payload_events().items():
+        decoded = 0
+        for _ in range(number):
+            data = random_data(rng, payload_class, wrong_rate)
+            cases = [data]
+            ok, _ = decode_state(redis_event.payload_decoder, data)
+            if ok:
+                # round trip through the wire format
+                obj = redis_event.payload_decoder(data)
+                cases.append(json.loads(redis_event.serialize(obj) or '{}'))
+
+            for case in cases:
+                expected = decode_state(
+                    lambda d: from_dict(payload_class, d, redis_event.
+                                        dacite_config), case)
+                result = decode_state(redis_event.payload_decoder, case)
+                decoded += result[0]
+                if result != expected:
+                    mismatches += 1
+                    LOGGER.error(f'{payload_class.__name__} {case} '
+                                 f'dacite: {expected} generated: {result}')
+        LOGGER.info(f'{payload_class.__name__:<18}{decoded:>6} decoded')
+    return mismatches
+
+
+def main():
+    parser = ArgumentParser(
+        description='Check and benchmark generated payload decoders')
+    parser.add_argument('-n', '--number', type=int, default=20000)
+    parser.add_argument('--check', type=int, default=0,
+                        help='random payloads per class compared to dacite')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--wrong-rate', type=float, default=0.02)
+    args = parser.parse_args()
+
+    if args.check:
+        mismatches = check_decoders(args.check, args.seed, args.wrong_rate)
+        LOGGER.info(f'{mismatches} mismatches')
+        if mismatches:
+            raise SystemExit(1)
+
+    LOGGER.info(f'{"event":<18}{"dacite us":>12}{"generated us":>14}')
+    for redis_event, payload in sample_payloads():
+        data = json.loads(redis_event.serialize(payload))
+        dacite = timeit.timeit(lambda: from_dict(
+            redis_event.payload_class, data, redis_event.dacite_config),
+                               number=args.number)
+        generated = timeit.timeit(lambda: redis_event.payload_decoder(data),
+                                  number=args.number)
+        LOGGER.info(f'{redis_event.__name__:<18}'
+                    f'{dacite / args.number * 1e6:>12.2f}'
+                    f'{generated / args.number * 1e6:>14.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import time
+
+from argparse import ArgumentParser
+
+from cryptofeed.defines import FUNDING, PERPETUAL
+
+from arb_logger.logger import get_logger
+from arb_defines.defines import BALANCE, EXCHANGE, INSTRUMENT, POSITION, STATUS_L2_BOOK, STATUS_TRADES
+from arb_defines.arb_dataclasses import Balance, Exchange, FundingRate, Instrument, Order, Position
+from redis_manager import redis_wrappers
+from redis_manager.redis_handler import RedisHandler
+from redis_manager.redis_manager import RedisManager
+from redis_manager.redis_events import BalanceEvent, FundingRateEvent, OrderBookEvent, OrderEvent, PositionEvent, TradeEvent
+
+LOGGER = get_logger('bench_hydration', short=True)
+
+
+def sample_instruments(instruments: int, exchanges: int) -> list[Instrument]:
+    exchange_list = [
+        Exchange(id=k + 1, feed_name=f'BENCH{k}', exchange_name=f'bench{k}')
+        for k in range(exchanges)
+    ]
+    return [
+        Instrument(id=k + 1,
+                   exchange=exchange_list[k % exchanges],
+                   instr_code=f'BENCH{k}-USDT-PERP',
+                   base=f'BENCH{k}',
+                   quote='USDT',
+                   instr_type=PERPETUAL,
+                   feed_code=f'BENCH{k}-USDT-PERP',
+                   instr_status='active') for k in range(instruments)
+    ]
+
+
+def seed(redis_handler: RedisHandler, instruments: list[Instrument],
+         orders: int):
+    """Position, funding, status and open orders of every instrument and
+    balances of every exchange, as written by the feed handlers"""
+    pipeline = redis_handler.redis_instance.pipeline(transaction=False)
+    exchanges = {i.exchange.id: i.exchange for i in instruments}
+    for exchange in exchanges.values():
+        for currency in ['USDT', 'BTC', 'ETH']:
+            pipeline.hset(
+                f'{EXCHANGE}:{exchange.id}', f'{BALANCE}:{currency}',
+                BalanceEvent.serialize(
+                    Balance(exchange.id, currency, qty=1000,
+                            total_qty=1000)))
+    for instr in instruments:
+        pipeline.hset(
+            f'{INSTRUMENT}:{instr.id}',
+            mapping={
+                POSITION:
+                PositionEvent.serialize(
+                    Position(instr.id, qty=1.5, price=100.)),
+                FUNDING:
+                FundingRateEvent.serialize(
+                    FundingRate(instr.id, rate=1e-4, predicted_rate=1e-4)),
+                STATUS_TRADES:
+                'UP',
+                STATUS_L2_BOOK:
+                'UP',
+            })
+        for k in range(orders):
+            order = Order(instr=instr,
+                          exchange_order_id=f'{instr.id}-{k}',
+                          price=100. + k,
+                          qty=1.,
+                          order_status='open')
+            pipeline.hset(instr.orders_hash, str(order.id),
+                          OrderEvent.serialize(order))
+    pipeline.execute()
+
+
+def clean(redis_handler: RedisHandler, instruments: list[Instrument]):
+    keys = [f'{INSTRUMENT}:{i.id}' for i in instruments]
+    keys += [i.orders_hash for i in instruments]
+    keys += list({f'{EXCHANGE}:{i.exchange.id}' for i in instruments})
+    redis_handler.redis_instance.delete(*keys)
+
+
+def time_to_ready(instruments: list[Instrument], host: str,
+                  port: int) -> float:
+    """Seconds until a watcher of the instruments starts listening"""
+    start = time.perf_counter()
+    redis_manager = RedisManager(instruments,
+                                 has_orders=True,
+                                 host=host,
+                                 port=port)
+    redis_manager.subscribe_event(OrderBookEvent(redis_manager.instruments))
+    redis_manager.subscribe_event(TradeEvent(redis_manager.instruments))
+    # what run does before listening
+    redis_manager.refresh_all()
+    seconds = time.perf_counter() - start
+    redis_manager.redis_handler.pubsub.close()
+    return seconds
+
+
+def main():
+    parser = ArgumentParser(
+        description='Time to ready of a RedisManager against a local '
+        'redis-server seeded with positions, fundings, statuses, balances '
+        'and open orders. Batch 1 is one round trip per object, as before '
+        'pipelined hydration.')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('-n', '--instruments', type=int, default=1500)
+    parser.add_argument('--exchanges', type=int, default=10)
+    parser.add_argument('--orders', type=int, default=2)
+    parser.add_argument('--batches',
+                        type=int,
+                        nargs='+',
+                        default=[1, redis_wrappers.HYDRATION_BATCH])
+    args = parser.parse_args()
+
+    instruments = sample_instruments(args.instruments, args.exchanges)
+    redis_handler = RedisHandler(args.host, args.port)
+    seed(redis_handler, instruments, args.orders)
+    try:
+        LOGGER.info(f'{"batch":>8}{"ready ms":>12}')
+        for batch in args.batches:
+            redis_wrappers.HYDRATION_BATCH = batch
+            seconds = time_to_ready(instruments, args.host, args.port)
+            LOGGER.info(f'{batch:>8}{seconds * 1e3:>12.1f}')
+    finally:
+        clean(redis_handler, instruments)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import time
+import threading
+
+from argparse import ArgumentParser
+
+from arb_logger.logger import get_logger
+from arb_defines.arb_dataclasses import OrderBook, Trade
+from redis_manager.redis_events import WIRE_CODEC_BINARY, WIRE_CODEC_JSON, OrderBookEvent, TradeEvent
+from redis_manager.local_redis_handler import LocalBus, LocalRedisHandler
+
+LOGGER = get_logger('bench_local_bus', short=True)
+
+
+def sample_payloads(number: int, instruments: int) -> list[tuple]:
+    """(event, payload), a trade every 4 books"""
+    now = time.time()
+    payloads = []
+    for i in range(number):
+        instr_id = i % instruments + 1
+        if i % 5 == 4:
+            payloads.append((TradeEvent,
+                             Trade(time=now + i * 1e-3,
+                                   qty=0.012 if i % 2 else -0.012,
+                                   price=30000.5 + i % 10,
+                                   instr_id=instr_id,
+                                   exchange_id=1)))
+        else:
+            payloads.append((OrderBookEvent,
+                             OrderBook(instr_id=instr_id,
+                                       bids=[(30000.0 - k * 0.5, 1.0 + k)
+                                             for k in range(10)],
+                                       asks=[(30000.5 + k * 0.5, 1.0 + k)
+                                             for k in range(10)],
+                                       timestamp=now + i * 1e-3)))
+    return payloads
+
+
+def bench_local(payloads: list[tuple], seekers: int,
+                conflate: bool) -> tuple[float, int]:
+    """Publish rate until every seeker thread handled its messages"""
+    bus = LocalBus()
+    sentinel = LocalRedisHandler(logger=LOGGER, bus=bus)
+    received = [0] * seekers
+    threads = []
+    for k in range(seekers):
+        seeker = LocalRedisHandler(logger=LOGGER, bus=bus)
+
+        def count(payload, k=k):
+            received[k] += 1
+
+        seeker.psubscribe_event(OrderBookEvent, count, conflate=conflate)
+        seeker.psubscribe_event(TradeEvent, count)
+        thread = threading.Thread(target=seeker.run, daemon=True)
+        thread.start()
+        threads.append((seeker, thread))
+
+    start = time.perf_counter()
+    for redis_event, payload in payloads:
+        sentinel.publish_event(redis_event, payload)
+    for seeker, thread in threads:
+        seeker.stop()
+        thread.join()
+    return len(payloads) / (time.perf_counter() - start), min(received)
+
+
+def bench_codec(payloads: list[tuple], codec: str) -> float:
+    """Encode and decode rate, what redis costs before the network"""
+    start = time.perf_counter()
+    for redis_event, payload in payloads:
+        redis_event.deserialize(redis_event.encode(payload, codec))
+    return len(payloads) / (time.perf_counter() - start)
+
+
+def main():
+    parser = ArgumentParser(
+        description='Books and trades from a sentinel to seekers running in '
+        'threads on a local bus, against the encode and decode redis needs')
+    parser.add_argument('-n', '--number', type=int, default=100000)
+    parser.add_argument('--instruments', type=int, default=20)
+    parser.add_argument('--seekers', type=int, nargs='+', default=[1, 4])
+    args = parser.parse_args()
+
+    payloads = sample_payloads(args.number, args.instruments)
+
+    LOGGER.info(f'{"transport":<28}{"msg/s":>12}{"received":>10}')
+    for codec in [WIRE_CODEC_JSON, WIRE_CODEC_BINARY]:
+        rate = bench_codec(payloads, codec)
+        LOGGER.info(f'{codec + " codec":<28}{rate:>12.0f}{"":>10}')
+    for seekers in args.seekers:
+        for conflate in [False, True]:
+            rate, received = bench_local(payloads, seekers, conflate)
+            name = f'local {seekers} seekers{" conflated" if conflate else ""}'
+            LOGGER.info(f'{name:<28}{rate:>12.0f}{received:>10}')
+
+
+if __name__ == '__main__':
+    main()
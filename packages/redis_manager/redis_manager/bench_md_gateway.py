@@ -0,0 +1,141 @@
+import os
+import time
+import shutil
+import asyncio
+import tempfile
+import threading
+import multiprocessing
+
+from argparse import ArgumentParser
+
+import numpy as np
+
+from arb_logger.logger import get_logger
+from arb_defines.arb_dataclasses import OrderBook
+from redis_manager.md_gateway import MarketDataGateway
+from redis_manager.redis_handler import RedisHandler
+from redis_manager.redis_events import OrderBookEvent
+from redis_manager.gateway_redis_handler import GatewayRedisHandler
+
+LOGGER = get_logger('bench_md_gateway', short=True)
+
+
+def run_gateway(host: str, port: int, path: str):
+    asyncio.run(MarketDataGateway(host, port, path).run())
+
+
+def consume(host: str, port: int, path: str, number: int, ready, results):
+    """Receives number books, reports latencies and cpu per message"""
+    if path:
+        redis_handler = GatewayRedisHandler(host, port, LOGGER, path=path)
+    else:
+        redis_handler = RedisHandler(host, port, LOGGER)
+    latencies = []
+    done = threading.Event()
+    cpu = []
+
+    def on_orderbook(orderbook: OrderBook):
+        if not latencies:
+            cpu.append(time.process_time())
+        latencies.append(time.time() - orderbook.timestamp)
+        if len(latencies) == number:
+            cpu.append(time.process_time())
+            done.set()
+
+    redis_handler.psubscribe_event(OrderBookEvent, on_orderbook)
+    threading.Thread(target=redis_handler.run, daemon=True).start()
+    ready.put(True)
+    done.wait()
+    latencies = np.array(latencies) * 1e3
+    results.put((np.percentile(latencies, 50), np.percentile(latencies, 99),
+                 (cpu[1] - cpu[0]) / number * 1e6))
+
+
+def publish(host: str, port: int, number: int, instruments: int,
+            rate: int):
+    """number books at rate per second, timestamped when published"""
+    redis_handler = RedisHandler(host, port, LOGGER)
+    levels = [(30000.0 - k * 0.5, 1.0 + k) for k in range(10)]
+    start = time.perf_counter()
+    for i in range(number):
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        redis_handler.publish_event(
+            OrderBookEvent,
+            OrderBook(instr_id=i % instruments + 1,
+                      bids=levels,
+                      asks=[(p + 0.5, q) for p, q in levels],
+                      timestamp=time.time()))
+    return number / (time.perf_counter() - start)
+
+
+def bench(host: str, port: int, path: str, consumers: int, number: int,
+          instruments: int, rate: int):
+    ready, results = multiprocessing.Queue(), multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=consume,
+                                args=(host, port, path, number, ready,
+                                      results),
+                                daemon=True) for _ in range(consumers)
+    ]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        ready.get()
+    # subscriptions reach redis, through the gateway or not
+    time.sleep(1)
+
+    published = publish(host, port, number, instruments, rate)
+    reports = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return (published, np.mean([r[0] for r in reports]),
+            np.max([r[1] for r in reports]),
+            np.mean([r[2] for r in reports]))
+
+
+def main():
+    parser = ArgumentParser(
+        description='Books fanned out to N local consumers by the market '
+        'data gateway, against the consumers subscribing on a local '
+        'redis-server')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('-n', '--number', type=int, default=20000)
+    parser.add_argument('--instruments', type=int, default=20)
+    parser.add_argument('--rate',
+                        type=int,
+                        default=5000,
+                        help='books published per second')
+    parser.add_argument('--consumers', type=int, nargs='+', default=[1, 8, 30])
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'md_gateway.sock')
+    gateway = multiprocessing.Process(target=run_gateway,
+                                      args=(args.host, args.port, path),
+                                      daemon=True)
+    gateway.start()
+    while not os.path.exists(path):
+        time.sleep(0.1)
+
+    LOGGER.info(f'{"transport":<10}{"consumers":>10}{"published/s":>13}'
+                f'{"fan out/s":>11}{"p50 ms":>9}{"p99 ms":>9}'
+                f'{"cpu us/msg":>12}')
+    try:
+        for consumers in args.consumers:
+            for name, consumer_path in [('redis', None), ('gateway', path)]:
+                published, p50, p99, cpu = bench(args.host, args.port,
+                                                 consumer_path, consumers,
+                                                 args.number,
+                                                 args.instruments, args.rate)
+                LOGGER.info(f'{name:<10}{consumers:>10}{published:>13.0f}'
+                            f'{published * consumers:>11.0f}{p50:>9.2f}'
+                            f'{p99:>9.2f}{cpu:>12.1f}')
+    finally:
+        gateway.terminate()
+        shutil.rmtree(os.path.dirname(path))
+
+
+if __name__ == '__main__':
+    main()
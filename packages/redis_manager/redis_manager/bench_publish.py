@@ -0,0 +1,86 @@
+import time
+
+from argparse import ArgumentParser
+
+from arb_logger.logger import get_logger
+from arb_defines.arb_dataclasses import Trade
+from redis_manager.redis_handler import RedisHandler
+from redis_manager.redis_events import TradeEvent
+
+LOGGER = get_logger('bench_publish', short=True)
+
+
+def sample_trades(number: int, instruments: int) -> list[Trade]:
+    now = time.time()
+    return [
+        Trade(time=now + i * 1e-3,
+              qty=0.012 if i % 2 else -0.012,
+              price=30000.5 + i % 10,
+              exchange_order_id=str(i),
+              instr_id=i % instruments + 1,
+              exchange_id=1) for i in range(number)
+    ]
+
+
+def check_order(redis_handler: RedisHandler, trades: list[Trade]) -> bool:
+    """A subscriber receives every trade, in publish order"""
+    pubsub = redis_handler.redis_instance.pubsub()
+    pubsub.psubscribe(f'{TradeEvent.channel}*')
+    pubsub.get_message(timeout=1)
+
+    for trade in trades:
+        redis_handler.publish_event(TradeEvent, trade)
+    redis_handler.flush()
+
+    received = []
+    while len(received) < len(trades):
+        message = pubsub.get_message(timeout=1)
+        if message is None:
+            break
+        if message['type'] == 'pmessage':
+            received.append(TradeEvent.deserialize(message['data']))
+    pubsub.close()
+    return [t.exchange_order_id for t in received
+            ] == [t.exchange_order_id for t in trades]
+
+
+def bench(redis_handler: RedisHandler, trades: list[Trade]) -> float:
+    start = time.perf_counter()
+    for trade in trades:
+        redis_handler.publish_event(TradeEvent, trade)
+    redis_handler.flush()
+    return len(trades) / (time.perf_counter() - start)
+
+
+def main():
+    parser = ArgumentParser(
+        description='Benchmark publish throughput against a local redis-server'
+    )
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('-n', '--number', type=int, default=20000)
+    parser.add_argument('--instruments', type=int, default=20)
+    parser.add_argument('--batches', type=int, nargs='+',
+                        default=[1, 10, 50, 200])
+    parser.add_argument('--batch-us', type=int, default=500)
+    args = parser.parse_args()
+
+    trades = sample_trades(args.number, args.instruments)
+
+    LOGGER.info(f'{"batch":>6}{"msg/s":>12}{"speedup":>10}{"ordered":>9}')
+    base = None
+    for batch in args.batches:
+        redis_handler = RedisHandler(args.host,
+                                     args.port,
+                                     LOGGER,
+                                     publish_batch=batch,
+                                     publish_batch_us=args.batch_us)
+        ordered = check_order(redis_handler, trades[:1000])
+        rate = bench(redis_handler, trades)
+        base = base or rate
+        LOGGER.info(f'{batch:>6}{rate:>12.0f}{rate / base:>10.1f}'
+                    f'{str(ordered):>9}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import os
+import time
+import multiprocessing
+
+from argparse import ArgumentParser
+
+from arb_logger.logger import get_logger
+from redis_manager.tob_store import TopOfBookStore
+
+LOGGER = get_logger('bench_tob_store', short=True)
+
+
+def writer(name: str, slots: int, instruments: int, seconds: float):
+    """Values of a slot are derived from one counter to detect torn reads"""
+    store = TopOfBookStore.open(name, slots)
+    end = time.time() + seconds
+    k = 0
+    while time.time() < end:
+        k += 1
+        store.write(k % instruments + 1, k, 2 * k, k + 1, 3 * k, k)
+    store.close()
+
+
+def reader(store: TopOfBookStore, instruments: int, seconds: float):
+    reads = torn = empty = 0
+    end = time.time() + seconds
+    start = time.perf_counter()
+    while time.time() < end:
+        for instr_id in range(1, instruments + 1):
+            values = store.read(instr_id)
+            reads += 1
+            if values is None:
+                empty += 1
+                continue
+            bid, bid_qty, ask, ask_qty, timestamp = values
+            if (bid_qty, ask, ask_qty, timestamp) != (2 * bid, bid + 1,
+                                                      3 * bid, bid):
+                torn += 1
+    return reads, torn, empty, (time.perf_counter() - start) / reads * 1e9
+
+
+def main():
+    parser = ArgumentParser(
+        description='Check and benchmark the top of book store with a '
+        'writer and a reader process, no redis needed')
+    parser.add_argument('--name', default=f'arb_tob_bench_{os.getpid()}')
+    parser.add_argument('--slots', type=int, default=1024)
+    parser.add_argument('--instruments', type=int, default=50)
+    parser.add_argument('--seconds', type=float, default=3)
+    args = parser.parse_args()
+
+    store = TopOfBookStore.open(args.name, args.slots)
+    process = multiprocessing.get_context('spawn').Process(
+        target=writer,
+        args=(args.name, args.slots, args.instruments, args.seconds + 1))
+    process.start()
+    try:
+        # writer attached and running
+        time.sleep(1)
+        reads, torn, empty, read_ns = reader(store, args.instruments,
+                                             args.seconds)
+    finally:
+        process.join()
+        store.unlink()
+        store.close()
+
+    LOGGER.info(f'{reads} reads, {read_ns:.0f} ns per read, '
+                f'{empty} empty, {torn} torn')
+    if torn:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+import types
+import typing
+import dataclasses
+
+from typing import Any, Callable, Union
+
+from dacite import from_dict, Config as DaciteConfig
+
+from arb_logger.logger import get_logger
+
+LOGGER = get_logger('decoders', short=True)
+
+_DECODERS: dict[type, Callable[[dict], object]] = {}
+
+NUMERIC_TOWER = {float: (int, float), complex: (int, float, complex)}
+
+
+class UnsupportedType(Exception):
+    pass
+
+
+def _wrong_type(field_name, field_type, value):
+    raise TypeError(
+        f'wrong value type for field "{field_name}" - should be "{field_type}" instead of value "{value}" of type "{type(value)}"'
+    )
+
+
+def _missing_value(field_name):
+    raise ValueError(f'missing value for field "{field_name}"')
+
+
+def _is_union(type_) -> bool:
+    return (typing.get_origin(type_) is Union
+            or isinstance(type_, types.UnionType))
+
+
+class _DecoderBuilder:
+    """
+    Generate the source of a from_dict equivalent for one dataclass.
+
+    Mirrors dacite: type_hooks and cast are applied before building the value,
+    nested dataclasses are built from dicts, unions keep the first member
+    matching the value and every field is type checked.
+    """
+
+    def __init__(self, data_class, config: DaciteConfig):
+        self.data_class = data_class
+        self.config = config
+        self.namespace = {
+            '_cls': data_class,
+            '_wrong_type': _wrong_type,
+            '_missing_value': _missing_value,
+        }
+        self._names = 0
+
+    def _ref(self, obj, prefix='_ref') -> str:
+        self._names += 1
+        name = f'{prefix}{self._names}'
+        self.namespace[name] = obj
+        return name
+
+    def _check(self, expr, field_name, type_) -> str:
+        # numeric tower, like dacite ints are valid floats
+        type_ref = self._ref(NUMERIC_TOWER.get(type_, type_), '_type')
+        return (f'(_v if isinstance(_v := {expr}, {type_ref}) '
+                f'else _wrong_type({field_name!r}, {type_ref}, _v))')
+
+    def value_expr(self, type_, field_name, var='v') -> str:
+        if type_ is Any:
+            return var
+
+        if _is_union(type_):
+            members = typing.get_args(type_)
+            non_none = [m for m in members if m is not type(None)]
+            if len(members) == 2 and len(non_none) == 1:
+                inner = self.value_expr(non_none[0], field_name, var)
+                return f'(None if {var} is None else {inner})'
+            return f'{self._ref(self._union(members, field_name))}({var})'
+
+        if not isinstance(type_, type) or typing.get_origin(type_):
+            # generic collections, literals, new types...
+            raise UnsupportedType(type_)
+
+        hooks = self.config.type_hooks or {}
+        if type_ in hooks:
+            return self._check(f'{self._ref(hooks[type_])}({var})',
+                               field_name, type_)
+
+        for cast_type in self.config.cast or []:
+            if issubclass(type_, cast_type):
+                return f'{self._ref(type_)}({var})'
+
+        if dataclasses.is_dataclass(type_):
+            decoder = self._ref(build_decoder(type_, self.config))
+            return (f'({decoder}({var}) if isinstance({var}, dict) '
+                    f'else {self._check(var, field_name, type_)})')
+
+        return self._check(var, field_name, type_)
+
+    def _union(self, members, field_name):
+        converters = []
+        for member in members:
+            if member is type(None):
+                converters.append((member, None))
+                continue
+            builder = _DecoderBuilder(self.data_class, self.config)
+            expr = builder.value_expr(member, field_name)
+            converters.append(
+                (member, eval(f'lambda v: {expr}', builder.namespace)))
+
+        def _decode_union(value):
+            for member, converter in converters:
+                if converter is None:
+                    if value is None:
+                        return None
+                    continue
+                try:
+                    return converter(value)
+                except Exception:
+                    continue
+            _wrong_type(field_name, members, value)
+
+        return _decode_union
+
+    def build(self) -> Callable[[dict], object]:
+        hints = typing.get_type_hints(self.data_class)
+        lines = ['def decode(data):', '    kwargs = {}']
+        for field in dataclasses.fields(self.data_class):
+            if not field.init:
+                continue
+            type_ = hints[field.name]
+            has_default = (field.default is not dataclasses.MISSING
+                           or field.default_factory is not dataclasses.MISSING)
+            lines.append(f'    if {field.name!r} in data:')
+            lines.append(f'        v = data[{field.name!r}]')
+            lines.append(f'        kwargs[{field.name!r}] = '
+                         f'{self.value_expr(type_, field.name)}')
+            if has_default:
+                continue
+            lines.append('    else:')
+            if _is_union(type_) and type(None) in typing.get_args(type_):
+                lines.append(f'        kwargs[{field.name!r}] = None')
+            else:
+                lines.append(f'        _missing_value({field.name!r})')
+        lines.append('    return _cls(**kwargs)')
+
+        exec('\n'.join(lines), self.namespace)
+        return self.namespace['decode']
+
+
+def build_decoder(data_class, config: DaciteConfig) -> Callable[[dict], object]:
+    """
+    Return a function building data_class from a dict exactly like
+    dacite.from_dict(data_class, data, config), generated once per class.
+    Falls back to dacite for field types the generator does not handle.
+    """
+    decoder = _DECODERS.get(data_class)
+    if decoder is not None:
+        return decoder
+
+    try:
+        decoder = _DecoderBuilder(data_class, config).build()
+    except UnsupportedType as e:
+        LOGGER.warning(f'{data_class.__name__} uses dacite, unsupported {e}')
+
+        def decoder(data):
+            return from_dict(data_class, data, config)
+
+    _DECODERS[data_class] = decoder
+    return decoder
@@ -0,0 +1,204 @@
+import os
+import stat
+import time
+import select
+import socket
+
+from redis_manager.md_gateway import FRAME, MD_GATEWAY, MD_GATEWAY_PATH, gateway_event, redis_address
+from redis_manager.latency import is_traced
+from redis_manager.redis_events import REDIS_ENCODING_ERRORS, WIRE_CODEC, is_binary_payload
+from redis_manager.redis_handler import CONFLATION_MAX_BATCH, RedisHandler
+
+# bytes read at once from the gateway socket
+GATEWAY_READ_SIZE = 1 << 20
+# seconds to wait for the redis address announced by the gateway
+GATEWAY_CONNECT_TIMEOUT = 1
+
+
+def gateway_available(path: str = MD_GATEWAY_PATH) -> bool:
+    """The gateway of the host runs and MD_GATEWAY is set"""
+    try:
+        return MD_GATEWAY and stat.S_ISSOCK(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+class GatewayRedisHandler(RedisHandler):
+    """
+    RedisHandler receiving market data from the MarketDataGateway of the
+    host instead of redis.
+
+    Subscriptions to GATEWAY_EVENTS channels and patterns are sent to the
+    gateway, the others and every publish go to redis. Gateway messages are
+    binary, decoding them skips json and dacite. run() reads both sockets
+    in one thread so callbacks keep running one at a time, conflation
+    applies to both. If the gateway can not be reached, is connected to
+    another redis than host:port, or stops, its subscriptions are made on
+    redis.
+    """
+
+    def __init__(self,
+                 host='localhost',
+                 port=6379,
+                 logger=None,
+                 wire_codec=WIRE_CODEC,
+                 path=MD_GATEWAY_PATH):
+        super().__init__(host, port, logger, wire_codec)
+        self.path = path
+        # channels and patterns subscribed on the gateway
+        self.gateway_channels: set[str] = set()
+        self.gateway_patterns: set[str] = set()
+        self._frames = bytearray()
+        self.gateway = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.gateway.settimeout(GATEWAY_CONNECT_TIMEOUT)
+            self.gateway.connect(path)
+            address = self._read_address()
+            self.gateway.settimeout(None)
+        except OSError as e:
+            self.logger.warning(f'market data gateway {path} unreachable, '
+                                f'subscribing on redis: {e}')
+            self.gateway.close()
+            self.gateway = None
+            return
+        redis_host, redis_port = redis_address(host, port)
+        if address != f'{redis_host}:{redis_port}':
+            self.logger.warning(f'market data gateway {path} is connected '
+                                f'to redis {address}, not {host}:{port}, '
+                                f'subscribing on redis')
+            self.gateway.close()
+            self.gateway = None
+
+    def _read_address(self) -> str:
+        """host:port of the redis of the gateway, its first line"""
+        line = b''
+        while not line.endswith(b'\n'):
+            chunk = self.gateway.recv(256)
+            if not chunk:
+                raise ConnectionError('closed before its redis address')
+            line += chunk
+        kind, _, address = line.decode().rstrip('\n').partition(' ')
+        if kind != 'R':
+            raise ConnectionError(f'unexpected first line {line}')
+        return address
+
+    def _subscribe(self, *channels: str):
+        redis_channels = []
+        for channel in channels:
+            if self.gateway is not None and gateway_event(channel):
+                self.gateway_channels.add(channel)
+                self._send(f'S {channel}\n')
+            else:
+                redis_channels.append(channel)
+        if redis_channels:
+            super()._subscribe(*redis_channels)
+
+    def _psubscribe(self, pattern: str):
+        if self.gateway is not None and gateway_event(pattern):
+            self.gateway_patterns.add(pattern)
+            self._send(f'P {pattern}\n')
+        else:
+            super()._psubscribe(pattern)
+
+    def _send(self, line: str):
+        try:
+            self.gateway.sendall(line.encode())
+        except OSError:
+            self._lose_gateway()
+
+    def _lose_gateway(self):
+        self.logger.error('market data gateway disconnected, subscribing on '
+                          'redis')
+        self.gateway.close()
+        self.gateway = None
+        self._frames.clear()
+        if self.gateway_channels:
+            super()._subscribe(*self.gateway_channels)
+        for pattern in self.gateway_patterns:
+            super()._psubscribe(pattern)
+        self.gateway_channels, self.gateway_patterns = set(), set()
+
+    def run(self):
+        self.logger.info(f'subscribed to channels {list(self.events.keys())}'
+                         f', through the gateway: '
+                         f'{sorted(self.gateway_channels)} '
+                         f'{sorted(self.gateway_patterns)}')
+        if not self.events:
+            self.logger.warning('no events subscribed, will run forever')
+
+        timeout = 1
+        while True:
+            sockets = [] if self.gateway is None else [self.gateway]
+            # connected on the first redis subscription
+            connection = self.pubsub.connection
+            if connection is not None and connection._sock is not None:
+                sockets.append(connection._sock)
+            if sockets:
+                select.select(sockets, [], [], timeout)
+            else:
+                time.sleep(timeout)
+
+            messages = self._read_gateway()
+            redis_messages = self._read_redis()
+            # redis may have more parsed already, select would not see them
+            timeout = 0 if len(redis_messages) >= CONFLATION_MAX_BATCH else 1
+            messages += redis_messages
+            if self.conflating:
+                self._handle_messages(messages)
+            else:
+                for message in messages:
+                    self._handle_message(message)
+
+    def _read_redis(self) -> list[dict]:
+        messages = []
+        while len(messages) < CONFLATION_MAX_BATCH:
+            message = self.pubsub.get_message(timeout=0)
+            if message is None:
+                break
+            if message['type'] in ['message', 'pmessage']:
+                messages.append(message)
+        return messages
+
+    def _read_gateway(self) -> list[dict]:
+        """Messages of the complete frames received from the gateway"""
+        if self.gateway is None:
+            return []
+        try:
+            while True:
+                chunk = self.gateway.recv(GATEWAY_READ_SIZE,
+                                          socket.MSG_DONTWAIT)
+                if not chunk:
+                    self._lose_gateway()
+                    return []
+                self._frames += chunk
+                if len(chunk) < GATEWAY_READ_SIZE:
+                    break
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._lose_gateway()
+            return []
+
+        frames, offset, messages = self._frames, 0, []
+        while len(frames) - offset >= FRAME.size:
+            key_len, channel_len, data_len = FRAME.unpack_from(frames, offset)
+            start = offset + FRAME.size
+            end = start + key_len + channel_len + data_len
+            if end > len(frames):
+                break
+            key = frames[start:start + key_len].decode()
+            start += key_len
+            channel = frames[start:start + channel_len].decode()
+            data = bytes(frames[start + channel_len:end])
+            if not (is_binary_payload(data) or is_traced(data)):
+                data = data.decode('utf-8', REDIS_ENCODING_ERRORS)
+            pattern = key if key in self.gateway_patterns else None
+            messages.append({
+                'type': 'pmessage' if pattern else 'message',
+                'pattern': pattern,
+                'channel': channel,
+                'data': data
+            })
+            offset = end
+        del frames[:offset]
+        return messages
@@ -0,0 +1,161 @@
+import os
+import math
+import uuid
+import struct
+import threading
+
+from datetime import datetime, timezone
+from collections import defaultdict
+
+from arb_defines.arb_dataclasses import Latency
+from redis_manager.redis_events import REDIS_ENCODING_ERRORS
+
+# traced events carry exchange, receipt and publish times, subscribers add
+# dispatch, decode and callback times and aggregate them in histograms
+LATENCY_TRACE = os.getenv('ARB_LATENCY_TRACE', '0') == '1'
+# histograms are published to the latencies table every N seconds
+LATENCY_FLUSH_SECONDS = float(os.getenv('ARB_LATENCY_FLUSH_SECONDS', '60'))
+
+# traced messages start with this byte then the trace, the payload follows
+# unchanged, json and binary payloads never start with it
+TRACE_MAGIC = 0xAC
+_TRACE = struct.Struct('<Bddd')
+TRACE_SIZE = _TRACE.size
+_TRACE_MAGIC_CHAR = bytes([TRACE_MAGIC]).decode('utf-8',
+                                                REDIS_ENCODING_ERRORS)
+
+# time between two timestamps of a trace
+STAGE_EXCHANGE = 'exchange'  # exchange -> feed handler receipt
+STAGE_FEED = 'feed'  # receipt -> publish
+STAGE_BUS = 'bus'  # publish -> dispatch in RedisHandler
+STAGE_DECODE = 'decode'  # dispatch -> payload decoded
+STAGE_CALLBACKS = 'callbacks'  # decoded -> callbacks completed
+STAGE_TOTAL = 'total'  # exchange -> callbacks completed
+
+# 4 buckets per power of 2 microseconds, ~19% resolution
+BUCKETS_PER_OCTAVE = 4
+
+
+def exchange_time(payload) -> float:
+    """Source time of a payload as epoch seconds, nan if unknown"""
+    for attr in ['timestamp', 'time']:
+        value = getattr(payload, attr, None)
+        if isinstance(value, datetime):
+            return value.timestamp()
+        if isinstance(value, int | float):
+            return float(value)
+    return math.nan
+
+
+def add_trace(data: str | bytes, exchange: float, receipt: float,
+              publish: float) -> bytes:
+    if isinstance(data, str):
+        data = data.encode('utf-8', REDIS_ENCODING_ERRORS)
+    return _TRACE.pack(TRACE_MAGIC, exchange, receipt, publish) + data
+
+
+def is_traced(data) -> bool:
+    if isinstance(data, str):
+        return data.startswith(_TRACE_MAGIC_CHAR)
+    if isinstance(data, bytes | bytearray):
+        return len(data) > 0 and data[0] == TRACE_MAGIC
+    return False
+
+
+def split_trace(data: str | bytes) -> tuple[tuple[float, float, float], str]:
+    """(exchange, receipt, publish), payload as received without trace"""
+    if isinstance(data, str):
+        data = data.encode('utf-8', REDIS_ENCODING_ERRORS)
+    _, *trace = _TRACE.unpack_from(data)
+    return tuple(trace), data[_TRACE.size:].decode('utf-8',
+                                                   REDIS_ENCODING_ERRORS)
+
+
+class LatencyHistogram:
+    """Log scale histogram of durations in microseconds"""
+
+    def __init__(self):
+        self.buckets: dict[int, int] = defaultdict(int)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    @staticmethod
+    def bucket(us: float) -> int:
+        if us < 1:
+            return 0
+        return int(math.log2(us) * BUCKETS_PER_OCTAVE) + 1
+
+    @staticmethod
+    def bucket_bound(bucket: int) -> float:
+        """Upper bound of a bucket in microseconds"""
+        return 2**(bucket / BUCKETS_PER_OCTAVE)
+
+    def add(self, us: float):
+        # clocks of different hosts are not perfectly synced
+        us = max(us, 0.)
+        self.buckets[self.bucket(us)] += 1
+        self.count += 1
+        self.total += us
+        self.max = max(self.max, us)
+
+    def quantile(self, q: float) -> float:
+        rank = q * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self.bucket_bound(bucket), self.max)
+        return self.max
+
+
+class LatencyRecorder:
+    """Histograms by (event type, instr_id, stage), thread safe"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms: dict[tuple, LatencyHistogram] = defaultdict(
+            LatencyHistogram)
+
+    def record(self, event_type: str, instr_id: int, trace: tuple,
+               dispatch: float, decoded: float, done: float):
+        exchange, receipt, publish = trace
+        stages = [
+            (STAGE_EXCHANGE, receipt - exchange),
+            (STAGE_FEED, publish - receipt),
+            (STAGE_BUS, dispatch - publish),
+            (STAGE_DECODE, decoded - dispatch),
+            (STAGE_CALLBACKS, done - decoded),
+            (STAGE_TOTAL, done - exchange),
+        ]
+        with self.lock:
+            for stage, seconds in stages:
+                # nan when the publisher did not know a timestamp
+                if not math.isnan(seconds):
+                    self.histograms[event_type, instr_id,
+                                    stage].add(seconds * 1e6)
+
+    def flush(self) -> list[Latency]:
+        """Latency rows of the histograms since last flush"""
+        with self.lock:
+            histograms = self.histograms
+            self.histograms = defaultdict(LatencyHistogram)
+
+        now = datetime.now(tz=timezone.utc)
+        # rows of a flush share their event_id
+        event_id = uuid.uuid4()
+        return [
+            Latency(time=now,
+                    event_id=event_id,
+                    event_type=event_type,
+                    instr_id=instr_id,
+                    stage=stage,
+                    count=h.count,
+                    mean_us=h.total / h.count,
+                    p50_us=h.quantile(0.5),
+                    p90_us=h.quantile(0.9),
+                    p99_us=h.quantile(0.99),
+                    max_us=h.max,
+                    buckets=dict(h.buckets))
+            for (event_type, instr_id, stage), h in histograms.items()
+        ]
@@ -0,0 +1,348 @@
+import os
+import re
+import queue
+import logging
+import threading
+import traceback
+
+from functools import lru_cache
+
+from redis_manager.profiler import CALLBACK_PROFILE, CallbackProfiler
+from redis_manager.redis_events import RedisEvent
+from redis_manager.redis_handler import CONFLATION_MAX_BATCH, HOT_CHANNELS, EventHandler, RedisHandler
+
+# RedisManager uses LocalRedisHandler, the managers of a process share an
+# in-memory bus instead of redis
+REDIS_LOCAL = os.getenv('ARB_REDIS_LOCAL', '0') == '1'
+
+
+@lru_cache(maxsize=None)
+def glob_regex(pattern: str) -> re.Pattern:
+    """
+    Regex of a redis glob-style pattern, as PSUBSCRIBE matches it: * any
+    string, ? any character, [abc] [a-z] sets and [^abc] negated sets, \\x
+    the character x. Unlike fnmatch, [!abc] is a set with !, an unclosed set
+    ends with the pattern and a range with a closing ] includes it.
+    """
+    parts, i, n = [], 0, len(pattern)
+    while i < n:
+        char = pattern[i]
+        i += 1
+        if char == '*':
+            parts.append('.*')
+        elif char == '?':
+            parts.append('.')
+        elif char == '[':
+            negate = i < n and pattern[i] == '^'
+            if negate:
+                i += 1
+            items = []
+            while i < n and pattern[i] != ']':
+                if pattern[i] == '\\' and i + 1 < n:
+                    items.append(re.escape(pattern[i + 1]))
+                    i += 2
+                elif pattern[i + 1:i + 2] == '-' and i + 2 < n:
+                    low, high = sorted([pattern[i], pattern[i + 2]])
+                    items.append(f'{re.escape(low)}-{re.escape(high)}')
+                    i += 3
+                else:
+                    items.append(re.escape(pattern[i]))
+                    i += 1
+            i += 1
+            if items:
+                parts.append(f'[{"^" if negate else ""}{"".join(items)}]')
+            else:
+                # [] matches nothing, [^] any character
+                parts.append('.' if negate else '(?!)')
+        elif char == '\\' and i < n:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+        else:
+            parts.append(re.escape(char))
+    return re.compile(''.join(parts), re.DOTALL)
+
+
+def glob_match(pattern: str, channel: str) -> bool:
+    if not channel:
+        # as redis, even * does not match an empty channel
+        return not pattern
+    return glob_regex(pattern).fullmatch(channel) is not None
+
+
+class LocalRedis:
+    """
+    The redis commands used by the managers, on a dict. Keys do not expire
+    and publish reaches nobody, messages go through the bus.
+    """
+
+    def __init__(self):
+        self.data: dict[str, str | dict] = {}
+
+    def get(self, name):
+        return self.data.get(name)
+
+    def set(self, name, value):
+        self.data[name] = value
+
+    def delete(self, *names):
+        return sum(self.data.pop(name, None) is not None for name in names)
+
+    def expire(self, name, seconds):
+        return name in self.data
+
+    def hget(self, name, key):
+        return self.data.get(name, {}).get(key)
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        hash_ = self.data.setdefault(name, {})
+        if key is not None:
+            hash_[key] = value
+        hash_.update(mapping or {})
+
+    def hgetall(self, name) -> dict:
+        return dict(self.data.get(name, {}))
+
+    def hdel(self, name, *keys):
+        hash_ = self.data.get(name, {})
+        return sum(hash_.pop(key, None) is not None for key in keys)
+
+    def publish(self, channel, data):
+        return 0
+
+    def pipeline(self, transaction=True):
+        return LocalPipeline(self)
+
+
+class LocalPipeline:
+    """Commands queued then run in order by execute"""
+
+    def __init__(self, redis: LocalRedis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self.redis, name)
+
+        def queue(*args, **kwargs):
+            self.commands.append((command, args, kwargs))
+            return self
+
+        return queue
+
+    def execute(self) -> list:
+        commands, self.commands = self.commands, []
+        return [command(*args, **kwargs) for command, args, kwargs in commands]
+
+
+class LocalBus:
+    """
+    Channels and store of the LocalRedisHandlers of a process.
+
+    A publish is delivered to every subscription matching its channel, one
+    message per subscription as redis does for a channel and a pattern both
+    matching. Subscriptions matching a channel are resolved once and cached
+    until the next (p)subscribe.
+    """
+
+    def __init__(self):
+        self.redis_instance = LocalRedis()
+        self.handlers: list['LocalRedisHandler'] = []
+        # (handler, event handler) of every subscription matching a channel
+        self.routes: dict[str, list[tuple]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, handler: 'LocalRedisHandler'):
+        with self._lock:
+            self.handlers.append(handler)
+            self.routes = {}
+
+    def invalidate(self):
+        with self._lock:
+            self.routes = {}
+
+    def route(self, channel: str) -> list[tuple]:
+        routes = self.routes.get(channel)
+        if routes is None:
+            with self._lock:
+                routes = self.routes[channel] = [
+                    (handler, event_handler) for handler in self.handlers
+                    for event_handler in handler.route(channel)
+                ]
+        return routes
+
+    def publish(self, channel: str, payload) -> int:
+        """Subscriptions reached, as the reply of redis PUBLISH"""
+        routes = self.route(channel)
+        for handler, event_handler in routes:
+            handler.deliver(channel, event_handler, payload)
+        return len(routes)
+
+
+# bus of the RedisManagers of the process when REDIS_LOCAL
+LOCAL_BUS = LocalBus()
+
+
+class LocalRedisHandler(RedisHandler):
+    """
+    RedisHandler on a LocalBus, for managers running in one process, a
+    sentinel and its seeker or the tools of a test, each run() in its own
+    thread as they would in their own process.
+
+    subscribe_event, psubscribe_event and publish_event behave as with
+    redis: messages are queued per handler and run() handles them in order,
+    conflating the backlog of conflated channels, patterns follow redis glob
+    rules. Heartbeats are threads of the RedisManager. Payloads are passed by
+    reference without serialization, deserialize is ignored and every
+    subscriber gets the same object, RedisEvent.local_payload only converts
+    the payloads which the wire gives another type. host and port are
+    ignored, the store is the bus one.
+    """
+
+    def __init__(self,
+                 host='localhost',
+                 port=6379,
+                 logger=None,
+                 bus: LocalBus = None,
+                 profile_callbacks=CALLBACK_PROFILE):
+        super().__init__(host,
+                         port,
+                         logger,
+                         publish_batch=1,
+                         profile_callbacks=False)
+        self.bus = bus or LOCAL_BUS
+        self.redis_instance = self.bus.redis_instance
+        self.pubsub = None
+        self.profiler = CallbackProfiler(
+            self.redis_instance, self.logger) if profile_callbacks else None
+        # channels subscribed as patterns
+        self.patterns: set[str] = set()
+        self.messages = queue.SimpleQueue()
+        self.bus.register(self)
+
+    def subscribe_event(self,
+                        redis_event: RedisEvent,
+                        callbacks=None,
+                        deserialize=True,
+                        conflate=False):
+        super().subscribe_event(redis_event, callbacks, deserialize, conflate)
+        self.bus.invalidate()
+
+    def psubscribe_event(self,
+                         redis_event: RedisEvent,
+                         callbacks=None,
+                         deserialize=True,
+                         conflate=False):
+        super().psubscribe_event(redis_event, callbacks, deserialize,
+                                 conflate)
+        self.bus.invalidate()
+
+    def _subscribe(self, *channels: str):
+        pass
+
+    def _psubscribe(self, pattern: str):
+        self.patterns.add(pattern)
+
+    def route(self, channel: str) -> list[EventHandler]:
+        """Event handlers of the channel and of the patterns matching it"""
+        return [
+            event_handler for key, event_handler in list(self.events.items())
+            if (glob_match(key, channel) if key in self.patterns else key ==
+                channel)
+        ]
+
+    def publish_event(self,
+                      redis_event: RedisEvent,
+                      payload=None,
+                      flush=False,
+                      receipt_time=None):
+        channel = self.get_channel(redis_event, payload)
+        if (redis_event.channel not in HOT_CHANNELS
+                and self.logger.isEnabledFor(logging.DEBUG)):
+            self.logger.debug(f'publishing on {channel} payload {payload}')
+        self.bus.publish(channel, redis_event.local_payload(payload))
+
+    def flush(self):
+        pass
+
+    def deliver(self, channel: str, event_handler: EventHandler, payload):
+        self.messages.put((channel, event_handler, payload))
+
+    def run(self):
+        self.logger.info(f'subscribed to channels {list(self.events.keys())}'
+                         f' on the local bus')
+        if not self.events:
+            self.logger.warning('no events subscribed, will run forever')
+        while True:
+            message = self.messages.get()
+            if message is None:
+                return
+            if self.conflating:
+                if not self._handle_local_backlog(message):
+                    return
+            else:
+                self.handle(*message)
+
+    def stop(self):
+        """run returns once the messages before are handled"""
+        self.messages.put(None)
+
+    def drain(self) -> int:
+        """Handles the pending messages in the calling thread, for tests"""
+        count = 0
+        while True:
+            try:
+                message = self.messages.get_nowait()
+            except queue.Empty:
+                return count
+            if message is not None:
+                self.handle(*message)
+                count += 1
+
+    def _handle_local_backlog(self, message) -> bool:
+        """message and the queued ones, False if stopped meanwhile"""
+        messages, running = [message], True
+        while len(messages) < CONFLATION_MAX_BATCH:
+            try:
+                message = self.messages.get_nowait()
+            except queue.Empty:
+                break
+            if message is None:
+                running = False
+                break
+            messages.append(message)
+
+        # channel and handler of conflated events: index of newest message,
+        # another subscription of the same channel keeps its own messages
+        newest = {}
+        for i, (channel, event_handler, _) in enumerate(messages):
+            if event_handler.conflate:
+                newest[channel, id(event_handler)] = i
+
+        for i, message in enumerate(messages):
+            channel, event_handler, _ = message
+            if (event_handler.conflate
+                    and newest[channel, id(event_handler)] != i):
+                self.conflated[channel] += 1
+                continue
+            self.handle(*message)
+
+        self._log_conflation()
+        return running
+
+    def handle(self, channel: str, event_handler: EventHandler, payload):
+        # payloads are objects, only formatted when logged
+        if (event_handler.event.channel not in HOT_CHANNELS
+                and self.logger.isEnabledFor(logging.DEBUG)):
+            self.logger.debug(
+                f'handling {event_handler} with message {payload}')
+        try:
+            if self.profiler is None:
+                for callback in event_handler.callbacks:
+                    callback(payload)
+            else:
+                for callback in event_handler.callbacks:
+                    self.profiler.call(channel, callback, payload)
+        except Exception:
+            self.logger.error(traceback.format_exc())
+        if self.profiler is not None:
+            self.profiler.maybe_publish()
@@ -0,0 +1,232 @@
+import os
+import time
+import socket
+import struct
+import asyncio
+import traceback
+
+from argparse import ArgumentParser
+from collections import defaultdict
+
+from redis.asyncio import Redis as AsyncRedis
+
+from arb_logger.logger import get_logger
+from redis_manager.latency import TRACE_SIZE, is_traced
+from redis_manager.redis_events import REDIS_ENCODING_ERRORS, WIRE_CODEC_BINARY, FundingRateEvent, LiquidationEvent, OrderBookDeltaEvent, OrderBookEvent, RedisEvent, TradeEvent, is_binary_payload
+
+LOGGER = get_logger('md_gateway', short=True)
+
+# unix socket of the market data gateway of the host
+MD_GATEWAY_PATH = os.getenv('ARB_MD_GATEWAY_PATH', '/tmp/arb_md_gateway.sock')
+# RedisManager subscribes market data through the gateway when it runs
+MD_GATEWAY = os.getenv('ARB_MD_GATEWAY', '1') == '1'
+# bytes waiting for a subscriber before it is disconnected, as redis
+# client-output-buffer-limit pubsub
+MD_GATEWAY_MAX_BUFFER = int(
+    os.getenv('ARB_MD_GATEWAY_MAX_BUFFER', str(32 * 1024 * 1024)))
+GATEWAY_STATS_SECONDS = 60
+
+# events fanned out by the gateway, every watcher of the host subscribes to
+# the same books and trades
+GATEWAY_EVENTS: dict[str, type[RedisEvent]] = {
+    e.channel: e
+    for e in [
+        OrderBookEvent, OrderBookDeltaEvent, TradeEvent, LiquidationEvent,
+        FundingRateEvent
+    ]
+}
+
+# gateway -> subscriber on connect: b'R host:port\n', its redis
+# subscriber -> gateway: b'S channel\n' or b'P pattern\n' lines
+# gateway -> subscriber: key, channel and data lengths then the key (the
+# channel or pattern subscribed), the channel and the binary payload
+FRAME = struct.Struct('<HHI')
+
+
+def redis_address(host: str, port: int) -> tuple[str, int]:
+    """host resolved, localhost and 127.0.0.1 are the same redis"""
+    try:
+        host = socket.gethostbyname(host)
+    except OSError:
+        pass
+    return host, int(port)
+
+
+def gateway_event(key: str) -> type[RedisEvent] | None:
+    """Event of a channel or pattern fanned out by the gateway"""
+    return GATEWAY_EVENTS.get(key.rstrip('*').split(':', 1)[0])
+
+
+class MarketDataGateway:
+    """
+    Holds the redis subscriptions of the market data (GATEWAY_EVENTS) of a
+    host and fans the messages out to local subscribers over a unix socket.
+
+    A channel or pattern is subscribed once on redis, whatever the number
+    of local subscribers, and unsubscribed with its last one. A message is
+    decoded once and sent in the binary wire format, binary messages are
+    forwarded as is and latency traces are kept. As with redis, a message
+    reaches a subscriber once per subscription matching it, and a
+    subscriber more than max_buffer bytes behind is disconnected.
+    """
+
+    def __init__(self,
+                 host='localhost',
+                 port=6379,
+                 path=MD_GATEWAY_PATH,
+                 max_buffer=MD_GATEWAY_MAX_BUFFER):
+        self.path = path
+        self.max_buffer = max_buffer
+        self.address = redis_address(host, port)
+        # raw messages, channels and payloads stay bytes
+        self.redis_instance = AsyncRedis(host=host, port=port)
+        self.pubsub = self.redis_instance.pubsub()
+        # subscribers of a channel or pattern
+        self.subscribers: dict[bytes, set[asyncio.StreamWriter]] = \
+            defaultdict(set)
+        self.patterns: set[bytes] = set()
+        # a publish matching several keys is converted once
+        self._last = (None, None)
+        self.received = 0
+        self.sent = 0
+        self.dropped = 0
+
+    async def run(self):
+        if os.path.exists(self.path):
+            # socket of a previous run
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(self._serve, path=self.path)
+        LOGGER.info(f'market data gateway listening on {self.path}')
+        stats = asyncio.create_task(self._log_stats())
+        try:
+            await self._listen()
+        finally:
+            stats.cancel()
+            server.close()
+            os.unlink(self.path)
+
+    async def _listen(self):
+        while True:
+            async for message in self.pubsub.listen():
+                if message['type'] in ['message', 'pmessage']:
+                    self.dispatch(message['pattern'] or message['channel'],
+                                  message['channel'], message['data'])
+            # nothing subscribed yet
+            await asyncio.sleep(1)
+
+    async def _serve(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter):
+        keys = set()
+        host, port = self.address
+        writer.write(f'R {host}:{port}\n'.encode())
+        try:
+            while line := await reader.readline():
+                kind, key = line.rstrip(b'\n').split(b' ', 1)
+                if gateway_event(key.decode()) is None:
+                    LOGGER.warning(f'{key} is not fanned out by the gateway')
+                elif key not in keys:
+                    keys.add(key)
+                    await self._add(key, writer, kind == b'P')
+        except (ConnectionError, ValueError):
+            LOGGER.error(traceback.format_exc())
+        finally:
+            for key in keys:
+                await self._remove(key, writer)
+            writer.close()
+
+    async def _add(self, key: bytes, writer: asyncio.StreamWriter,
+                   pattern: bool):
+        subscribers = self.subscribers[key]
+        subscribers.add(writer)
+        if len(subscribers) > 1:
+            return
+        if pattern:
+            self.patterns.add(key)
+            await self.pubsub.psubscribe(key)
+        else:
+            await self.pubsub.subscribe(key)
+
+    async def _remove(self, key: bytes, writer: asyncio.StreamWriter):
+        subscribers = self.subscribers.get(key)
+        if subscribers is None:
+            return
+        subscribers.discard(writer)
+        if subscribers:
+            return
+        del self.subscribers[key]
+        if key in self.patterns:
+            self.patterns.discard(key)
+            await self.pubsub.punsubscribe(key)
+        else:
+            await self.pubsub.unsubscribe(key)
+
+    def convert(self, channel: bytes, data: bytes) -> bytes:
+        """Binary payload of a message, with its trace if any"""
+        trace = b''
+        if is_traced(data):
+            trace, data = data[:TRACE_SIZE], data[TRACE_SIZE:]
+        if is_binary_payload(data):
+            return trace + data
+        redis_event = gateway_event(channel.decode())
+        payload = None
+        if redis_event is not None:
+            payload = redis_event.deserialize(
+                data.decode('utf-8', REDIS_ENCODING_ERRORS))
+        if payload is None:
+            return trace + data
+        encoded = redis_event.encode(payload, WIRE_CODEC_BINARY)
+        if isinstance(encoded, str):
+            encoded = encoded.encode('utf-8', REDIS_ENCODING_ERRORS)
+        return trace + encoded
+
+    def dispatch(self, key: bytes, channel: bytes, data: bytes):
+        self.received += 1
+        subscribers = self.subscribers.get(key)
+        if not subscribers:
+            return
+        if self._last[0] != (channel, data):
+            self._last = ((channel, data), self.convert(channel, data))
+        payload = self._last[1]
+        frame = b''.join([
+            FRAME.pack(len(key), len(channel), len(payload)), key, channel,
+            payload
+        ])
+        for writer in list(subscribers):
+            if writer.transport.get_write_buffer_size() > self.max_buffer:
+                LOGGER.warning(f'subscriber of {key} is more than '
+                               f'{self.max_buffer} bytes behind, '
+                               f'disconnecting it')
+                self.dropped += 1
+                subscribers.discard(writer)
+                writer.transport.abort()
+                continue
+            writer.write(frame)
+            self.sent += 1
+
+    async def _log_stats(self):
+        received, sent, last = 0, 0, time.time()
+        while True:
+            await asyncio.sleep(GATEWAY_STATS_SECONDS)
+            seconds = time.time() - last
+            LOGGER.info(
+                f'received {(self.received - received) / seconds:.0f} msg/s,'
+                f' sent {(self.sent - sent) / seconds:.0f} msg/s to '
+                f'{len(self.subscribers)} channels and patterns, '
+                f'{self.dropped} subscribers dropped')
+            received, sent, last = self.received, self.sent, time.time()
+
+
+def main():
+    parser = ArgumentParser(
+        description='Fans the market data of redis out to the processes of '
+        'the host, decoded once')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--path', default=MD_GATEWAY_PATH)
+    args = parser.parse_args()
+
+    asyncio.run(MarketDataGateway(args.host, args.port, args.path).run())
+
+
+if __name__ == '__main__':
+    main()
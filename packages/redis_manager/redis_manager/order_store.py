@@ -0,0 +1,129 @@
+from typing import Optional
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+from cryptofeed.defines import BUY, SELL
+
+from arb_defines.arb_dataclasses import Order
+
+
+class OrderStore:
+    """
+    Live orders indexed by id, instrument, exchange and side, maintained on
+    every add / remove instead of rebuilt on read.
+
+    Each (instr_id, side) keeps its priced orders sorted by (price, id), so
+    nearest and farthest orders are O(1) and updates O(log n) to locate.
+    Open count and notional (abs(qty) * price) are kept as running totals.
+    """
+
+    def __init__(self):
+        self.orders: dict[str, Order] = {}
+        self._by_instr: dict[int, dict[str, Order]] = defaultdict(dict)
+        self._by_exchange: dict[int, dict[str, Order]] = defaultdict(dict)
+        # (instr_id, side) -> sorted [(price, order_id)]
+        self._prices: dict[tuple[int, str], list] = defaultdict(list)
+        self._counts: dict[tuple[int, str], int] = defaultdict(int)
+        self._notionals: dict[tuple[int, str], float] = defaultdict(float)
+        # order_id -> (key, price, notional) as indexed, orders may be
+        # mutated in place afterwards
+        self._indexed: dict[str, tuple] = {}
+
+    def __len__(self) -> int:
+        return len(self.orders)
+
+    def __contains__(self, order_id) -> bool:
+        return str(order_id) in self.orders
+
+    def get(self, order_id) -> Optional[Order]:
+        return self.orders.get(str(order_id))
+
+    def instr_orders(self, instr_id: int) -> dict[str, Order]:
+        return self._by_instr[instr_id]
+
+    def exchange_orders(self, exchange_id: int) -> dict[str, Order]:
+        return self._by_exchange[exchange_id]
+
+    def add(self, order: Order):
+        """Insert or replace the order with the same id"""
+        order_id = str(order.id)
+        if order_id in self.orders:
+            self._unindex(order_id, self.orders[order_id])
+        self.orders[order_id] = order
+        self._by_instr[order.instr_id][order_id] = order
+        self._by_exchange[order.exchange_id][order_id] = order
+        side = order.side
+        if side not in (BUY, SELL):
+            return
+        key = (order.instr_id, side)
+        notional = 0.
+        self._counts[key] += 1
+        if order.price is not None:
+            insort(self._prices[key], (order.price, order_id))
+            notional = abs(order.qty) * order.price
+            self._notionals[key] += notional
+        self._indexed[order_id] = (key, order.price, notional)
+
+    def remove(self, order_id) -> Optional[Order]:
+        order_id = str(order_id)
+        order = self.orders.pop(order_id, None)
+        if order is not None:
+            self._unindex(order_id, order)
+        return order
+
+    def clear(self, instr_id: Optional[int] = None):
+        """Drop the orders of an instrument, or all of them"""
+        if instr_id is None:
+            self.__init__()
+            return
+        for order_id in list(self._by_instr.get(instr_id, {})):
+            self.remove(order_id)
+
+    def _unindex(self, order_id: str, order: Order):
+        self._by_instr[order.instr_id].pop(order_id, None)
+        self._by_exchange[order.exchange_id].pop(order_id, None)
+        indexed = self._indexed.pop(order_id, None)
+        if indexed is None:
+            return
+        key, price, notional = indexed
+        self._counts[key] -= 1
+        if price is not None:
+            prices = self._prices[key]
+            k = bisect_left(prices, (price, order_id))
+            if k < len(prices) and prices[k][1] == order_id:
+                del prices[k]
+            self._notionals[key] -= notional
+        if not self._counts[key]:
+            # no float residue once the side is empty
+            self._notionals[key] = 0.
+
+    def side_orders(self, instr_id: int, side: str) -> list[Order]:
+        """Priced orders of a side, nearest to the spread first"""
+        prices = self._prices.get((instr_id, side), [])
+        if side == BUY:
+            prices = reversed(prices)
+        return [self.orders[order_id] for _, order_id in prices]
+
+    def nearest(self, instr_id: int, side: str) -> Optional[Order]:
+        """Highest buy or lowest sell"""
+        prices = self._prices.get((instr_id, side))
+        if not prices:
+            return None
+        return self.orders[prices[-1 if side == BUY else 0][1]]
+
+    def farthest(self, instr_id: int, side: str) -> Optional[Order]:
+        """Lowest buy or highest sell"""
+        prices = self._prices.get((instr_id, side))
+        if not prices:
+            return None
+        return self.orders[prices[0 if side == BUY else -1][1]]
+
+    def open_count(self, instr_id: int, side: Optional[str] = None) -> int:
+        sides = [side] if side else [BUY, SELL]
+        return sum(self._counts.get((instr_id, s), 0) for s in sides)
+
+    def open_notional(self,
+                      instr_id: int,
+                      side: Optional[str] = None) -> float:
+        sides = [side] if side else [BUY, SELL]
+        return sum(self._notionals.get((instr_id, s), 0.) for s in sides)
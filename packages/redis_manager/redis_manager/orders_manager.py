@@ -2,12 +2,14 @@ import simplejson as json
 
 from datetime import datetime, timezone
 
+from typing import Optional
 from logging import Logger
-from dataclasses import dataclass
-from collections import defaultdict, ChainMap
+from dataclasses import InitVar, dataclass
+from collections import defaultdict
 
 from arb_defines.defines import CANCEL
-from redis_manager.redis_wrappers import ObjectRedis
+from redis_manager.order_store import OrderStore
+from redis_manager.redis_wrappers import ObjectRedis, hgetall_many
 from arb_defines.arb_dataclasses import Exchange, Instrument, Order
 from redis_manager.redis_events import CancelAllOrdersEvent, CancelAllOrdersExchangeEvent, CancelAllOrdersInstrEvent, CancelOrderEvent, OrderEvent, OrderExchangeEvent
 
@@ -17,40 +19,49 @@ class InstrOrdersManager(ObjectRedis):
     """DONT INSTANCIATE THIS CLASS DIRECTLY, USE ORDERS_MANAGER"""
     instrument: Instrument
     logger: Logger
+    # shared with the other managers of the OrdersManager
+    store: Optional[OrderStore] = None
+    # False when the orders are loaded later by OrdersManager
+    load: InitVar[bool] = True
 
-    def __post_init__(self):
+    def __post_init__(self, load: bool):
         self.logger.info(f'Load instr orders managers for {self.instrument}')
-        self._orders: dict[str, Order] = defaultdict(Order)
-        self.load_orders()
+        if self.store is None:
+            self.store = OrderStore()
+        if load:
+            self.load_orders()
 
     @property
-    def orders(self):
-        return self._orders
+    def orders(self) -> dict[str, Order]:
+        return self.store.instr_orders(self.instrument.id)
 
     def load_orders(self):
-        orders = self.redis_instance.hgetall(self.instrument.orders_hash)
-        self._orders: dict[str, Order] = {
-            k: Order(**json.loads(v))
-            for k, v in orders.items()
-        }
+        self.set_orders(
+            self.redis_instance.hgetall(self.instrument.orders_hash))
+
+    def set_orders(self, orders: dict[str, str]):
+        self.store.clear(self.instrument.id)
+        for v in orders.values():
+            self.store.add(Order(**json.loads(v)))
 
     def get_order(self, order_id) -> Order:
-        return self._orders.get(order_id)
+        return self.orders.get(str(order_id))
 
     def _store_local(self, order: Order) -> Order:
-        if order.id in self._orders:
+        known = self.orders.get(str(order.id))
+        if known is not None:
             # get latest valid order
             self.logger.debug(
-                f'Order {order} already exists, matching with known order {self._orders[str(order.id)]}'
+                f'Order {order} already exists, matching with known order {known}'
             )
-            order = order | self._orders[str(order.id)]
+            order = order | known
 
         if order.is_final:
             self.logger.debug(f'Order {order} is final, deleting from local')
             self._delete_order(order)
         else:
             self.logger.debug(f'Order {order} is not final, storing in local')
-            self._orders[str(order.id)] = order
+            self.store.add(order)
 
         return order
 
@@ -59,12 +70,11 @@ class InstrOrdersManager(ObjectRedis):
         if isinstance(order, Order):
             order_id = order.id
         self.logger.debug(f'Deleting order {order_id} from local')
-        if order_id in self._orders:
-            self.logger.debug(f'Order {order_id} found, deleting')
-            del self._orders[str(order_id)]
+        if self.store.remove(order_id) is not None:
+            self.logger.debug(f'Order {order_id} found, deleted')
         else:
             self.logger.warning(f'Order {order} not found')
-            self.logger.debug(self._orders)
+            self.logger.debug(self.orders)
 
     def _store_redis(self, order: Order):
         if not order:
@@ -101,28 +111,34 @@ class ExchangeOrdersManager(ObjectRedis):
     exchange: Exchange
     instruments: list[Instrument]
     logger: Logger
+    # shared with the other managers of the OrdersManager
+    store: Optional[OrderStore] = None
+    # False when the orders are loaded later by OrdersManager
+    load: InitVar[bool] = True
 
-    def __post_init__(self):
+    def __post_init__(self, load: bool):
         self.logger.info(f'Load exchange orders managers for {self.exchange}')
+        if self.store is None:
+            self.store = OrderStore()
 
         self.instr_orders_managers: dict[
             int, InstrOrdersManager] = defaultdict(InstrOrdersManager)
-        self.load_managers()
+        self.load_managers(load)
 
     @property
-    def orders(self):
-        return ChainMap(*[
-            manager.orders for manager in self.instr_orders_managers.values()
-        ])
+    def orders(self) -> dict[str, Order]:
+        return self.store.exchange_orders(self.exchange.id)
 
-    def load_managers(self):
+    def load_managers(self, load=True):
         for instr in self.instruments:
-            self.add_instrument_manager(instr)
+            self.add_instrument_manager(instr, load)
 
-    def add_instrument_manager(self, instr: Instrument):
+    def add_instrument_manager(self, instr: Instrument, load=True):
         manager = InstrOrdersManager(redis_handler=self.redis_handler,
                                      instrument=instr,
-                                     logger=self.logger)
+                                     logger=self.logger,
+                                     store=self.store,
+                                     load=load)
         self.instr_orders_managers[instr.id] = manager
 
     def _store_local(self, order: Order):
@@ -148,43 +164,39 @@ class OrdersManager(ObjectRedis):
     logger: Logger
 
     def __post_init__(self):
+        # live orders of every sub manager, indexed as they are handled
+        self.store = OrderStore()
         self.exchange_orders_managers: dict[
             int, ExchangeOrdersManager] = defaultdict(ExchangeOrdersManager)
         self.load_managers()
-        # self._orders: dict[str, Order] = self.all_orders
 
     @property
     def orders(self) -> dict[str, Order]:
         """ Return all orders managed by this manager """
-        return self.all_orders
-        # it should be usable but not tested after fix
-        return self._orders
+        return self.store.orders
 
     @property
     def all_orders(self) -> dict[str, Order]:
-        """
-        Return all orders from the sub managers
-        This looks costly hence it is cached using _orders
-        Only use it when you need to refresh the cache
-        """
-        return ChainMap(*[
-            manager.orders
-            for manager in self.exchange_orders_managers.values()
-        ])
-        return self._orders
+        """Same as orders, kept for existing callers"""
+        return self.store.orders
 
     def reload_all_orders(self, exchange_id=None):
         self.logger.info(
             f'Reloading all orders for {exchange_id if exchange_id else "all exchanges"}'
         )
-        for manager in self.exchange_orders_managers.values():
-            if exchange_id is None or manager.exchange.id == exchange_id:
-                for mana in manager.instr_orders_managers.values():
-                    mana.load_orders()
-        # self.all_orders
-
-    def get_order(self, order_id):
-        return self._orders.get(order_id)
+        managers = [
+            mana for manager in self.exchange_orders_managers.values()
+            if exchange_id is None or manager.exchange.id == exchange_id
+            for mana in manager.instr_orders_managers.values()
+        ]
+        # pipelined, one round trip per HYDRATION_BATCH instruments
+        orders = hgetall_many(self.redis_instance,
+                              [m.instrument.orders_hash for m in managers])
+        for manager, instr_orders in zip(managers, orders):
+            manager.set_orders(instr_orders)
+
+    def get_order(self, order_id) -> Optional[Order]:
+        return self.store.get(order_id)
 
     def get_orders(self, key):
         if isinstance(key, Instrument):
@@ -212,14 +224,17 @@ class OrdersManager(ObjectRedis):
 
     def load_managers(self):
         for exchange in set([i.exchange for i in self.instruments]):
-            self.add_exchange_manager(exchange)
+            self.add_exchange_manager(exchange, load=False)
+        self.reload_all_orders()
 
-    def add_exchange_manager(self, exchange: Exchange):
+    def add_exchange_manager(self, exchange: Exchange, load=True):
         exch_instr = [i for i in self.instruments if i.exchange == exchange]
         manager = ExchangeOrdersManager(redis_handler=self.redis_handler,
                                         exchange=exchange,
                                         instruments=exch_instr,
-                                        logger=self.logger)
+                                        logger=self.logger,
+                                        store=self.store,
+                                        load=load)
         self.exchange_orders_managers[exchange.id] = manager
 
     def add_instrument_manager(self, instr: Instrument):
@@ -0,0 +1,119 @@
+import os
+import time
+import threading
+import traceback
+
+from typing import Callable
+from collections import deque
+
+# time every callback run by RedisHandler
+CALLBACK_PROFILE = os.getenv('ARB_CALLBACK_PROFILE', '0') == '1'
+# callbacks slower than this are logged
+CALLBACK_BUDGET_MS = float(os.getenv('ARB_CALLBACK_BUDGET_MS', '10'))
+# durations kept per callback for the rolling stats
+CALLBACK_WINDOW = 1000
+# stats written to redis and slow callbacks logged at most every N seconds
+CALLBACK_STATS_SECONDS = 10
+CALLBACK_STATS_KEY = 'callback_stats'
+
+
+def callback_name(callback: Callable) -> str:
+    return getattr(callback, '__qualname__', None) or repr(callback)
+
+
+class CallbackStats:
+
+    def __init__(self):
+        self.durations = deque(maxlen=CALLBACK_WINDOW)
+        self.count = 0
+        self.slow = 0
+        self.warned = 0.
+
+    @staticmethod
+    def quantile(durations: list[float], q: float) -> float:
+        return durations[min(int(q * len(durations)), len(durations) - 1)]
+
+    def to_fields(self, prefix: str) -> dict[str, float]:
+        durations = sorted(self.durations)
+        if not durations:
+            return {}
+        return {
+            f'{prefix}|count': self.count,
+            f'{prefix}|slow': self.slow,
+            f'{prefix}|p50_ms': round(self.quantile(durations, 0.5), 3),
+            f'{prefix}|p99_ms': round(self.quantile(durations, 0.99), 3),
+            f'{prefix}|max_ms': round(durations[-1], 3),
+        }
+
+
+class CallbackProfiler:
+    """
+    Rolling duration stats per (channel pattern, callback).
+
+    Stats are written every CALLBACK_STATS_SECONDS to the redis hash
+    callback_stats:<process>:<pid>, fields are <channel>|<callback>|<stat>.
+    It expires when the process stops updating it.
+    """
+
+    def __init__(self,
+                 redis_instance,
+                 logger,
+                 budget_ms: float = CALLBACK_BUDGET_MS):
+        self.redis_instance = redis_instance
+        self.logger = logger
+        self.budget_ms = budget_ms
+        self.key = f'{CALLBACK_STATS_KEY}:{logger.name}:{os.getpid()}'
+        self.stats: dict[tuple[str, Callable], CallbackStats] = {}
+        self._publish_lock = threading.Lock()
+        self._publish_time = time.time()
+
+    def call(self, channel: str, callback: Callable, payload):
+        start = time.perf_counter()
+        try:
+            callback(payload)
+        finally:
+            self.record(channel, callback,
+                        (time.perf_counter() - start) * 1e3)
+
+    def record(self, channel: str, callback: Callable, ms: float):
+        stats = self.stats.get((channel, callback))
+        if stats is None:
+            stats = self.stats.setdefault((channel, callback),
+                                          CallbackStats())
+        stats.durations.append(ms)
+        stats.count += 1
+        if ms <= self.budget_ms:
+            return
+        stats.slow += 1
+        now = time.time()
+        if now - stats.warned >= CALLBACK_STATS_SECONDS:
+            stats.warned = now
+            self.logger.warning(
+                f'{callback_name(callback)} on {channel} took {ms:.1f}ms, '
+                f'budget {self.budget_ms}ms ({stats.slow} slow calls)')
+
+    def maybe_publish(self):
+        if time.time() - self._publish_time < CALLBACK_STATS_SECONDS:
+            return
+        # another thread is already publishing
+        if not self._publish_lock.acquire(blocking=False):
+            return
+        try:
+            self._publish_time = time.time()
+            self.publish()
+        except Exception:
+            self.logger.error(traceback.format_exc())
+        finally:
+            self._publish_lock.release()
+
+    def publish(self):
+        fields = {}
+        for (channel, callback), stats in list(self.stats.items()):
+            fields.update(
+                stats.to_fields(f'{channel}|{callback_name(callback)}'))
+        if not fields:
+            return
+        pipeline = self.redis_instance.pipeline(transaction=False)
+        pipeline.hset(self.key, mapping=fields)
+        pipeline.expire(self.key, int(CALLBACK_STATS_SECONDS * 3))
+        pipeline.execute()
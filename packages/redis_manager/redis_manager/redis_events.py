@@ -1,19 +1,49 @@
+import os
 import uuid
+import struct
 import simplejson as json
 
 from abc import ABC
-from datetime import datetime
-from dataclasses import asdict
+from copy import copy
+from dataclasses import asdict, is_dataclass, replace
+from datetime import datetime, timedelta, timezone
 
-from dacite import from_dict, Config as DaciteConfig
+from dacite import Config as DaciteConfig
 
 from arb_defines.defines import *
 from arb_logger.logger import get_logger
 from arb_defines.status import StatusEnum
-from arb_defines.arb_dataclasses import Candle, ExchangeApiPayload, Latency, SentinelPayload, StrategyInfo, Order, Trade, Exchange, ExchangeStatus, Balance, Instrument, InstrStatus, OrderBook, FundingRate, Position, TriggerPayload
+from arb_defines.arb_dataclasses import Candle, ExchangeApiPayload, Latency, SentinelPayload, StrategyInfo, Order, Trade, Exchange, ExchangeStatus, Balance, Instrument, InstrStatus, OrderBook, OrderBookDelta, FundingRate, Position, TriggerPayload
+from redis_manager.decoders import build_decoder
 
 LOGGER = get_logger('redis_events', short=True)
 
+WIRE_CODEC_JSON = 'json'
+WIRE_CODEC_BINARY = 'binary'
+# codec used to publish, every process can decode both so during a rolling
+# upgrade update consumers first then switch producers to binary
+WIRE_CODEC = os.getenv('ARB_WIRE_CODEC', WIRE_CODEC_JSON)
+
+# binary messages start with a non ascii byte, it can never start a json payload
+BINARY_MAGIC = 0xAB
+# bump only on incompatible changes, adding fields at the end of a schema is
+# backward compatible since decoders ignore unknown presence bits
+BINARY_VERSION = 1
+# publish OrderBookDeltaEvent, full books only go out on OrderBookEvent with
+# the snapshots, see InstrumentRedis
+L2_DELTAS = os.getenv('ARB_L2_DELTAS', '0') == '1'
+# with L2_DELTAS, still publish every full book on OrderBookEvent; otherwise
+# RedisManager serves OrderBookEvent subscriptions from the deltas
+L2_FULL_BOOKS = os.getenv('ARB_L2_FULL_BOOKS', '0') == '1'
+# a full snapshot is published every N updates or S seconds per instrument
+L2_SNAPSHOT_UPDATES = int(os.getenv('ARB_L2_SNAPSHOT_UPDATES', '100'))
+L2_SNAPSHOT_SECONDS = float(os.getenv('ARB_L2_SNAPSHOT_SECONDS', '5'))
+# redis clients decode responses, binary payloads survive the round trip
+# only if undecodable bytes are escaped instead of raising
+REDIS_ENCODING_ERRORS = 'surrogateescape'
+_BINARY_MAGIC_CHAR = bytes([BINARY_MAGIC]).decode('utf-8',
+                                                  REDIS_ENCODING_ERRORS)
+
 
 def factory(data):
 
@@ -27,9 +57,312 @@ def factory(data):
     return {k: _factory_mapper(v) for (k, v) in data if v is not None}
 
 
+# ██╗    ██╗██╗██████╗ ███████╗
+# ██║    ██║██║██╔══██╗██╔════╝
+# ██║ █╗ ██║██║██████╔╝█████╗
+# ██║███╗██║██║██╔══██╗██╔══╝
+# ╚███╔███╔╝██║██║  ██║███████╗
+#  ╚══╝╚══╝ ╚═╝╚═╝  ╚═╝╚══════╝
+
+F_INT = 'int'
+F_FLOAT = 'float'
+F_BOOL = 'bool'
+F_STR = 'str'
+F_UUID = 'uuid'
+F_DATETIME = 'datetime'
+F_LEVELS = 'levels'
+
+_HEADER = struct.Struct('<BBBI')
+_INT = struct.Struct('<q')
+_FLOAT = struct.Struct('<d')
+_BOOL = struct.Struct('<?')
+_LEN = struct.Struct('<H')
+_DATETIME = struct.Struct('<q?')
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _pack_str(value) -> bytes:
+    value = str(value).encode()
+    return _LEN.pack(len(value)) + value
+
+
+def _unpack_str(data, offset):
+    (length, ) = _LEN.unpack_from(data, offset)
+    offset += _LEN.size
+    return data[offset:offset + length].decode(), offset + length
+
+
+def _pack_uuid(value) -> bytes:
+    if not isinstance(value, uuid.UUID):
+        value = uuid.UUID(str(value))
+    return value.bytes
+
+
+def _unpack_uuid(data, offset):
+    return uuid.UUID(bytes=bytes(data[offset:offset + 16])), offset + 16
+
+
+def _pack_datetime(value: datetime) -> bytes:
+    is_aware = value.tzinfo is not None
+    if not is_aware:
+        value = value.replace(tzinfo=timezone.utc)
+    return _DATETIME.pack((value - _EPOCH) // _MICROSECOND, is_aware)
+
+
+def _unpack_datetime(data, offset):
+    micros, is_aware = _DATETIME.unpack_from(data, offset)
+    value = _EPOCH + timedelta(microseconds=micros)
+    if not is_aware:
+        value = value.replace(tzinfo=None)
+    return value, offset + _DATETIME.size
+
+
+def _pack_levels(levels) -> bytes:
+    flat = []
+    for price, size in levels:
+        flat.append(float(price))
+        flat.append(float(size))
+    return struct.pack(f'<H{len(flat)}d', len(levels), *flat)
+
+
+def _unpack_levels(data, offset):
+    (length, ) = _LEN.unpack_from(data, offset)
+    offset += _LEN.size
+    flat = struct.unpack_from(f'<{length * 2}d', data, offset)
+    levels = [[flat[i], flat[i + 1]] for i in range(0, length * 2, 2)]
+    return levels, offset + length * 2 * _FLOAT.size
+
+
+def _unpacker(st: struct.Struct):
+
+    def _unpack(data, offset):
+        return st.unpack_from(data, offset)[0], offset + st.size
+
+    return _unpack
+
+
+_PACKERS = {
+    F_INT: _INT.pack,
+    F_FLOAT: lambda v: _FLOAT.pack(float(v)),
+    F_BOOL: lambda v: _BOOL.pack(bool(v)),
+    F_STR: _pack_str,
+    F_UUID: _pack_uuid,
+    F_DATETIME: _pack_datetime,
+    F_LEVELS: _pack_levels,
+}
+
+_UNPACKERS = {
+    F_INT: _unpacker(_INT),
+    F_FLOAT: _unpacker(_FLOAT),
+    F_BOOL: _unpacker(_BOOL),
+    F_STR: _unpack_str,
+    F_UUID: _unpack_uuid,
+    F_DATETIME: _unpack_datetime,
+    F_LEVELS: _unpack_levels,
+}
+
+
+class BinarySchema:
+    """
+    Layout of a payload class on the wire:
+    header (magic, version, schema_id, presence mask) then non None fields.
+    Fields are append only, never reorder or remove them.
+    """
+
+    def __init__(self, schema_id: int, payload_class,
+                 fields: list[tuple[str, str]]):
+        if len(fields) > 32:
+            raise ValueError(f'{payload_class} has too many fields')
+        self.schema_id = schema_id
+        self.payload_class = payload_class
+        self.fields = [(name, _PACKERS[kind], _UNPACKERS[kind])
+                       for name, kind in fields]
+
+    def encode(self, payload) -> bytes:
+        mask = 0
+        parts = []
+        for bit, (name, pack, _) in enumerate(self.fields):
+            value = getattr(payload, name)
+            if value is None:
+                continue
+            mask |= 1 << bit
+            parts.append(pack(value))
+        header = _HEADER.pack(BINARY_MAGIC, BINARY_VERSION, self.schema_id,
+                              mask)
+        return header + b''.join(parts)
+
+    def decode(self, data: bytes):
+        offset = _HEADER.size
+        _, _, _, mask = _HEADER.unpack_from(data)
+        kwargs = {}
+        for bit, (name, _, unpack) in enumerate(self.fields):
+            if mask & (1 << bit):
+                kwargs[name], offset = unpack(data, offset)
+        return self.payload_class(**kwargs)
+
+
+# instr is never sent, ReduceInstrEvent drops it from json payloads as well
+BINARY_SCHEMAS: dict[int, BinarySchema] = {
+    s.schema_id: s
+    for s in [
+        BinarySchema(1, OrderBook, [
+            ('instr_id', F_INT),
+            ('bids', F_LEVELS),
+            ('asks', F_LEVELS),
+            ('timestamp', F_FLOAT),
+        ]),
+        BinarySchema(2, Trade, [
+            ('id', F_STR),
+            ('time', F_DATETIME),
+            ('qty', F_FLOAT),
+            ('price', F_FLOAT),
+            ('order_type', F_STR),
+            ('exchange_order_id', F_STR),
+            ('fee', F_FLOAT),
+            ('instr_id', F_INT),
+            ('exchange_id', F_INT),
+            ('is_liquidation', F_BOOL),
+            ('trade_count', F_INT),
+        ]),
+        BinarySchema(3, FundingRate, [
+            ('instr_id', F_INT),
+            ('rate', F_FLOAT),
+            ('predicted_rate', F_FLOAT),
+            ('next_funding_time', F_DATETIME),
+            ('timestamp', F_FLOAT),
+        ]),
+        BinarySchema(4, Order, [
+            ('id', F_STR),
+            ('time', F_DATETIME),
+            ('exchange_order_id', F_STR),
+            ('order_type', F_STR),
+            ('price', F_FLOAT),
+            ('qty', F_FLOAT),
+            ('order_status', F_STR),
+            ('instr_id', F_INT),
+            ('exchange_id', F_INT),
+            ('strat_id', F_INT),
+            ('event_type', F_STR),
+            ('event_key', F_UUID),
+            ('time_open', F_DATETIME),
+            ('time_ack_mkt', F_DATETIME),
+            ('time_filled_mkt', F_DATETIME),
+            ('time_cancel', F_DATETIME),
+            ('time_canceled_mkt', F_DATETIME),
+            ('time_rejected_mkt', F_DATETIME),
+            ('total_filled', F_FLOAT),
+        ]),
+        BinarySchema(5, OrderBookDelta, [
+            ('instr_id', F_INT),
+            ('seq', F_INT),
+            ('bids', F_LEVELS),
+            ('asks', F_LEVELS),
+            ('snapshot', F_BOOL),
+            ('timestamp', F_FLOAT),
+        ]),
+    ]
+}
+BINARY_SCHEMAS_BY_CLASS = {s.payload_class: s for s in BINARY_SCHEMAS.values()}
+
+
+def binary_schema(payload_class) -> BinarySchema | None:
+    """Schema of a payload class or of its closest schema parent"""
+    try:
+        return BINARY_SCHEMAS_BY_CLASS[payload_class]
+    except KeyError:
+        schema = next((BINARY_SCHEMAS_BY_CLASS[c]
+                       for c in payload_class.__mro__[1:]
+                       if c in BINARY_SCHEMAS_BY_CLASS), None)
+        BINARY_SCHEMAS_BY_CLASS[payload_class] = schema
+        return schema
+
+
+def is_binary_payload(payload) -> bool:
+    if isinstance(payload, str):
+        return payload.startswith(_BINARY_MAGIC_CHAR)
+    if isinstance(payload, bytes | bytearray | memoryview):
+        return len(payload) > 0 and payload[0] == BINARY_MAGIC
+    return False
+
+
+class WireCodec(ABC):
+    name = None
+
+    def encode(self, redis_event, payload):
+        raise NotImplementedError
+
+    def decode(self, redis_event, data):
+        raise NotImplementedError
+
+
+class JsonWireCodec(WireCodec):
+    name = WIRE_CODEC_JSON
+
+    def encode(self, redis_event, payload):
+        return redis_event.serialize(payload)
+
+    def decode(self, redis_event, data):
+        if isinstance(data, str):
+            data = json.loads(data)
+        return redis_event.payload_decoder(data)
+
+
+class BinaryWireCodec(WireCodec):
+    """Compact encoding for hot payloads, anything else falls back to json"""
+    name = WIRE_CODEC_BINARY
+
+    def encode(self, redis_event, payload):
+        schema = binary_schema(type(payload))
+        if schema is not None:
+            try:
+                return schema.encode(payload)
+            except (TypeError, ValueError, struct.error) as e:
+                LOGGER.debug(f'{redis_event} binary encoding failed: {e}')
+        return redis_event.serialize(payload)
+
+    def decode(self, redis_event, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8', REDIS_ENCODING_ERRORS)
+        _, version, schema_id, _ = _HEADER.unpack_from(data)
+        if version > BINARY_VERSION:
+            raise ValueError(
+                f'unsupported binary version {version} > {BINARY_VERSION}')
+        schema = BINARY_SCHEMAS.get(schema_id)
+        if schema is None:
+            raise ValueError(f'unknown binary schema {schema_id}')
+        return schema.decode(data)
+
+
+WIRE_CODECS: dict[str, WireCodec] = {
+    c.name: c
+    for c in [JsonWireCodec(), BinaryWireCodec()]
+}
+
+
+def get_wire_codec(name: str = None) -> WireCodec:
+    codec = WIRE_CODECS.get(name or WIRE_CODEC)
+    if codec is None:
+        raise ValueError(f'unknown wire codec {name or WIRE_CODEC}')
+    return codec
+
+
 class RedisEvent(ABC):
     dacite_config = DaciteConfig(cast=[uuid.UUID],
                                  type_hooks={datetime: datetime.fromisoformat})
+    payload_decoder = None
+    # each message is the latest value of its channel, subscribers can ask to
+    # skip older messages of a backlog
+    conflatable = False
+    # market data, publishers add a latency trace when LATENCY_TRACE is set
+    traced = False
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # from_dict equivalent generated once per payload class
+        if getattr(cls, 'payload_class', None) is not None:
+            cls.payload_decoder = staticmethod(
+                build_decoder(cls.payload_class, cls.dacite_config))
 
     def __init__(self):
         if not hasattr(self, 'channel'):
@@ -51,10 +384,10 @@ class RedisEvent(ABC):
     def deserialize(cls, payload: dict) -> object:
         if payload is None:
             return
-        if isinstance(payload, str):
-            payload = json.loads(payload)
+        codec = WIRE_CODEC_BINARY if is_binary_payload(
+            payload) else WIRE_CODEC_JSON
         try:
-            return from_dict(cls.payload_class, payload, cls.dacite_config)
+            return WIRE_CODECS[codec].decode(cls, payload)
         except Exception as e:
             LOGGER.error(e)
             LOGGER.error(f'{cls.payload_class} payload: {payload}')
@@ -67,6 +400,23 @@ class RedisEvent(ABC):
         payload = json.dumps(payload, separators=(',', ':'), default=str)
         return payload
 
+    @classmethod
+    def encode(cls, payload, codec: str = None) -> str | bytes:
+        """
+        Serialize payload for publishing, serialize() stays json since it is
+        also used to store payloads in redis hashes
+        """
+        return get_wire_codec(codec).encode(cls, payload)
+
+    @staticmethod
+    def local_payload(payload):
+        """
+        Payload as subscribers of a local bus receive it: the object itself,
+        unless the wire would give them another type or the subscriber
+        another object to change
+        """
+        return payload
+
 
 class LatencyDBEvent(RedisEvent):
     channel = DB_ADD_LATENCY
@@ -100,6 +450,11 @@ class ReduceInstrEvent:
         payload = json.dumps(payload, separators=(',', ':'), default=str)
         return payload
 
+    @staticmethod
+    def local_payload(payload):
+        # orders and trades are updated on both sides, each keeps its object
+        return copy(payload)
+
 
 class ReduceIdEvent(RedisEvent):
 
@@ -112,17 +467,32 @@ class ReduceIdEvent(RedisEvent):
         return payload
 
     @staticmethod
-    def serialize(payload) -> str:
+    def local_payload(payload) -> dict:
         if isinstance(payload, Instrument):
             payload = {'instr_id': payload.id}
         if isinstance(payload, Exchange):
             payload = {'exchange_id': payload.id}
         if not isinstance(payload, dict):
             raise ValueError(f'{payload} is not a dict, did not get reduced')
+        return payload
+
+    @classmethod
+    def serialize(cls, payload) -> str:
+        payload = cls.local_payload(payload)
         payload = json.dumps(payload, separators=(',', ':'), default=str)
         return payload
 
 
+class ConfigDictEvent:
+
+    @staticmethod
+    def local_payload(payload):
+        # config is a dict once through the wire
+        if is_dataclass(payload.config):
+            payload = replace(payload, config=asdict(payload.config))
+        return payload
+
+
 class OrderDBEvent(ReduceInstrEvent, RedisEvent):
     channel = DB_ADD_ORDER
     payload_class = Order
@@ -231,11 +601,24 @@ class InstrStatusEvent(InstrumentDrivenEvent):
 class OrderBookEvent(InstrumentDrivenEvent):
     channel = ORDERBOOK_UPDATE
     payload_class = OrderBook
+    conflatable = True
+    traced = True
+
+
+class OrderBookDeltaEvent(InstrumentDrivenEvent):
+    """
+    L2 levels changes with a per instrument sequence number, RedisManager
+    rebuilds the book and its callbacks receive the OrderBook
+    """
+    channel = ORDERBOOK_DELTA
+    payload_class = OrderBookDelta
+    traced = True
 
 
 class FundingRateEvent(InstrumentDrivenEvent):
     channel = FUNDING_RATE_UPDATE
     payload_class = FundingRate
+    traced = True
 
     @staticmethod
     def _filter_objects(instruments: list[Instrument]):
@@ -255,6 +638,7 @@ class OrderEvent(ReduceInstrEvent, InstrumentDrivenEvent):
 class TradeEvent(ReduceInstrEvent, InstrumentDrivenEvent):
     channel = TRADE_UPDATE
     payload_class = Trade
+    traced = True
 
 
 class CandleEvent(ReduceInstrEvent, InstrumentDrivenEvent):
@@ -262,9 +646,20 @@ class CandleEvent(ReduceInstrEvent, InstrumentDrivenEvent):
     payload_class = Candle
 
 
+class CandleBarEvent(ReduceInstrEvent, InstrumentDrivenEvent):
+    """
+    Bars built from trades by CandleSentinel, every timeframe on the same
+    channel: candle.timeframe tells them apart. CandleEvent carries the
+    exchange candles.
+    """
+    channel = CANDLE_BAR
+    payload_class = Candle
+
+
 class LiquidationEvent(ReduceInstrEvent, InstrumentDrivenEvent):
     channel = LIQUIDATION_UPDATE
     payload_class = Trade
+    traced = True
 
     @staticmethod
     def _filter_objects(instruments: list[Instrument]):
@@ -284,7 +679,7 @@ class TradeExecEvent(ReduceInstrEvent, InstrumentDrivenEvent):
 #    ╚═╝   ╚═╝  ╚═╝╚═╝ ╚═════╝  ╚═════╝ ╚══════╝╚═╝  ╚═╝
 
 
-class TriggerEvent(RedisEvent):
+class TriggerEvent(ConfigDictEvent, RedisEvent):
     channel = TRIGGER_EVENT
     payload_class = TriggerPayload
 
@@ -301,7 +696,7 @@ class TriggerEvent(RedisEvent):
         return [f'{self.channel}:{self.trigger_id}']
 
 
-class SentinelEvent(ArbDataclassDriverEvent):
+class SentinelEvent(ConfigDictEvent, ArbDataclassDriverEvent):
     channel = SENTINEL_EVENT
     arb_dataclass = SentinelPayload
     payload_class = SentinelPayload
@@ -1,14 +1,42 @@
+import os
+import math
 import time
+import atexit
+import threading
 import traceback
 
 from abc import ABC
 from typing import Callable
+from operator import attrgetter
 from dataclasses import dataclass
+from collections import Counter
 
 from redis.client import Redis
 
 from arb_logger.logger import get_logger
-from redis_manager.redis_events import CancelAllOrdersInstrEvent, OrderBookEvent, RedisEvent, OrderExchangeEvent, CancelOrderEvent, StrategyInfoDBEvent, OrderDBEvent, TradeEvent
+from redis_manager.profiler import CALLBACK_PROFILE, CallbackProfiler
+from redis_manager.latency import LATENCY_TRACE, LatencyRecorder, add_trace, exchange_time, is_traced, split_trace
+from redis_manager.redis_events import REDIS_ENCODING_ERRORS, WIRE_CODEC, BalanceEvent, LatencyDBEvent, CancelAllOrdersInstrEvent, OrderBookDeltaEvent, OrderBookEvent, OrderEvent, PositionEvent, RedisEvent, OrderExchangeEvent, CancelOrderEvent, StrategyInfoDBEvent, OrderDBEvent, TradeEvent, TradeExecEvent
+
+# not logged in debug, way too verbose
+HOT_CHANNELS = [
+    OrderBookEvent.channel, OrderBookDeltaEvent.channel, TradeEvent.channel
+]
+
+# publishes buffered until PUBLISH_BATCH messages or PUBLISH_BATCH_US
+# microseconds, then sent in one pipeline. 1 publishes immediately
+PUBLISH_BATCH = int(os.getenv('ARB_PUBLISH_BATCH', '1'))
+PUBLISH_BATCH_US = int(os.getenv('ARB_PUBLISH_BATCH_US', '500'))
+# published with everything buffered before them, never delayed
+FLUSHED_CHANNELS = [
+    OrderExchangeEvent.channel, CancelOrderEvent.channel,
+    CancelAllOrdersInstrEvent.channel, OrderEvent.channel,
+    TradeExecEvent.channel, PositionEvent.channel, BalanceEvent.channel
+]
+
+# messages read at once from the socket backlog when conflating
+CONFLATION_MAX_BATCH = 1000
+CONFLATION_LOG_SECONDS = 60
 
 
 @dataclass
@@ -16,59 +44,123 @@ class EventHandler:
     event: RedisEvent
     callbacks: list[Callable]
     deserialize: bool = True
+    # only the newest message of a channel backlog is handled
+    conflate: bool = False
 
 
 class RedisHandler(ABC):
 
-    def __init__(self, host='localhost', port=6379, logger=None):
+    def __init__(self,
+                 host='localhost',
+                 port=6379,
+                 logger=None,
+                 wire_codec=WIRE_CODEC,
+                 publish_batch=PUBLISH_BATCH,
+                 publish_batch_us=PUBLISH_BATCH_US,
+                 profile_callbacks=CALLBACK_PROFILE):
         self.logger = logger or get_logger(self.__class__.__name__, short=True)
 
-        self.redis_instance: Redis = Redis(host=host,
-                                           port=port,
-                                           decode_responses=True)
+        self.redis_instance: Redis = Redis(
+            host=host,
+            port=port,
+            decode_responses=True,
+            encoding_errors=REDIS_ENCODING_ERRORS)
+        self.wire_codec = wire_codec
         self.pubsub = self.redis_instance.pubsub()
 
         self.events: dict[str, EventHandler] = {}
 
+        # channel attribute of the payload by (event, payload class) and
+        # channel by (event, attribute value)
+        self._channel_getters: dict[tuple, Callable] = {}
+        self._channels: dict[tuple, str] = {}
+
+        # latencies of traced messages received
+        self.latencies = LatencyRecorder()
+        # callbacks durations, None when not profiling
+        self.profiler = CallbackProfiler(
+            self.redis_instance, self.logger) if profile_callbacks else None
+
+        self.publish_batch = publish_batch
+        self.publish_batch_us = publish_batch_us
+        self._publish_buffer: list[tuple[str, str | bytes]] = []
+        self._publish_lock = threading.Condition(threading.RLock())
+        self._flush_thread = None
+        if publish_batch > 1:
+            atexit.register(self.flush)
+        # any channel conflates, messages are then read by batch
+        self.conflating = False
+        # conflated messages by channel
+        self.conflated = Counter()
+        self._conflated_logged = 0
+        self._conflation_log_time = time.time()
+
+    @staticmethod
+    def _check_conflate(redis_event: RedisEvent, conflate: bool):
+        if conflate and not redis_event.conflatable:
+            raise ValueError(f'{redis_event} can not be conflated')
+
     def subscribe_event(self,
                         redis_event: RedisEvent,
                         callbacks=None,
-                        deserialize=True):
+                        deserialize=True,
+                        conflate=False):
+        self._check_conflate(redis_event, conflate)
         if not isinstance(callbacks, list):
             callbacks = [callbacks]
             callbacks = list(set(callbacks))
 
         channels = redis_event.get_channels()
+        new_channels = []
         for c in channels:
             # Wrongly implemented? If channel is already subscribed we simply add the callbacks to the existing channel
             # but the redis_event could be different with different channels?
             # or since channels are built they should be the same/not exists hence bueno?
             if c not in self.events:
-                self.pubsub.subscribe(c)
+                new_channels.append(c)
                 self.events[c] = EventHandler(redis_event, callbacks,
-                                              deserialize)
+                                              deserialize, conflate)
             else:
+                # conflate only if every subscriber asked for it
+                self.events[c].conflate &= conflate
                 for callback in callbacks:
                     if callback not in self.events[c].callbacks:
                         self.events[c].callbacks.append(callback)
+        if new_channels:
+            # one SUBSCRIBE for every channel of the event
+            self._subscribe(*new_channels)
+        self._update_conflating()
 
     def psubscribe_event(self,
                          redis_event: RedisEvent,
                          callbacks=None,
-                         deserialize=True):
+                         deserialize=True,
+                         conflate=False):
+        self._check_conflate(redis_event, conflate)
         if not isinstance(callbacks, list):
             callbacks = [callbacks]
             callbacks = list(set(callbacks))
 
         channel = f'{redis_event.channel}*'
         if channel not in self.events:
-            self.pubsub.psubscribe(channel)
+            self._psubscribe(channel)
             self.events[channel] = EventHandler(redis_event, callbacks,
-                                                deserialize)
+                                                deserialize, conflate)
         else:
+            self.events[channel].conflate &= conflate
             for callback in callbacks:
                 if callback not in self.events[channel].callbacks:
                     self.events[channel].callbacks.extend(callbacks)
+        self._update_conflating()
+
+    def _subscribe(self, *channels: str):
+        self.pubsub.subscribe(*channels)
+
+    def _psubscribe(self, pattern: str):
+        self.pubsub.psubscribe(pattern)
+
+    def _update_conflating(self):
+        self.conflating = any(e.conflate for e in self.events.values())
 
     def run(self):
         self.logger.info(f'subscribed to channels {list(self.events.keys())}')
@@ -81,62 +173,194 @@ class RedisHandler(ABC):
 
         for message in self.pubsub.listen():
             if message and message['type'] in ['message', 'pmessage']:
-                self.__handle_message(message)
+                if self.conflating:
+                    self.__handle_backlog(message)
+                else:
+                    self._handle_message(message)
+
+    def __read_backlog(self, message) -> list[dict]:
+        """message and every message already waiting on the connection"""
+        messages = [message]
+        while len(messages) < CONFLATION_MAX_BATCH:
+            message = self.pubsub.get_message(timeout=0)
+            if message is None:
+                break
+            if message['type'] in ['message', 'pmessage']:
+                messages.append(message)
+        return messages
+
+    def __handle_backlog(self, message):
+        self._handle_messages(self.__read_backlog(message))
+
+    def _handle_messages(self, messages: list[dict]):
+        """Messages read at once, conflated subscriptions get their newest"""
+        # (channel or pattern, channel) of conflated events: index of newest
+        # message, a pattern or another subscription of the same channel
+        # keeps its own messages
+        newest = {}
+        for i, message in enumerate(messages):
+            key = message['pattern'] or message['channel']
+            event_handler = self.events.get(key)
+            if event_handler and event_handler.conflate:
+                newest[key, message['channel']] = i
+
+        for i, message in enumerate(messages):
+            key = message['pattern'] or message['channel']
+            if newest.get((key, message['channel']), i) != i:
+                self.conflated[message['channel']] += 1
+                continue
+            self._handle_message(message)
+
+        self._log_conflation()
+
+    def _log_conflation(self):
+        if time.time() - self._conflation_log_time < CONFLATION_LOG_SECONDS:
+            return
+        total = self.conflated.total()
+        if total > self._conflated_logged:
+            self.logger.info(
+                f'conflated {total - self._conflated_logged} messages in '
+                f'{time.time() - self._conflation_log_time:.0f}s, '
+                f'most conflated: {self.conflated.most_common(3)}')
+        self._conflated_logged = total
+        self._conflation_log_time = time.time()
 
-    def __handle_message(self, message):
+    def _handle_message(self, message):
         channel = message['pattern'] or message['channel']
         event_handler: EventHandler = self.events.get(channel)
 
-        if event_handler.event not in [OrderBookEvent, TradeEvent]:
+        if event_handler.event not in [OrderBookEvent, OrderBookDeltaEvent, TradeEvent]:
             self.logger.debug(f'handling {event_handler} with message {message}')
         if not event_handler:
             self.logger.warning(f'unknown channel {channel}')
             return
+        data = message['data']
+        trace = None
+        if is_traced(data):
+            dispatch_time = time.time()
+            trace, data = split_trace(data)
         try:
             if event_handler.deserialize:
-                payload = event_handler.event.deserialize(message['data'])
+                payload = event_handler.event.deserialize(data)
+            else:
+                payload = data
+            if trace:
+                decoded_time = time.time()
+            if self.profiler is None:
+                for callback in event_handler.callbacks:
+                    callback(payload)
             else:
-                payload = message['data']
-            for callback in event_handler.callbacks:
-                callback(payload)
+                for callback in event_handler.callbacks:
+                    self.profiler.call(channel, callback, payload)
         except Exception:
             self.logger.error(traceback.format_exc())
+        else:
+            if trace:
+                self.latencies.record(event_handler.event.channel,
+                                      getattr(payload, 'instr_id', None),
+                                      trace, dispatch_time, decoded_time,
+                                      time.time())
+        if self.profiler is not None:
+            self.profiler.maybe_publish()
 
-    def __publish_payload(self,
-                          redis_event: RedisEvent,
-                          payload,
-                          channel=None):
-        if channel is None:
-            channel = redis_event.channel
-            if hasattr(payload, 'instr_id'):
-                channel += f':{payload.instr_id}'
-            elif hasattr(payload, 'exchange_id'):
-                channel += f':{payload.exchange_id}'
-            elif hasattr(payload, 'trigger_id'):
-                channel += f':{payload.trigger_id}'
-            elif hasattr(payload, 'sentinel_id'):
-                channel += f':{payload.sentinel_id}'
-
-        payload = redis_event.serialize(payload)
-        if redis_event.channel not in [OrderBookEvent.channel, TradeEvent.channel]:
-            self.logger.debug(f'publishing on {channel} payload {payload}')
-        self.redis_instance.publish(channel, payload)
-
-    def publish_event(self, redis_event: RedisEvent, payload=None):
-        # pass payload to XxxRedis and use his setter to remove math case
+    def flush_latencies(self):
+        """Publish latency histograms to the db handler"""
+        for latency in self.latencies.flush():
+            self.publish_event(LatencyDBEvent, latency)
 
-        if redis_event.channel not in [OrderBookEvent.channel, TradeEvent.channel]:
-            self.logger.debug(f'publishing {redis_event} with payload {payload}')
+    def _channel_getter(self, redis_event: RedisEvent, payload):
+        """Payload attribute completing the channel, None if constant"""
         match redis_event():
             case OrderExchangeEvent() | CancelOrderEvent():
-                channel = f'{redis_event.channel}:{payload.exchange_id}'
-                self.__publish_payload(redis_event, payload, channel)
+                return attrgetter('exchange_id')
             case CancelAllOrdersInstrEvent():
-                channel = f'{redis_event.channel}:{payload.exchange.id}'
-                self.__publish_payload(redis_event, payload, channel)
+                return attrgetter('exchange.id')
             case OrderDBEvent() | StrategyInfoDBEvent():
-                self.__publish_payload(redis_event, payload, redis_event.channel)
+                return None
             case RedisEvent():
-                self.__publish_payload(redis_event, payload)
+                for attr in ['instr_id', 'exchange_id', 'trigger_id',
+                             'sentinel_id']:
+                    if hasattr(payload, attr):
+                        return attrgetter(attr)
+                return None
             case _:
                 self.logger.warning(f'unknown event {redis_event}')
+                return None
+
+    def get_channel(self, redis_event: RedisEvent, payload) -> str:
+        key = (redis_event, type(payload))
+        try:
+            getter = self._channel_getters[key]
+        except KeyError:
+            getter = self._channel_getters[key] = self._channel_getter(
+                redis_event, payload)
+        if getter is None:
+            return redis_event.channel
+
+        key = (redis_event, getter(payload))
+        try:
+            return self._channels[key]
+        except KeyError:
+            channel = self._channels[key] = f'{redis_event.channel}:{key[1]}'
+            return channel
+
+    def publish_event(self,
+                      redis_event: RedisEvent,
+                      payload=None,
+                      flush=False,
+                      receipt_time=None):
+        """
+        flush: send every buffered publish now, implied for FLUSHED_CHANNELS
+        receipt_time: when the feed handler received the payload, traced with
+        the payload time and publish time if LATENCY_TRACE
+        """
+        # pass payload to XxxRedis and use his setter to remove math case
+        channel = self.get_channel(redis_event, payload)
+        data = redis_event.encode(payload, self.wire_codec)
+        if LATENCY_TRACE and redis_event.traced:
+            data = add_trace(data, exchange_time(payload),
+                             receipt_time or math.nan, time.time())
+        if redis_event.channel not in HOT_CHANNELS:
+            self.logger.debug(f'publishing on {channel} payload {data}')
+
+        if self.publish_batch <= 1:
+            self.redis_instance.publish(channel, data)
+            return
+
+        with self._publish_lock:
+            self._publish_buffer.append((channel, data))
+            if (flush or redis_event.channel in FLUSHED_CHANNELS
+                    or len(self._publish_buffer) >= self.publish_batch):
+                self.flush()
+            elif len(self._publish_buffer) == 1:
+                self._start_flush_timer()
+
+    def flush(self):
+        """Publish buffered messages in one pipeline, in publish order"""
+        with self._publish_lock:
+            if not self._publish_buffer:
+                return
+            pipeline = self.redis_instance.pipeline(transaction=False)
+            for channel, data in self._publish_buffer:
+                pipeline.publish(channel, data)
+            self._publish_buffer = []
+            pipeline.execute()
+
+    def _start_flush_timer(self):
+        if self._flush_thread is None:
+            self._flush_thread = threading.Thread(target=self._flush_timer,
+                                                  daemon=True)
+            self._flush_thread.start()
+        self._publish_lock.notify()
+
+    def _flush_timer(self):
+        """Flush a buffer at most publish_batch_us after its first message"""
+        while True:
+            with self._publish_lock:
+                while not self._publish_buffer:
+                    self._publish_lock.wait()
+            time.sleep(self.publish_batch_us / 1e6)
+            try:
+                self.flush()
+            except Exception:
+                self.logger.error(traceback.format_exc())
@@ -8,14 +8,23 @@ from collections import defaultdict
 
 from arb_logger.logger import get_logger
 from redis_manager.redis_handler import RedisHandler
+from redis_manager.async_redis_handler import REDIS_ASYNC, AsyncRedisHandler
+from redis_manager.local_redis_handler import REDIS_LOCAL, LocalRedisHandler
+from redis_manager.gateway_redis_handler import GatewayRedisHandler, gateway_available
 from redis_manager.orders_manager import OrdersManager
-from redis_manager.redis_wrappers import ExchangeRedis, InstrumentRedis
-from arb_defines.arb_dataclasses import Balance, Exchange, ExchangeApiPayload, ExchangeStatus, FundingRate, InstrStatus, Instrument, Order, OrderBook, Position, Trade
-from redis_manager.redis_events import BalanceEvent, ExchangeApiEvent, ExchangeDrivenEvent, ExchangeStatusEvent, FundingRateEvent, InstrStatusEvent, InstrumentDrivenEvent, LiquidationEvent, OrderBookEvent, OrderEvent, OrderExchangeEvent, PositionEvent, RedisEvent, TradeEvent
+from redis_manager.redis_wrappers import ExchangeRedis, InstrumentRedis, refresh_objects
+from arb_defines.arb_dataclasses import Balance, Exchange, ExchangeApiPayload, ExchangeStatus, FundingRate, InstrStatus, Instrument, Order, OrderBook, OrderBookDelta, Position, Trade
+from redis_manager.redis_events import L2_DELTAS, L2_FULL_BOOKS, BalanceEvent, ExchangeApiEvent, ExchangeDrivenEvent, ExchangeStatusEvent, FundingRateEvent, InstrStatusEvent, InstrumentDrivenEvent, LiquidationEvent, OrderBookDeltaEvent, OrderBookEvent, OrderEvent, OrderExchangeEvent, PositionEvent, RedisEvent, TradeEvent
 
 
 @dataclass
 class RedisManager:
+    # (host, port, logger) -> handler of every manager when set, a backtest
+    # runs the managers of a process on its in-memory bus
+    handler_factory = None
+    # OrderBookEvent subscriptions get books rebuilt from OrderBookDeltaEvent,
+    # publishers only send full books with the l2 snapshots
+    books_from_deltas = L2_DELTAS and not L2_FULL_BOOKS
 
     def __init__(self,
                  instruments: list[Instrument] = None,
@@ -25,17 +34,40 @@ class RedisManager:
                  no_wrapper=False,
                  host='localhost',
                  port=6379,
-                 logger=None):
-        """Provide exchanges only if you dont provide instruments."""
+                 logger=None,
+                 async_handler=REDIS_ASYNC,
+                 local_handler=REDIS_LOCAL):
+        """
+        Provide exchanges only if you dont provide instruments.
+        async_handler: messages are read on an asyncio loop and handled by
+        worker threads, see AsyncRedisHandler.
+        local_handler: the managers of the process share an in-memory bus
+        instead of redis, payloads are passed by reference, see
+        LocalRedisHandler.
+        Otherwise market data is received from the gateway of the host when
+        it runs, see GatewayRedisHandler.
+        """
         self.logger: Logger = logger or get_logger(self.__class__.__name__)
 
         if instruments and exchanges:
             raise ValueError(
                 'You cant provide instruments or exchanges, not both.')
 
+        # OrderBookDeltaEvent callbacks by instr_id, None for every instrument
+        self._orderbook_delta_callbacks: dict[int, list[Callable]] = defaultdict(list)
+
         self._exchanges_list = exchanges
         self._instruments_list = instruments
-        self.redis_handler = RedisHandler(host, port, logger)
+        if self.handler_factory is not None:
+            self.redis_handler = self.handler_factory(host, port, logger)
+        elif local_handler:
+            self.redis_handler = LocalRedisHandler(host, port, logger)
+        elif async_handler:
+            self.redis_handler = AsyncRedisHandler(host, port, logger)
+        elif gateway_available():
+            self.redis_handler = GatewayRedisHandler(host, port, logger)
+        else:
+            self.redis_handler = RedisHandler(host, port, logger)
         self.publish_event = self.redis_handler.publish_event
 
         self.has_orders = has_orders
@@ -64,18 +96,29 @@ class RedisManager:
     def _load_objects_redis(self):
         if self._instruments_list:
             for instr in self._instruments_list:
-                exchange = ExchangeRedis.from_exchange(instr.exchange,
-                                                       self.redis_handler)
-                self.exchanges[instr.exchange.id] = exchange
+                if instr.exchange.id not in self.exchanges:
+                    exchange = ExchangeRedis.from_exchange(instr.exchange,
+                                                           self.redis_handler,
+                                                           refresh=False)
+                    self.exchanges[instr.exchange.id] = exchange
                 instrument = InstrumentRedis.from_instrument(
-                    instr, self.redis_handler)
+                    instr, self.redis_handler, refresh=False)
                 self.instruments[instr.id] = instrument
 
         if self._exchanges_list:
             for exchange in self._exchanges_list:
                 exchange = ExchangeRedis.from_exchange(exchange,
-                                                       self.redis_handler)
+                                                       self.redis_handler,
+                                                       refresh=False)
                 self.exchanges[exchange.id] = exchange
+        self.refresh_all()
+
+    def refresh_all(self):
+        """Reload every exchange and instrument with pipelined reads"""
+        refresh_objects(self.redis_instance, [
+            *self.exchanges.values(),
+            *self.instruments.values(),
+        ])
 
     def run_heartbeat_events(self):
         for th in self.hearthbeat_threads:
@@ -83,10 +126,7 @@ class RedisManager:
             th.start()
 
     def run(self):
-        for exchange in self.exchanges.values():
-            exchange.refresh_all()
-        for instrument in self.instruments.values():
-            instrument.refresh_all()
+        self.refresh_all()
         self.run_heartbeat_events()
         self.redis_handler.run()
 
@@ -119,22 +159,39 @@ class RedisManager:
     def subscribe_event(self,
                         redis_event: RedisEvent,
                         callbacks=None,
-                        deserialize=True):
+                        deserialize=True,
+                        conflate=False):
+        """
+        conflate: under backlog only the newest message of each channel is
+        handled, for latest value events (RedisEvent.conflatable) only
+        With books_from_deltas, OrderBookEvent subscriptions are served from
+        OrderBookDeltaEvent, without conflation.
+        """
         if not callbacks:
             callbacks = []
+        if self.books_from_deltas and isinstance(redis_event, OrderBookEvent):
+            # deltas can not be conflated, the book needs all of them
+            redis_event = OrderBookDeltaEvent(redis_event.objects)
+            conflate = False
         callbacks = self._wrap_callbacks(redis_event, callbacks)
-        self.redis_handler.subscribe_event(redis_event, callbacks, deserialize)
+        self.redis_handler.subscribe_event(redis_event, callbacks, deserialize,
+                                           conflate)
 
     def psubscribe_event(self,
                          redis_event: RedisEvent,
                          callbacks=None,
-                         deserialize=True):
+                         deserialize=True,
+                         conflate=False):
         if not callbacks:
             callbacks = []
+        if (self.books_from_deltas and not self.no_wrapper
+                and (redis_event is OrderBookEvent
+                     or isinstance(redis_event, OrderBookEvent))):
+            redis_event, conflate = OrderBookDeltaEvent(), False
         if not self.no_wrapper:
             callbacks = self._wrap_callbacks(redis_event, callbacks)
         self.redis_handler.psubscribe_event(redis_event, callbacks,
-                                            deserialize)
+                                            deserialize, conflate)
 
     def _wrap_heartbeat_callback(self, period, callback: Callable, is_pile=False, offset=0):
         start_time = (0 if is_pile else time.time()) + offset
@@ -171,9 +228,17 @@ class RedisManager:
         at the specified period
           is_pile: ("a lheure pile") if True, the callback will be called at start of period, otherwise it
         will be called every period starting the moment the thread is started
+
+        With an AsyncRedisHandler, or any handler scheduling heartbeats, no
+        thread is created, the callbacks are scheduled by the handler.
         """
         if not isinstance(callbacks, list):
             callbacks = [callbacks]
+        if hasattr(self.redis_handler, 'heartbeat_event'):
+            for callback in callbacks:
+                self.redis_handler.heartbeat_event(period, callback, is_pile,
+                                                   offset)
+            return
         for callback in callbacks:
             th = Thread(target=self._wrap_heartbeat_callback,
                         args=(period, callback, is_pile, offset),
@@ -187,6 +252,8 @@ class RedisManager:
         match redis_event.__class__.__qualname__:
             case OrderBookEvent.__qualname__:
                 return [self._on_orderbook_event_callback] + callbacks
+            case OrderBookDeltaEvent.__qualname__:
+                return self._add_orderbook_delta_callbacks(redis_event, callbacks)
             case OrderEvent.__qualname__ :
                 self.subscribe_event(ExchangeApiEvent(redis_event.objects), self._on_exchange_api_event_callback)
                 return [self._on_order_event_callback] + callbacks
@@ -246,6 +313,31 @@ class RedisManager:
         instrument = self.instruments.get(orderbook.instr_id)
         instrument.orderbook = orderbook
 
+    def _add_orderbook_delta_callbacks(self, redis_event: OrderBookDeltaEvent,
+                                       callbacks: list[Callable]):
+        """
+        Deltas are applied to the instrument book first, callbacks then get
+        the rebuilt OrderBook like OrderBookEvent callbacks
+        """
+        instr_ids = ([i.id for i in redis_event.objects]
+                     if redis_event.objects else [None])
+        for instr_id in instr_ids:
+            registered = self._orderbook_delta_callbacks[instr_id]
+            for callback in callbacks:
+                if (callback not in registered and
+                        callback != self._on_orderbook_delta_event_callback):
+                    registered.append(callback)
+        return [self._on_orderbook_delta_event_callback]
+
+    def _on_orderbook_delta_event_callback(self, delta: OrderBookDelta):
+        instrument = self.instruments.get(delta.instr_id)
+        orderbook = instrument.apply_orderbook_delta(delta)
+        if orderbook is None:
+            return
+        for instr_id in [delta.instr_id, None]:
+            for callback in self._orderbook_delta_callbacks.get(instr_id, []):
+                callback(orderbook)
+
     def _on_funding_rate_event_callback(self, funding_rate: FundingRate):
         instrument = self.instruments.get(funding_rate.instr_id)
         instrument.funding_rate = funding_rate
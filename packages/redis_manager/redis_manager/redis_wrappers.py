@@ -1,15 +1,22 @@
-from typing import Optional
+import time
+
+from typing import ClassVar, Optional
 from collections import defaultdict
-from dataclasses import asdict, dataclass, field
+from dataclasses import InitVar, asdict, dataclass, field
 
 from redis import Redis
 from cryptofeed.defines import FUNDING, PERPETUAL
 
 from arb_defines.defines import *
 from arb_defines.status import StatusEnum
-from redis_manager.redis_events import BalanceEvent, CandleEvent, ExchangeStatusEvent, FundingRateEvent, InstrStatusEvent, LiquidationEvent, OrderBookEvent, PositionEvent, RedisEvent, TradeEvent
-from arb_defines.arb_dataclasses import Balance, Candle, ConnectionStatus, Exchange, ExchangeStatus, FundingRate, InstrStatus, Instrument, OrderBook, Position, Trade
+from redis_manager.redis_events import L2_DELTAS, L2_FULL_BOOKS, L2_SNAPSHOT_SECONDS, L2_SNAPSHOT_UPDATES, BalanceEvent, CandleEvent, ExchangeStatusEvent, FundingRateEvent, InstrStatusEvent, LiquidationEvent, OrderBookDeltaEvent, OrderBookEvent, PositionEvent, RedisEvent, TradeEvent
+from arb_defines.arb_dataclasses import Balance, Candle, ConnectionStatus, Exchange, ExchangeStatus, FundingRate, InstrStatus, Instrument, OrderBook, OrderBookDelta, Position, Trade
 from redis_manager.redis_handler import RedisHandler
+from redis_manager.tob_store import TopOfBookStore, host_tob_store
+
+
+# hashes read per pipeline when hydrating many objects
+HYDRATION_BATCH = 1000
 
 
 @dataclass(kw_only=True)
@@ -21,6 +28,24 @@ class ObjectRedis:
         return self.redis_handler.redis_instance
 
 
+def hgetall_many(redis_instance: Redis, keys: list[str]) -> list[dict]:
+    """hgetall of every key, HYDRATION_BATCH keys per round trip"""
+    results = []
+    for k in range(0, len(keys), HYDRATION_BATCH):
+        pipeline = redis_instance.pipeline(transaction=False)
+        for key in keys[k:k + HYDRATION_BATCH]:
+            pipeline.hgetall(key)
+        results.extend(pipeline.execute())
+    return results
+
+
+def refresh_objects(redis_instance: Redis, objects: list['StatusRedis']):
+    """refresh_all of every object with pipelined reads"""
+    redis_dicts = hgetall_many(redis_instance, [o.redis_hash for o in objects])
+    for obj, redis_dict in zip(objects, redis_dicts):
+        obj.refresh_from(redis_dict)
+
+
 class StatusRedis(ObjectRedis):
     status_event: RedisEvent = None
 
@@ -97,21 +122,26 @@ class ExchangeRedis(Exchange, StatusRedis):
     status: Optional[ExchangeStatus] = None
     balances: dict[str, Balance] = field(default_factory=defaultdict)
     positions: dict[int, Position] = field(default_factory=defaultdict)
+    # False when hydrated later with refresh_objects
+    refresh: InitVar[bool] = True
 
     def __str__(self) -> str:
         return f'{self.feed_name} (current status: {self.status})'
 
-    def __post_init__(self):
+    def __post_init__(self, refresh: bool):
         self.status = ExchangeStatus(self.id)
-        self.refresh_all()
+        if refresh:
+            self.refresh_all()
 
     @property
     def redis_hash(self):
         return f'{EXCHANGE}:{self.id}'
 
     @staticmethod
-    def from_exchange(exchange: Exchange, redis_handler):
-        return ExchangeRedis(**asdict(exchange), redis_handler=redis_handler)
+    def from_exchange(exchange: Exchange, redis_handler, refresh=True):
+        return ExchangeRedis(**asdict(exchange),
+                             redis_handler=redis_handler,
+                             refresh=refresh)
 
     @staticmethod
     def balance_key(balance: Balance) -> str:
@@ -122,8 +152,9 @@ class ExchangeRedis(Exchange, StatusRedis):
         return f'{POSITION}:{position.instr_id}'
 
     def refresh_all(self):
-        redis_dict = self.redis_instance.hgetall(self.redis_hash)
+        self.refresh_from(self.redis_instance.hgetall(self.redis_hash))
 
+    def refresh_from(self, redis_dict: dict):
         self.balances = {
             b.currency: b
             for b in [
@@ -211,31 +242,49 @@ class InstrumentRedis(Instrument, StatusRedis):
     __hash__ = Instrument.__hash__
 
     status_event = InstrStatusEvent
+    publish_l2_deltas: ClassVar[bool] = L2_DELTAS
+    # with l2 deltas, every full book is also published, not only snapshots
+    publish_full_books: ClassVar[bool] = L2_FULL_BOOKS
+    # same host best bid/ask, written by set_orderbook, the ARB_TOB_SHM store
+    # attached on first use when not set
+    tob_store: ClassVar[Optional[TopOfBookStore]] = None
+    # instruments without a slot in tob_store, logged once
+    tob_missing: ClassVar[set[int]] = set()
 
     status: Optional[InstrStatus] = None
     timestamp: Optional[float] = None
     orderbook: Optional[OrderBook] = None
+    # l2 delta channel, last published seq or last applied seq when consuming
+    l2_seq: int = 0
+    l2_snapshot_seq: int = 0
+    l2_snapshot_time: float = 0
     funding_rate: Optional[FundingRate] = None
     position: Optional[Position] = None
     last_trade: Optional[Trade] = None
     last_candle: Optional[Candle] = None
+    # False when hydrated later with refresh_objects
+    refresh: InitVar[bool] = True
 
     @property
     def redis_hash(self):
         return f'{INSTRUMENT}:{self.id}'
 
-    def __post_init__(self):
+    def __post_init__(self, refresh: bool):
         super().__post_init__()
         self.status = InstrStatus(self.id)
-        self.refresh_all()
+        if refresh:
+            self.refresh_all()
 
     @staticmethod
-    def from_instrument(instrument: Instrument, redis_handler):
+    def from_instrument(instrument: Instrument, redis_handler, refresh=True):
         return InstrumentRedis(**asdict(instrument),
-                               redis_handler=redis_handler)
+                               redis_handler=redis_handler,
+                               refresh=refresh)
 
     def refresh_all(self):
-        redis_dict = self.redis_instance.hgetall(self.redis_hash)
+        self.refresh_from(self.redis_instance.hgetall(self.redis_hash))
+
+    def refresh_from(self, redis_dict: dict):
         po = redis_dict.get(POSITION)
         self.position = (PositionEvent.deserialize(po)
                          if po else Position(self.id))
@@ -256,22 +305,125 @@ class InstrumentRedis(Instrument, StatusRedis):
 
     def set_last_trade(self,
                        trade: Trade,
-                       event_type: TradeEvent | LiquidationEvent = TradeEvent):
+                       event_type: TradeEvent | LiquidationEvent = TradeEvent,
+                       receipt_time: float = None):
         self.last_trade = trade
-        self.redis_handler.publish_event(event_type, trade)
+        self.redis_handler.publish_event(event_type,
+                                         trade,
+                                         receipt_time=receipt_time)
 
     def set_last_candle(self, candle: Candle, event_type=CandleEvent):
         self.last_candle = candle
         self.redis_handler.publish_event(event_type, candle)
 
-    def set_orderbook(self, orderbook):
+    def set_orderbook(self, orderbook, receipt_time: float = None):
+        previous = self.orderbook
         self.orderbook = orderbook
         #* comment to reduce pressure on redis - need to think about this
         #* have to be able to ask a snapshot of the orderbook to the websocket?
         #* in case its needed when instantiating the instr from somewhere else
         # self.redis_instance.hset(self.redis_hash, ORDERBOOK,
         #                          OrderBookEvent.serialize(orderbook))
-        self.redis_handler.publish_event(OrderBookEvent, orderbook)
+        snapshot = False
+        if self.publish_l2_deltas:
+            snapshot = self._publish_orderbook_delta(previous, orderbook,
+                                                     receipt_time)
+        if not self.publish_l2_deltas or snapshot or self.publish_full_books:
+            self.redis_handler.publish_event(OrderBookEvent,
+                                             orderbook,
+                                             receipt_time=receipt_time)
+        # never in the way of redis
+        tob_store = self.tob_store or host_tob_store()
+        if tob_store is not None and self.id not in self.tob_missing:
+            try:
+                tob_store.write_orderbook(orderbook)
+            except IndexError as e:
+                self.tob_missing.add(self.id)
+                self.redis_handler.logger.error(
+                    f'{self} not in the top of book store: {e}')
+
+    def _publish_orderbook_delta(self,
+                                 previous: OrderBook,
+                                 orderbook: OrderBook,
+                                 receipt_time: float = None) -> bool:
+        """True if the delta is a snapshot"""
+        self.l2_seq += 1
+        now = time.time()
+        if (previous is None
+                or self.l2_seq - self.l2_snapshot_seq >= L2_SNAPSHOT_UPDATES
+                or now - self.l2_snapshot_time >= L2_SNAPSHOT_SECONDS):
+            delta = OrderBookDelta.from_snapshot(orderbook, self.l2_seq)
+            self.l2_snapshot_seq = self.l2_seq
+            self.l2_snapshot_time = now
+            # stored before publishing, consumers resync from it after a gap
+            self.redis_instance.hset(self.redis_hash, L2_SNAPSHOT,
+                                     OrderBookDeltaEvent.serialize(delta))
+        else:
+            delta = OrderBookDelta.from_orderbooks(previous, orderbook,
+                                                   self.l2_seq)
+        self.redis_handler.publish_event(OrderBookDeltaEvent,
+                                         delta,
+                                         receipt_time=receipt_time)
+        return delta.snapshot
+
+    def apply_orderbook_delta(self, delta: OrderBookDelta) -> OrderBook:
+        """
+        Update the local book from the l2 delta channel, returns the rebuilt
+        orderbook or None if the delta was not applied (stale or waiting for
+        a snapshot after a gap)
+        """
+        if delta.snapshot:
+            self._set_l2_snapshot(delta)
+            return self.orderbook
+
+        if self.l2_seq and delta.seq <= self.l2_seq:
+            return None
+
+        if not self.l2_seq or delta.seq != self.l2_seq + 1:
+            if not self._resync_orderbook(delta.seq):
+                return None
+            if delta.seq <= self.l2_seq:
+                # already in the stored snapshot
+                return self.orderbook
+
+        self.orderbook = delta.apply(self.orderbook)
+        self.l2_seq = delta.seq
+        return self.orderbook
+
+    def _set_l2_snapshot(self, snapshot: OrderBookDelta):
+        self.orderbook = snapshot.to_orderbook()
+        self.l2_seq = snapshot.seq
+
+    def _resync_orderbook(self, seq: int) -> bool:
+        data = self.redis_instance.hget(self.redis_hash, L2_SNAPSHOT)
+        snapshot = OrderBookDeltaEvent.deserialize(data) if data else None
+        if snapshot is None or snapshot.seq < seq - 1:
+            # deltas are missing, the book stays empty until next snapshot
+            if self.l2_seq:
+                self.redis_handler.logger.warning(
+                    f'{self} l2 gap after seq {self.l2_seq}, got {seq}, '
+                    'waiting for next snapshot')
+            self.orderbook = None
+            self.l2_seq = 0
+            return False
+        self._set_l2_snapshot(snapshot)
+        return True
+
+    @property
+    def top_of_book(self) -> Optional[OrderBook]:
+        """
+        Best bid/ask from the host shared memory store, without waiting for
+        the OrderBookEvent, falls back to the last received orderbook
+        """
+        tob_store = self.tob_store or host_tob_store()
+        if tob_store is not None and self.id not in self.tob_missing:
+            try:
+                orderbook = tob_store.read_orderbook(self.id)
+            except IndexError:
+                orderbook = None
+            if orderbook is not None:
+                return orderbook
+        return self.orderbook
 
     def get_orderbook(self):
         """
@@ -297,9 +449,13 @@ class InstrumentRedis(Instrument, StatusRedis):
         po = self.redis_instance.hget(self.redis_hash, POSITION)
         return PositionEvent.deserialize(po) if po else None
 
-    def set_funding_rate(self, funding_rate: FundingRate):
+    def set_funding_rate(self,
+                         funding_rate: FundingRate,
+                         receipt_time: float = None):
         self.funding_rate = funding_rate
-        self.redis_handler.publish_event(FundingRateEvent, funding_rate)
+        self.redis_handler.publish_event(FundingRateEvent,
+                                         funding_rate,
+                                         receipt_time=receipt_time)
         self.redis_instance.hset(self.redis_hash, FUNDING,
                                  FundingRateEvent.serialize(funding_rate))
 
@@ -0,0 +1,166 @@
+import os
+import math
+import time
+import struct
+
+from typing import Optional
+from functools import lru_cache
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+from arb_logger.logger import get_logger
+from arb_defines.arb_dataclasses import OrderBook
+
+LOGGER = get_logger('tob_store', short=True)
+
+# shared memory name of the host top of book store, empty to disable
+TOB_SHM_NAME = os.getenv('ARB_TOB_SHM', '')
+# slots in the store, instrument ids must be lower
+TOB_SLOTS = int(os.getenv('ARB_TOB_SLOTS', '65536'))
+
+TOB_MAGIC = b'ARBTOB'
+TOB_VERSION = 1
+# reads retried while a writer is updating the slot, then yielding the cpu
+# in case the writer was preempted in the middle of a write
+READ_SPINS = 100
+READ_RETRIES = 1000
+# seconds a process attaching waits for the creator to write the header
+OPEN_TIMEOUT = 1.0
+
+
+class TopOfBookStore:
+    """
+    Best bid/ask per instrument in shared memory, the slot of an instrument is
+    its instr_id.
+
+    Every slot is protected by a seqlock: the writer makes the sequence odd,
+    writes the values and makes it even again. Readers retry when the
+    sequence is odd or changed during their read, they never block the
+    writer. A slot has a single writer, the feed handler of its instrument.
+    """
+    HEADER = struct.Struct('<6sHI')
+    SEQ = struct.Struct('<Q')
+    # seq, bid, bid_qty, ask, ask_qty, timestamp
+    VALUES = struct.Struct('<Qddddd')
+    # padded to a cache line
+    SLOT_SIZE = 64
+
+    def __init__(self, shm: SharedMemory, slots: int):
+        self.shm = shm
+        self.slots = slots
+        self.buf = shm.buf
+
+    @classmethod
+    def open(cls, name: str = TOB_SHM_NAME, slots: int = TOB_SLOTS):
+        """Attach to the host store, created by the first process"""
+        try:
+            shm = SharedMemory(name,
+                               create=True,
+                               size=cls.HEADER.size + slots * cls.SLOT_SIZE)
+            cls.HEADER.pack_into(shm.buf, 0, TOB_MAGIC, TOB_VERSION, slots)
+            LOGGER.info(f'created top of book store {name} '
+                        f'with {slots} slots')
+        except FileExistsError:
+            shm, slots = cls._attach(name)
+        # the store outlives the processes using it, do not let the
+        # resource tracker unlink it when this one exits
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, slots)
+
+    @classmethod
+    def _attach(cls, name: str) -> tuple[SharedMemory, int]:
+        """
+        The store of another process, retried while its creator has not
+        sized it or written its header yet
+        """
+        deadline = time.monotonic() + OPEN_TIMEOUT
+        while True:
+            try:
+                shm = SharedMemory(name)
+            except ValueError:
+                # created, not sized yet
+                shm = None
+            else:
+                magic, version, slots = cls.HEADER.unpack_from(shm.buf, 0)
+                if magic == TOB_MAGIC and version == TOB_VERSION:
+                    return shm, slots
+                shm.close()
+                if magic != bytes(len(TOB_MAGIC)):
+                    raise ValueError(f'{name} is not a top of book store '
+                                     f'version {TOB_VERSION}')
+            if time.monotonic() > deadline:
+                raise ValueError(f'{name} still initialising after '
+                                 f'{OPEN_TIMEOUT}s')
+            time.sleep(0.01)
+
+    def _offset(self, instr_id: int) -> int:
+        if not 0 <= instr_id < self.slots:
+            raise IndexError(
+                f'instr_id {instr_id} out of the {self.slots} slots')
+        return self.HEADER.size + instr_id * self.SLOT_SIZE
+
+    def write(self, instr_id: int, bid: float, bid_qty: float, ask: float,
+              ask_qty: float, timestamp: float):
+        offset = self._offset(instr_id)
+        seq = self.SEQ.unpack_from(self.buf, offset)[0]
+        self.SEQ.pack_into(self.buf, offset, seq + 1)
+        self.VALUES.pack_into(self.buf, offset, seq + 1, bid, bid_qty, ask,
+                              ask_qty, timestamp)
+        self.SEQ.pack_into(self.buf, offset, seq + 2)
+
+    def read(self, instr_id: int) -> Optional[tuple[float, ...]]:
+        """(bid, bid_qty, ask, ask_qty, timestamp), None if never written"""
+        offset = self._offset(instr_id)
+        for retry in range(READ_RETRIES):
+            seq, *values = self.VALUES.unpack_from(self.buf, offset)
+            if seq & 1:
+                if retry >= READ_SPINS:
+                    time.sleep(0)
+                continue
+            if self.SEQ.unpack_from(self.buf, offset)[0] == seq:
+                return tuple(values) if seq else None
+        LOGGER.warning(f'instr {instr_id} top of book still being written '
+                       f'after {READ_RETRIES} reads')
+        return None
+
+    def write_orderbook(self, orderbook: OrderBook):
+        bid, bid_qty = orderbook.bid() if orderbook.bids else (math.nan, 0)
+        ask, ask_qty = orderbook.ask() if orderbook.asks else (math.nan, 0)
+        self.write(orderbook.instr_id, bid, bid_qty, ask, ask_qty,
+                   orderbook.timestamp or math.nan)
+
+    def read_orderbook(self, instr_id: int) -> Optional[OrderBook]:
+        """One level OrderBook, sides without price are empty"""
+        values = self.read(instr_id)
+        if values is None:
+            return None
+        bid, bid_qty, ask, ask_qty, timestamp = values
+        return OrderBook(instr_id=instr_id,
+                         bids=[] if math.isnan(bid) else [[bid, bid_qty]],
+                         asks=[] if math.isnan(ask) else [[ask, ask_qty]],
+                         timestamp=None if math.isnan(timestamp) else timestamp)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+
+    def unlink(self):
+        """Remove the store from the host, processes attached keep it"""
+        # unlink unregisters it from the resource tracker
+        resource_tracker.register(self.shm._name, 'shared_memory')
+        self.shm.unlink()
+
+
+@lru_cache(maxsize=None)
+def host_tob_store() -> Optional[TopOfBookStore]:
+    """
+    Store configured by ARB_TOB_SHM, attached once per process on the first
+    call, None when disabled or unavailable
+    """
+    if not TOB_SHM_NAME:
+        return None
+    try:
+        return TopOfBookStore.open(TOB_SHM_NAME, TOB_SLOTS)
+    except (OSError, ValueError) as e:
+        LOGGER.error(f'top of book store {TOB_SHM_NAME} unavailable: {e}')
+        return None
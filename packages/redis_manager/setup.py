@@ -8,4 +8,9 @@ setup(
     version='1.1.1',
     packages=find_packages(),
     install_requires=['arb_logger', 'arb_defines'],
+    entry_points={
+        'console_scripts': [
+            'md_gateway = redis_manager.md_gateway:main',
+        ]
+    },
 )
@@ -12,7 +12,7 @@ from playsound import playsound
 from arb_logger.logger import get_logger
 from db_handler.wrapper import DBWrapper
 from arb_defines.defines import ORDER_EXCHANGE, TRADE_EXEC
-from redis_manager.redis_events import OrderDBEvent, TradeExecEvent
+from redis_manager.redis_events import REDIS_ENCODING_ERRORS, OrderDBEvent, TradeExecEvent
 from arb_defines.arb_dataclasses import Instrument, Order, Trade
 
 LOGGER = get_logger('notif_server', short=True)
@@ -25,7 +25,7 @@ def notif_server(args):
 
     db_wrapper = DBWrapper(logger=LOGGER)
 
-    r = Redis(decode_responses=True)
+    r = Redis(decode_responses=True, encoding_errors=REDIS_ENCODING_ERRORS)
     p = r.pubsub()
 
     name = 'arb_notification_server'
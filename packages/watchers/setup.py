@@ -9,13 +9,14 @@ setup(
     packages=find_packages(),
     install_requires=[
         'arb_logger', 'arb_defines', 'db_handler', 'redis_manager',
-        'exchange_api', 'feed_handler', 'standalone_tools'
+        'exchange_api', 'feed_handler', 'standalone_tools', 'recorders'
     ],
     entry_points={
         'console_scripts': [
             # SCRIPTS
             'cancel_order = watchers.cancel_order:main',
             'single_order = watchers.single_order:main',
+            'backtest = watchers.backtest:main',
             # WATCHERS
             'tick_watcher = watchers.watchers.tick_watcher:main',
             'spread_watcher = watchers.watchers.spread_watcher:main',
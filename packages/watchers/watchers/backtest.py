@@ -0,0 +1,522 @@
+import sys
+import time
+import heapq
+import logging
+import importlib
+import traceback
+import simplejson as json
+
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from cryptofeed.defines import BUY, MARKET, OPEN, SELL
+
+from arb_logger.logger import get_logger
+from arb_defines.defines import CANCELED, CANCEL_REJECTED, REJECTED
+from arb_defines.status import StatusEnum
+from arb_utils.resolver import resolve_instruments
+from arb_utils.args_parser import instruments_args_parser
+from arb_defines.arb_dataclasses import Exchange, Instrument, Order, OrderBook, Position, Trade, TriggerPayload
+from exchange_api.base_api import ExchangeAPI
+from redis_manager.order_store import OrderStore
+from redis_manager.redis_manager import RedisManager
+from redis_manager.local_redis_handler import LocalBus, LocalRedisHandler
+from redis_manager.redis_events import CancelAllOrdersEvent, CancelAllOrdersExchangeEvent, CancelAllOrdersInstrEvent, CancelOrderEvent, OrderBookEvent, OrderEvent, OrderExchangeEvent, RedisEvent, TradeEvent, TradeExecEvent, TriggerEvent
+from recorders.replay import REPLAY_BATCH, REPLAY_TYPES, Replay
+from recorders.dataset_reader import to_timestamp
+
+LOGGER = get_logger('backtest', short=True)
+
+
+class SimClock:
+    """Replay time, returned by time.time and datetime.now while patched"""
+
+    def __init__(self, now: float):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def datetime(self) -> datetime:
+        return datetime.fromtimestamp(self.now, tz=timezone.utc)
+
+    @contextmanager
+    def patched(self):
+        """
+        time.time() is the replay time, and so is datetime.now() in the
+        modules loaded which imported datetime from datetime, e.g. the
+        default Order.time. Modules which imported time from time keep the
+        wall clock.
+        """
+        # this module is patched too
+        wall_datetime = datetime
+        modules = [
+            module for module in list(sys.modules.values())
+            if getattr(module, '__dict__', {}).get('datetime') is datetime
+        ]
+        wall_time = time.time
+        time.time = self.time
+        SimDatetime.clock = self
+        for module in modules:
+            module.datetime = SimDatetime
+        try:
+            yield
+        finally:
+            time.time = wall_time
+            SimDatetime.clock = None
+            for module in modules:
+                module.datetime = wall_datetime
+
+
+class _SimDatetimeType(type):
+
+    def __instancecheck__(cls, instance):
+        return isinstance(instance, cls.__base__)
+
+
+class SimDatetime(datetime, metaclass=_SimDatetimeType):
+    """
+    datetime of the modules patched by SimClock.patched, building plain
+    datetimes which are still its instances
+    """
+    clock: Optional[SimClock] = None
+
+    def __new__(cls, *args, **kwargs):
+        return super().__new__(cls.__base__, *args, **kwargs)
+
+    @classmethod
+    def now(cls, tz=None):
+        if cls.clock is None:
+            return super().now(tz)
+        return cls.fromtimestamp(cls.clock.now, tz)
+
+    @classmethod
+    def utcnow(cls):
+        if cls.clock is None:
+            return super().utcnow()
+        return cls.utcfromtimestamp(cls.clock.now)
+
+
+class BacktestBus(LocalBus):
+    """
+    LocalBus of every handler of a backtest, in one thread.
+
+    Publishes are queued and drain() dispatches them in publish order, a
+    callback publishing only adds to the queue, as a process would only see
+    the message on its next read. Heartbeats and scheduled publishes are
+    timers on the SimClock, run by advance() before the replay events of
+    later times.
+    """
+
+    def __init__(self, clock: SimClock):
+        super().__init__()
+        self.clock = clock
+        self.queue = deque()
+        # (due time, sequence, period, callback, start time), period None
+        # for a single call
+        self.timers = []
+        self._sequence = 0
+        self.published = 0
+
+    def handler(self, host='localhost', port=6379, logger=None):
+        """Handler factory of RedisManager"""
+        return BacktestHandler(self, logger)
+
+    @contextmanager
+    def installed(self):
+        """RedisManagers created meanwhile use the bus"""
+        RedisManager.handler_factory = self.handler
+        try:
+            yield
+        finally:
+            RedisManager.handler_factory = None
+
+    def publish(self, channel: str, payload):
+        self.published += 1
+        self.queue.append((channel, payload))
+
+    def drain(self):
+        while self.queue:
+            channel, payload = self.queue.popleft()
+            # LocalRedisHandler.handle without debug log nor profiler
+            for handler, event_handler in self.route(channel):
+                try:
+                    for callback in event_handler.callbacks:
+                        callback(payload)
+                except Exception:
+                    handler.logger.error(traceback.format_exc())
+
+    def _push_timer(self, due: float, period: Optional[float],
+                    callback: Callable, start_time: float):
+        self._sequence += 1
+        heapq.heappush(self.timers,
+                       (due, self._sequence, period, callback, start_time))
+
+    def heartbeat(self, period: float, callback: Callable, is_pile=False,
+                  offset=0):
+        """Same schedule as RedisManager._wrap_heartbeat_callback"""
+        now = self.clock.now
+        if is_pile:
+            start_time = offset
+            due = now + period - ((now - start_time) % period)
+        else:
+            start_time = now + offset
+            due = now
+        self._push_timer(due, period, callback, start_time)
+
+    def call_at(self, due: float, callback: Callable):
+        self._push_timer(due, None, callback, due)
+
+    def advance(self, timestamp: float):
+        """Runs the timers due up to timestamp, at their time"""
+        while self.timers and self.timers[0][0] <= timestamp:
+            due, _, period, callback, start_time = heapq.heappop(self.timers)
+            self.clock.now = max(self.clock.now, due)
+            try:
+                callback()
+            except Exception:
+                LOGGER.error(traceback.format_exc())
+            self.drain()
+            if period:
+                now = self.clock.now
+                self._push_timer(now + period - ((now - start_time) % period),
+                                 period, callback, start_time)
+        self.clock.now = max(self.clock.now, timestamp)
+
+
+class BacktestHandler(LocalRedisHandler):
+    """LocalRedisHandler driven by its BacktestBus instead of run()"""
+
+    def __init__(self, bus: BacktestBus, logger=None):
+        super().__init__(logger=logger, bus=bus, profile_callbacks=False)
+
+    def heartbeat_event(self, period: float, callback: Callable,
+                        is_pile=False, offset=0):
+        self.bus.heartbeat(period, callback, is_pile, offset)
+
+    def run(self):
+        raise RuntimeError('a backtest handler is driven by Backtest.run')
+
+
+class SimulatedExchange(ExchangeAPI):
+    """
+    ExchangeAPI of one exchange in a backtest, without ccxt nor db.
+
+    Market orders and limit orders crossing the book fill at once at the
+    best opposite price. Other limit orders are acked and rest until the
+    replayed book reaches their price or a trade prints through it, they
+    then fill at their price. Fills go through
+    _populate_order_fields_from_exchange_simulate and are published as the
+    private feed would: OrderEvent, PositionEvent then TradeExecEvent.
+    Orders fill completely, there is no queue position nor fee.
+    """
+
+    def __init__(self,
+                 exchange: Exchange,
+                 instruments: list[Instrument],
+                 clock: SimClock,
+                 log_level=logging.INFO):
+        self.logger = get_logger(f'{self.__class__.__name__}:{exchange}',
+                                 short=True,
+                                 level=log_level)
+        self._exchange = exchange
+        self._instruments = instruments
+        self.clock = clock
+        self.activate_trading = False
+        self.fetch_only = False
+        self.redis_manager: RedisManager = RedisManager(instruments,
+                                                        logger=self.logger)
+        # resting orders, as acked to the strategy
+        self.orders = OrderStore()
+        self.fills: list[Trade] = []
+
+        up = dict(api=StatusEnum.UP,
+                  trades=StatusEnum.UP,
+                  l2_book=StatusEnum.UP,
+                  private=StatusEnum.UP)
+        self.exchange.set_status(**up)
+        for instr in self.redis_manager.instruments.values():
+            instr.set_status(**up)
+
+    def subscribe_to_events(self):
+        instruments = list(self.redis_manager.instruments.values())
+        self.redis_manager.subscribe_event(OrderBookEvent(instruments),
+                                           self.on_orderbook_event)
+        self.redis_manager.subscribe_event(TradeEvent(instruments),
+                                           self.on_trade_event)
+        self.redis_manager.subscribe_event(OrderExchangeEvent(self._exchange),
+                                           self.on_order_exchange_event)
+        self.redis_manager.subscribe_event(CancelOrderEvent(self._exchange),
+                                           self.on_cancel_order_event)
+        self.redis_manager.subscribe_event(
+            CancelAllOrdersInstrEvent(self._exchange),
+            self.on_cancel_all_orders_instr_event)
+        self.redis_manager.subscribe_event(
+            CancelAllOrdersExchangeEvent(self._exchange),
+            self.on_cancel_all_orders_event)
+        self.redis_manager.subscribe_event(CancelAllOrdersEvent(),
+                                           self.on_cancel_all_orders_event)
+
+    def on_order_exchange_event(self, order: Order):
+        order.instr = self.redis_manager.get_instrument(order)
+        order.exchange_order_id = f'simulated:{order.id}'
+        self.logger.info(order)
+
+        price = self._crossing_price(order)
+        if price is not None:
+            self._fill(order, price)
+        elif order.order_type == MARKET or order.price is None:
+            order.order_status = REJECTED
+            order.time_rejected_mkt = self.clock.datetime()
+            self._publish_order(order)
+        else:
+            order.order_status = OPEN
+            order.time_ack_mkt = self.clock.datetime()
+            self.orders.add(order)
+            self._publish_order(order)
+
+    def on_cancel_order_event(self, order: Order):
+        resting = self.orders.remove(order.id)
+        if resting is None:
+            order.order_status = CANCEL_REJECTED
+            order.time_rejected_mkt = self.clock.datetime()
+        else:
+            order = resting
+            order.order_status = CANCELED
+            order.time_canceled_mkt = self.clock.datetime()
+        self._publish_order(order)
+
+    def on_cancel_all_orders_instr_event(self, payload: dict):
+        instr_id = payload['instr_id']
+        for order in list(self.orders.instr_orders(instr_id).values()):
+            self.on_cancel_order_event(order)
+
+    def on_cancel_all_orders_event(self, payload=None):
+        for order in list(self.orders.orders.values()):
+            self.on_cancel_order_event(order)
+
+    def on_orderbook_event(self, orderbook: OrderBook):
+        if not self.orders.instr_orders(orderbook.instr_id):
+            return
+        if orderbook.asks:
+            self._match(orderbook.instr_id, BUY, orderbook.ask()[0])
+        if orderbook.bids:
+            self._match(orderbook.instr_id, SELL, orderbook.bid()[0])
+
+    def on_trade_event(self, trade: Trade):
+        if not self.orders.instr_orders(trade.instr_id):
+            return
+        self._match(trade.instr_id, BUY, trade.price, through=True)
+        self._match(trade.instr_id, SELL, trade.price, through=True)
+
+    def _crossing_price(self, order: Order) -> Optional[float]:
+        """Best opposite price if the order takes liquidity at once"""
+        orderbook = order.instr.orderbook
+        levels = None
+        if orderbook is not None:
+            levels = orderbook.asks if order.side == BUY else orderbook.bids
+        if not levels:
+            return None
+        price = levels[0][0]
+        if order.order_type == MARKET or order.price is None:
+            return price
+        if (order.price >= price) if order.side == BUY else (order.price <=
+                                                              price):
+            return price
+        return None
+
+    def _match(self, instr_id: int, side: str, price: float, through=False):
+        """Fills the resting orders of a side reached by price"""
+        while True:
+            order = self.orders.nearest(instr_id, side)
+            if order is None:
+                return
+            if side == BUY:
+                crossed = order.price > price if through else order.price >= price
+            else:
+                crossed = order.price < price if through else order.price <= price
+            if not crossed:
+                return
+            self.orders.remove(order.id)
+            self._fill(order, order.price)
+
+    def _fill(self, order: Order, price: float):
+        order.order_status = OPEN
+        self._populate_order_fields_from_exchange_simulate(order)
+        order.time_filled_mkt = self.clock.datetime()
+        order.time_ack_mkt = order.time_ack_mkt or order.time_filled_mkt
+        trade = Trade(id=f'simulated:{order.id}:{len(self.fills)}',
+                      time=order.time_filled_mkt,
+                      qty=order.total_filled,
+                      price=price,
+                      order_type=order.order_type,
+                      exchange_order_id=order.exchange_order_id,
+                      instr=order.instr)
+        self.fills.append(trade)
+
+        self._publish_order(order)
+        instr = order.instr
+        position = instr.position or Position(instr_id=instr.id)
+        instr.set_position(position + Position.from_trade(trade))
+        self.redis_manager.publish_event(TradeExecEvent, trade)
+
+    def _publish_order(self, order: Order):
+        self.redis_manager.publish_event(OrderEvent, order)
+
+
+class Backtest:
+    """
+    Runs a strategy (WatcherBase subclass, TriggerBase or SeekerBase) on
+    replayed books, trades and funding rates, in one process.
+
+    The RedisManagers of the strategy and of a SimulatedExchange per
+    exchange share a BacktestBus instead of redis. The strategy is not
+    modified: its heartbeats are timers of the SimClock and time.time is the
+    replay time during the backtest. It logs locally at log_level. Each
+    replayed event is dispatched with every message it leads to before the
+    next one, strategy callbacks take no replay time.
+    """
+
+    def __init__(self,
+                 strategy_class,
+                 instruments: list[Instrument],
+                 start,
+                 end=None,
+                 recorder_types: list[str] = REPLAY_TYPES,
+                 log_level=logging.INFO,
+                 batch: int = REPLAY_BATCH):
+        self.clock = SimClock(to_timestamp(start))
+        self.bus = BacktestBus(self.clock)
+        self.replay = Replay(start,
+                             end, [i.id for i in instruments],
+                             recorder_types,
+                             batch=batch)
+        self.counts = defaultdict(int)
+
+        by_exchange = defaultdict(list)
+        for instr in instruments:
+            by_exchange[instr.exchange].append(instr)
+        with self.bus.installed(), self.clock.patched():
+            # exchanges first, the strategy loads their status
+            self.exchanges = {
+                exchange.id: SimulatedExchange(exchange, instrs, self.clock,
+                                               log_level)
+                for exchange, instrs in by_exchange.items()
+            }
+            for exchange in self.exchanges.values():
+                exchange.subscribe_to_events()
+            self.strategy = self.backtest_class(strategy_class,
+                                                log_level)(instruments)
+            self.strategy.subscribe_to_events()
+            self.strategy.redis_manager.refresh_all()
+            self.feed = self.bus.handler(logger=LOGGER)
+        self.bus.drain()
+
+    @staticmethod
+    def backtest_class(strategy_class, log_level):
+        """Same strategy, name and id, logging locally"""
+        return type(
+            strategy_class.__name__, (strategy_class, ), {
+                '__module__': strategy_class.__module__,
+                'log_level': log_level,
+                'log_redis_handler': False,
+            })
+
+    def schedule(self, redis_event: type[RedisEvent], payload, at=None):
+        """Publishes payload at a replay time, default the start"""
+        at = self.clock.now if at is None else to_timestamp(at)
+        self.bus.call_at(
+            at, lambda: self.feed.publish_event(redis_event, payload))
+
+    def trigger(self, action: str, config=None, at=None):
+        """TriggerEvent of a TriggerBase strategy, config as its client sends"""
+        self.schedule(
+            TriggerEvent,
+            TriggerPayload(trigger_id=self.strategy.id,
+                           action=action,
+                           config=config), at)
+
+    @property
+    def fills(self) -> list[Trade]:
+        return [t for e in self.exchanges.values() for t in e.fills]
+
+    def positions(self) -> dict[int, Position]:
+        return {
+            instr.id: instr.position
+            for exchange in self.exchanges.values()
+            for instr in exchange.redis_manager.instruments.values()
+        }
+
+    def run(self) -> int:
+        """Replays every event through the strategy, returns how many"""
+        wall_start = time.perf_counter()
+        with self.clock.patched():
+            for timestamp, redis_event, payload in self.replay.events():
+                self.bus.advance(timestamp)
+                self.counts[redis_event] += 1
+                self.feed.publish_event(redis_event, payload)
+                self.bus.drain()
+
+        seconds = time.perf_counter() - wall_start
+        total = sum(self.counts.values())
+        for redis_event, count in self.counts.items():
+            LOGGER.info(f'{redis_event.__name__}: {count}')
+        LOGGER.info(f'Backtested {self.strategy.id} on {total} events in '
+                    f'{seconds:.1f}s, {total / max(seconds, 1e-9):.0f} '
+                    f'events/s, {self.bus.published} messages, '
+                    f'{len(self.fills)} fills')
+        for instr_id, position in self.positions().items():
+            LOGGER.info(f'position {position}')
+        return total
+
+
+def import_strategy(path: str):
+    """Class from its dotted path, watchers.triggers.mm_grid.MMGrid"""
+    module, name = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module), name)
+
+
+def main():
+    parser = instruments_args_parser(
+        'Runs a strategy on recorded books, trades and funding rates')
+    parser.add_argument('strategy',
+                        help='dotted path, watchers.triggers.mm_grid.MMGrid')
+    parser.add_argument('--start',
+                        required=True,
+                        help='YYYYMMDD or ISO time, UTC')
+    parser.add_argument('--end', help='YYYYMMDD or ISO time, default now')
+    parser.add_argument('-r',
+                        '--records',
+                        nargs='+',
+                        choices=REPLAY_TYPES,
+                        default=REPLAY_TYPES)
+    parser.add_argument('--trigger',
+                        nargs='*',
+                        default=[],
+                        help='trigger actions sent at start, in order')
+    parser.add_argument('--config',
+                        help='json config sent with the trigger actions')
+    parser.add_argument('--log-level', default='INFO')
+    args = parser.parse_args()
+
+    instruments = resolve_instruments(args)
+    if args.instr_ids:
+        order = [int(i) for i in args.instr_ids]
+        instruments = sorted(instruments, key=lambda x: order.index(x.id))
+
+    backtest = Backtest(import_strategy(args.strategy),
+                        instruments,
+                        args.start,
+                        args.end,
+                        args.records,
+                        log_level=args.log_level)
+    config = json.loads(args.config) if args.config else None
+    for action in args.trigger:
+        backtest.trigger(action, config)
+    backtest.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import random
+import time
+
+from argparse import ArgumentParser
+
+from arb_logger.logger import get_logger
+from arb_defines.status import StatusEnum
+from arb_defines.arb_dataclasses import AggrBook, Exchange, Fee, IncrAggrBook, InstrStatus, Instrument, OrderBook
+
+LOGGER = get_logger('bench_aggrbook', short=True)
+
+
+def build_instruments(count: int, rng: random.Random) -> list[Instrument]:
+    instruments = []
+    for i in range(count):
+        exchange = Exchange(id=i, feed_name=f'EXCH{i}', exchange_name=f'exch{i}')
+        instr = Instrument(id=i + 1,
+                           exchange=exchange,
+                           instr_code=f'EXCH{i}_BTC_{"USDT" if i % 3 else "USD"}',
+                           base='BTC',
+                           quote='USDT' if i % 3 else 'USD',
+                           maker_fee=Fee(0, exchange, rng.choice([0, 2e-4])),
+                           taker_fee=Fee(0, exchange,
+                                         rng.choice([4e-4, 5e-4, 7e-4])))
+        # set by InstrumentRedis in watchers
+        instr.status = InstrStatus(instr.id, StatusEnum.UP)
+        instruments.append(instr)
+    return instruments
+
+
+def random_book(instr: Instrument, rng: random.Random, mid: float):
+    mid *= 1 + rng.gauss(0, 5e-4)
+    half_spread = mid * rng.uniform(1e-5, 1e-4)
+    return OrderBook(instr_id=instr.id,
+                     bids=[[mid - half_spread, rng.uniform(0.1, 2)]],
+                     asks=[[mid + half_spread, rng.uniform(0.1, 2)]],
+                     timestamp=time.time())
+
+
+def build_updates(instruments: list[Instrument], number: int, seed: int):
+    rng = random.Random(seed)
+    initial = [(instr, random_book(instr, rng, 30000))
+               for instr in instruments]
+    updates = [(instr, random_book(instr, rng, 30000))
+               for instr in rng.choices(instruments, k=number)]
+    return initial, updates
+
+
+def query(aggrbook: AggrBook, excl: list[Instrument]):
+    return [
+        aggrbook.hit_hit_spread(excl_buys=excl[:1], excl_sells=excl[1:]),
+        aggrbook.taker_buy(excl_instrs=excl[:1]),
+        aggrbook.taker_sell(excl_instrs=excl[1:]),
+        aggrbook.maker_buy(excl_instrs=excl[:1]),
+        aggrbook.maker_sell(excl_instrs=excl[1:]),
+    ]
+
+
+def results(aggrbook_class, currencies, initial, updates, excl):
+    aggrbook = aggrbook_class(currencies=currencies)
+    for instr, orderbook in initial:
+        aggrbook.update_aggrbook(instr, orderbook)
+    res = []
+    for instr, orderbook in updates:
+        aggrbook.update_aggrbook(instr, orderbook)
+        res.append(query(aggrbook, excl))
+    return res
+
+
+def bench(aggrbook_class, currencies, initial, updates, excl) -> float:
+    aggrbook = aggrbook_class(currencies=currencies)
+    for instr, orderbook in initial:
+        aggrbook.update_aggrbook(instr, orderbook)
+    start = time.perf_counter()
+    for instr, orderbook in updates:
+        aggrbook.update_aggrbook(instr, orderbook)
+        aggrbook.hit_hit_spread(excl_buys=excl[:1], excl_sells=excl[1:])
+    return (time.perf_counter() - start) / len(updates) * 1e6
+
+
+def main():
+    parser = ArgumentParser(
+        description='Benchmark AggrBook against IncrAggrBook')
+    parser.add_argument('-n', '--number', type=int, default=5000)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # quote currency, USDT instruments are converted through its mid
+    usdt = Instrument(id=0, base='USDT', quote='USD')
+    usdt.orderbook = OrderBook(instr_id=usdt.id,
+                               bids=[[0.9995, 1e6]],
+                               asks=[[1.0005, 1e6]])
+    currencies = [usdt]
+
+    LOGGER.info(f'{"instruments":>12}{"AggrBook us":>14}'
+                f'{"IncrAggrBook us":>18}{"speedup":>10}')
+    for size in args.sizes:
+        instruments = build_instruments(size, random.Random(args.seed))
+        initial, updates = build_updates(instruments, args.number, args.seed)
+        excl = instruments[:2]
+
+        expected = results(AggrBook, currencies, initial, updates, excl)
+        result = results(IncrAggrBook, currencies, initial, updates,
+                         excl)
+        if expected != result:
+            LOGGER.error(f'{size} instruments: IncrAggrBook differs')
+
+        full = bench(AggrBook, currencies, initial, updates, excl)
+        incr = bench(IncrAggrBook, currencies, initial, updates, excl)
+        LOGGER.info(f'{size:>12}{full:>14.2f}{incr:>18.2f}'
+                    f'{full / incr:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
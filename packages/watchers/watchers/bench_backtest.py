@@ -0,0 +1,95 @@
+import os
+import time
+import random
+import shutil
+import tempfile
+
+from pathlib import Path
+from argparse import ArgumentParser
+from datetime import datetime, timedelta, timezone
+
+from cryptofeed.defines import PERPETUAL
+
+from arb_logger.logger import get_logger
+from arb_defines.arb_dataclasses import Exchange, Instrument
+from recorders.bench_replay import write_records
+from watchers.backtest import Backtest
+from watchers.triggers.mm_dumb import MMDumb, MMDumbConfig
+from watchers.triggers.mm_grid import MMGrid, MMGridConfig
+
+LOGGER = get_logger('bench_backtest', short=True)
+
+DAY = 86400
+
+
+def build_instrument() -> Instrument:
+    exchange = Exchange(id=1,
+                        feed_name='BINANCE_FUTURES',
+                        exchange_name='binance')
+    return Instrument(id=1,
+                      exchange=exchange,
+                      instr_code='BINANCE_FUTURES_BTC_USDT_PERP',
+                      symbol='BTC-USDT-PERP',
+                      base='BTC',
+                      quote='USDT',
+                      instr_type=PERPETUAL,
+                      contract_type='linear',
+                      tick_size=0.5,
+                      min_order_size=0.001,
+                      min_size_incr=0.001,
+                      contract_size=1,
+                      lot_size=1,
+                      exchange_code='BTCUSDT',
+                      feed_code='BTC-USDT-PERP')
+
+
+def run(strategy_class, config, instr: Instrument, day: datetime,
+        log_level) -> Backtest:
+    backtest = Backtest(strategy_class, [instr],
+                        day,
+                        day + timedelta(days=1),
+                        log_level=log_level)
+    backtest.trigger('start', config)
+    start = time.perf_counter()
+    events = backtest.run()
+    seconds = time.perf_counter() - start
+    LOGGER.info(f'{strategy_class.__name__:<8}{events:>10}{seconds:>10.1f}'
+                f'{events / seconds:>12.0f}{len(backtest.fills):>8}')
+    return backtest
+
+
+def main():
+    parser = ArgumentParser(
+        description='Events per second of grid strategies backtested over a '
+        'day of generated books, trades and funding rates of an instrument')
+    parser.add_argument('--books', type=int, default=200000)
+    parser.add_argument('--trades', type=int, default=100000)
+    parser.add_argument('--log-level',
+                        default='ERROR',
+                        help='of the strategies and simulated exchange')
+    args = parser.parse_args()
+
+    base = Path(tempfile.mkdtemp())
+    os.environ['ARB_RECORDS_PATH'] = str(base)
+    random.seed(0)
+    day = (datetime.now(tz=timezone.utc) - timedelta(days=1)).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+    instr = build_instrument()
+    try:
+        write_records(day, instr.id, args.books, args.trades, DAY, 10000.)
+
+        LOGGER.info(f'{"strategy":<8}{"events":>10}{"seconds":>10}'
+                    f'{"events/s":>12}{"fills":>8}')
+        # sends no order as long as update_state returns first
+        run(MMGrid, MMGridConfig(instr=instr), instr, day, args.log_level)
+        # a buy and a sell around the book every 30s of replay time
+        backtest = run(MMDumb,
+                       MMDumbConfig(instr=instr, spread=0.0002),
+                       instr, day, args.log_level)
+        LOGGER.info(f'MMDumb position {backtest.positions()[instr.id]}')
+    finally:
+        shutil.rmtree(base)
+
+
+if __name__ == '__main__':
+    main()
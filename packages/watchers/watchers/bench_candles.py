@@ -0,0 +1,113 @@
+import time
+import shutil
+import tempfile
+
+from argparse import ArgumentParser
+
+import numpy as np
+
+from arb_logger.logger import get_logger
+from arb_defines.arb_dataclasses import Candle, Trade
+from watchers.candle_store import CandleStore
+from watchers.candle_aggregator import CANDLE_TIMEFRAMES, CandleAggregator
+
+LOGGER = get_logger('bench_candles', short=True)
+
+
+def sample_trades(number: int, seconds: int) -> list[Trade]:
+    """Random walk trades spread over seconds"""
+    rng = np.random.default_rng(0)
+    times = np.sort(rng.uniform(0, seconds, number)) + 1.7e9
+    prices = 30000 + np.cumsum(rng.normal(0, 0.5, number))
+    qtys = rng.normal(0, 0.1, number)
+    return [
+        Trade(time=t, qty=q, price=p, instr_id=1, exchange_id=1)
+        for t, p, q in zip(times.tolist(), prices.tolist(), qtys.tolist())
+    ]
+
+
+def bench_ltps(trades: list[Trade]) -> tuple[float, int]:
+    """trades/s and bars of a ltps list per timeframe, closed on trades"""
+    ltps = {timeframe: [] for timeframe in CANDLE_TIMEFRAMES}
+    ends = {timeframe: None for timeframe in CANDLE_TIMEFRAMES}
+    bars = 0
+    start = time.perf_counter()
+    for trade in trades:
+        timestamp = trade.time.timestamp()
+        for timeframe, values in ltps.items():
+            if ends[timeframe] is not None and timestamp >= ends[timeframe]:
+                Candle.from_ltps(values)
+                values.clear()
+                bars += 1
+            if not values:
+                ends[timeframe] = timestamp - timestamp % timeframe + timeframe
+            values.append((trade.time, trade.price, trade.qty))
+    return len(trades) / (time.perf_counter() - start), bars
+
+
+def bench_aggregator(trades: list[Trade],
+                     store_path: str = None) -> tuple[float, int]:
+    """trades/s and bars closed, stored if store_path"""
+    stores = {
+        timeframe: CandleStore(1, timeframe, store_path)
+        for timeframe in CANDLE_TIMEFRAMES
+    } if store_path else {}
+    bars = [0]
+
+    def on_close(timeframe: int, candle: Candle):
+        bars[0] += 1
+        if stores:
+            stores[timeframe].append(candle)
+
+    aggregator = CandleAggregator(1, 1, on_close=on_close)
+    start = time.perf_counter()
+    for trade in trades:
+        aggregator.add_trade(trade)
+    rate = len(trades) / (time.perf_counter() - start)
+    for store in stores.values():
+        store.close()
+    return rate, bars[0]
+
+
+def bench_read(store_path: str, timeframe: int, repeat=20) -> tuple[float, int]:
+    """candles/s read back from the store"""
+    store = CandleStore(1, timeframe, store_path)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        candles = store.candles()
+    rate = len(candles) * repeat / (time.perf_counter() - start)
+    store.close()
+    return rate, len(candles)
+
+
+def main():
+    parser = ArgumentParser(
+        description='Trades aggregated into bars of every timeframe at once, '
+        'against a ltps list per timeframe, and the local candle store')
+    parser.add_argument('-n', '--number', type=int, default=1000000)
+    parser.add_argument('--seconds',
+                        type=int,
+                        default=6 * 3600,
+                        help='seconds the trades are spread over')
+    args = parser.parse_args()
+
+    trades = sample_trades(args.number, args.seconds)
+    store_path = tempfile.mkdtemp()
+    try:
+        LOGGER.info(f'{"":<24}{"trades/s":>12}{"bars":>10}')
+        for name, (rate, bars) in [
+            ('ltps lists', bench_ltps(trades)),
+            ('aggregator', bench_aggregator(trades)),
+            ('aggregator and store', bench_aggregator(trades, store_path)),
+        ]:
+            LOGGER.info(f'{name:<24}{rate:>12.0f}{bars:>10}')
+        for timeframe in CANDLE_TIMEFRAMES:
+            rate, candles = bench_read(store_path, timeframe)
+            LOGGER.info(f'{f"read {timeframe}s candles":<24}{rate:>12.0f}'
+                        f'{candles:>10}')
+    finally:
+        shutil.rmtree(store_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import os
+
+from datetime import datetime
+from typing import Callable, Optional
+
+from arb_logger.logger import get_logger
+from arb_defines.arb_dataclasses import Candle, Trade
+
+LOGGER = get_logger('candle_aggregator', short=True)
+
+# timeframes built at once, in seconds
+CANDLE_TIMEFRAMES = [1, 60, 300, 3600]
+# seconds after its end a bar is closed by the clock, exchange timestamps
+# lag behind
+CANDLE_CLOSE_DELAY = float(os.getenv('ARB_CANDLE_CLOSE_DELAY', '0.25'))
+# flat bars closed at most for a gap without trades, per timeframe
+MAX_GAP_BARS = 3600
+
+
+class _Bar:
+    """Open bar of a timeframe"""
+
+    __slots__ = ('timeframe', 'start', 'end', 'open', 'high', 'low', 'close',
+                 'volume', 'trades', 'partial')
+
+    def __init__(self, timeframe: int):
+        self.timeframe = timeframe
+        self.start = None
+        self.end = None
+        self.close = None
+
+    def reset(self, start: float, close: Optional[float], partial=False):
+        """Flat at close until its first trade"""
+        self.start, self.end = start, start + self.timeframe
+        self.open = self.high = self.low = self.close = close
+        self.volume, self.trades = 0.0, 0
+        self.partial = partial
+
+    def candle(self, instr_id: int, exchange_id: Optional[int]) -> Candle:
+        return Candle(time=self.start,
+                      close=self.close,
+                      open=self.open,
+                      high=self.high,
+                      low=self.low,
+                      volume=self.volume,
+                      trades=self.trades,
+                      instr_id=instr_id,
+                      exchange_id=exchange_id,
+                      end_time=self.end)
+
+
+class CandleAggregator:
+    """
+    OHLCV bars of an instrument over several timeframes at once, built from
+    its trades.
+
+    A trade updates the open bar of every timeframe in O(1). A bar closes on
+    the first trade of a later period, or on advance() once it ended
+    close_delay seconds ago; periods without trades close as flat bars at
+    the last close, with no volume. Trades timestamped before the open bar
+    are counted in it. Closed bars go to on_close(timeframe, candle).
+
+    The first bar of a timeframe is partial, and dropped when it closes,
+    if it started before since: trades before since were not seen, e.g.
+    after a restart. Without since every first bar is partial.
+    """
+
+    def __init__(self,
+                 instr_id: int,
+                 exchange_id: Optional[int] = None,
+                 on_close: Optional[Callable[[int, Candle], None]] = None,
+                 timeframes: list[int] = CANDLE_TIMEFRAMES,
+                 close_delay: float = CANDLE_CLOSE_DELAY,
+                 since: Optional[float] = None):
+        self.instr_id = instr_id
+        self.exchange_id = exchange_id
+        self.on_close = on_close
+        self.close_delay = close_delay
+        self.since = since
+        self.bars = [_Bar(timeframe) for timeframe in timeframes]
+
+    def add_trade(self, trade: Trade):
+        timestamp = trade.time
+        if isinstance(timestamp, datetime):
+            timestamp = timestamp.timestamp()
+        self.add(timestamp, trade.price, abs(trade.qty),
+                 trade.trade_count or 1)
+
+    def add(self, timestamp: float, price: float, volume: float, trades=1):
+        for bar in self.bars:
+            if bar.start is None or timestamp >= bar.end:
+                self._roll(bar, timestamp)
+            if bar.trades:
+                if price > bar.high:
+                    bar.high = price
+                elif price < bar.low:
+                    bar.low = price
+            else:
+                bar.open = bar.high = bar.low = price
+            bar.close = price
+            bar.volume += volume
+            bar.trades += trades
+
+    def advance(self, timestamp: float):
+        """Closes the bars ended close_delay seconds before timestamp"""
+        timestamp -= self.close_delay
+        for bar in self.bars:
+            if bar.start is not None and timestamp >= bar.end:
+                self._roll(bar, timestamp)
+
+    def _roll(self, bar: _Bar, timestamp: float):
+        """Closes bar and the flat ones up to the period of timestamp"""
+        start = timestamp - timestamp % bar.timeframe
+        if bar.start is not None:
+            self._close(bar)
+            gap = int((start - bar.end) // bar.timeframe)
+            if gap > MAX_GAP_BARS:
+                LOGGER.warning(f'{self.instr_id} no trade for {gap} bars of '
+                               f'{bar.timeframe}s, closing the last '
+                               f'{MAX_GAP_BARS}')
+                bar.reset(start - MAX_GAP_BARS * bar.timeframe, bar.close)
+            else:
+                bar.reset(bar.end, bar.close)
+            while bar.start < start:
+                self._close(bar)
+                bar.reset(bar.end, bar.close)
+            bar.reset(start, bar.close)
+        else:
+            bar.reset(start, None, self.since is None or start < self.since)
+
+    def _close(self, bar: _Bar):
+        if bar.partial:
+            LOGGER.info(f'{self.instr_id} dropping the partial first bar of '
+                        f'{bar.timeframe}s')
+            return
+        if self.on_close is not None and bar.close is not None:
+            self.on_close(bar.timeframe,
+                          bar.candle(self.instr_id, self.exchange_id))
@@ -0,0 +1,130 @@
+import os
+
+from pathlib import Path
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from arb_logger.logger import get_logger
+from arb_defines.arb_dataclasses import Candle
+
+LOGGER = get_logger('candle_store', short=True)
+
+# directory of the local candle store, default $ARB_RECORDS_PATH/candles
+CANDLES_PATH = os.getenv('ARB_CANDLES_PATH')
+
+CANDLE_RECORD = np.dtype([
+    ('time', '<f8'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('volume', '<f8'),
+    ('trades', '<i8'),
+])
+
+
+class CandleStore:
+    """
+    Closed candles of an instrument and timeframe, in a local file of fixed
+    size records sorted by time: {path}/{instr_id}_{timeframe}.candles.
+
+    A candle is one unbuffered append, a record torn by a crash is dropped
+    when the store is opened. Reads are memory mapped and find their first
+    candle by binary search.
+    """
+
+    def __init__(self,
+                 instr_id: int,
+                 timeframe: int,
+                 path: Optional[str] = None,
+                 exchange_id: Optional[int] = None):
+        path = path or CANDLES_PATH
+        if path is None:
+            records_path = os.getenv('ARB_RECORDS_PATH')
+            if records_path is None:
+                raise ValueError(
+                    'neither ARB_CANDLES_PATH nor ARB_RECORDS_PATH is set')
+            path = os.path.join(records_path, 'candles')
+        self.instr_id = instr_id
+        self.timeframe = timeframe
+        self.exchange_id = exchange_id
+        self.path = Path(path) / f'{instr_id}_{timeframe}.candles'
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        size = self.path.stat().st_size if self.path.exists() else 0
+        if size % CANDLE_RECORD.itemsize:
+            LOGGER.warning(f'{self.path} ends with a torn candle, dropped')
+            os.truncate(self.path, size - size % CANDLE_RECORD.itemsize)
+        self.last_time = None
+        if size >= CANDLE_RECORD.itemsize:
+            self.last_time = float(self._records()[-1]['time'])
+        self._file = open(self.path, 'ab', buffering=0)
+
+    def __len__(self) -> int:
+        return self.path.stat().st_size // CANDLE_RECORD.itemsize
+
+    def append(self, candle: Candle) -> bool:
+        """False if not after the last candle stored"""
+        timestamp = candle.time.timestamp()
+        if self.last_time is not None and timestamp <= self.last_time:
+            return False
+        record = np.array([(timestamp, candle.open, candle.high, candle.low,
+                            candle.close, candle.volume or 0,
+                            candle.trades or 0)],
+                          dtype=CANDLE_RECORD)
+        self._file.write(record.tobytes())
+        self.last_time = timestamp
+        return True
+
+    def _records(self) -> np.ndarray:
+        if not self.path.exists() or len(self) == 0:
+            return np.empty(0, dtype=CANDLE_RECORD)
+        return np.memmap(self.path,
+                         dtype=CANDLE_RECORD,
+                         mode='r',
+                         shape=(len(self), ))
+
+    def read(self,
+             since: Optional[datetime | float] = None,
+             limit: Optional[int] = None) -> np.ndarray:
+        """Records from since, the last limit ones"""
+        records = self._records()
+        if since is not None:
+            if isinstance(since, datetime):
+                since = since.timestamp()
+            records = records[np.searchsorted(records['time'], since):]
+        if limit is not None:
+            records = records[-limit:] if limit else records[:0]
+        return np.array(records)
+
+    def candles(self,
+                since: Optional[datetime | float] = None,
+                limit: Optional[int] = None) -> list[Candle]:
+        return [
+            Candle(time=time,
+                   open=open_,
+                   high=high,
+                   low=low,
+                   close=close,
+                   volume=volume,
+                   trades=trades,
+                   instr_id=self.instr_id,
+                   exchange_id=self.exchange_id,
+                   end_time=time + self.timeframe)
+            for time, open_, high, low, close, volume, trades in self.read(
+                since, limit).tolist()
+        ]
+
+    def frame(self,
+              since: Optional[datetime | float] = None,
+              limit: Optional[int] = None) -> pd.DataFrame:
+        """open, high, low, close, volume, trades by UTC time"""
+        df = pd.DataFrame(self.read(since, limit))
+        df.index = pd.to_datetime(df.pop('time'), unit='s', utc=True)
+        return df
+
+    def close(self):
+        self._file.close()
@@ -1,20 +1,24 @@
-import math
+import time
+import threading
 
 from datetime import datetime, timedelta, timezone
 
-import pandas as pd
-
-from arb_utils import arb_round
 from arb_logger.logger import get_logger
-from redis_manager.redis_events import TradeEvent
-from data_manager.candle_manager import CandleManager
+from redis_manager.redis_events import CandleBarEvent, TradeEvent
 from arb_defines.arb_dataclasses import Candle, Instrument, Trade
+from watchers.candle_store import CandleStore
+from watchers.candle_aggregator import CANDLE_TIMEFRAMES, CandleAggregator
 from watchers.sentinel_base import SentinelBase, SentinelClientBase, sentinel_main
 
 LOGGER = get_logger('candle_sentinel', short=True)
 
 
 class CandleSentinel(SentinelBase):
+    """
+    Builds the CANDLE_TIMEFRAMES bars of its instrument from its trades,
+    publishes them as CandleBarEvent when they close and keeps them in a local
+    CandleStore. Its values are the bars of tf.
+    """
     sentinel_name = 'candle'
     max_nb_candles = 10000
 
@@ -27,7 +31,17 @@ class CandleSentinel(SentinelBase):
         super().__init__(instruments)
 
         self.tf = 60
-        self.ltps = []
+        self.stores = {
+            timeframe: CandleStore(self.instr.id,
+                                   timeframe,
+                                   exchange_id=self.instr.exchange.id)
+            for timeframe in CANDLE_TIMEFRAMES
+        }
+        self.aggregator = CandleAggregator(self.instr.id,
+                                           self.instr.exchange.id,
+                                           on_close=self.on_candle_close)
+        # trades and the heartbeat closing bars run in different threads
+        self.lock = threading.Lock()
 
         self.load_candles()
 
@@ -35,17 +49,16 @@ class CandleSentinel(SentinelBase):
         self.logger.info(f'Loading candles for {self.instr}')
 
         since = datetime.now(tz=timezone.utc) - timedelta(days=2)
-        df: pd.DataFrame = CandleManager(self.instr).get_candles(since)
-
-        self.values: list[Candle] = [
-            Candle(*c) for c in df.reset_index().values.tolist()
-        ]
+        self.values: list[Candle] = self.stores[self.tf].candles(
+            since, self.max_nb_candles)
 
         self.logger.info(f'Loaded {len(self.values)} candles')
         self.send_snapshot()
 
     def subscribe_to_events(self):
-        self.redis_manager.heartbeat_event(self.tf,
+        # bars started before are partial
+        self.aggregator.since = time.time()
+        self.redis_manager.heartbeat_event(min(CANDLE_TIMEFRAMES),
                                            self.update_candles,
                                            is_pile=True)
         self.redis_manager.subscribe_event(TradeEvent(self.instruments),
@@ -53,29 +66,20 @@ class CandleSentinel(SentinelBase):
         super().subscribe_to_events()
 
     def on_trade_event(self, trade: Trade):
-        self.ltps.append((trade.time, trade.price, trade.qty))
+        with self.lock:
+            self.aggregator.add_trade(trade)
 
     def send_last_candle(self):
         self.send_update({'values': [self.values[-1]]})
 
     def update_candles(self):
-        self.logger.info(f'Updating candle for {self.instr.id}')
-        candle = Candle.from_ltps(self.ltps)
-        self.ltps = []
-        if candle:
-            # round timestamp to start timestamp of candle period <-- not very clear but iykyk
-            candle.time = datetime.fromtimestamp(arb_round(
-                candle.time.timestamp(), self.tf, math.floor),
-                                                 tz=timezone.utc)
-        elif self.values:
-            self.logger.info(
-                f'No candle for {self.instr.id}, BUILD FROM LAST ONE')
-            last_candle: Candle = self.values[-1]
-            candle = Candle(last_candle.time + timedelta(seconds=self.tf),
-                            last_candle.close, last_candle.close,
-                            last_candle.close, last_candle.close, 0)
-
-        if candle:
+        with self.lock:
+            self.aggregator.advance(time.time())
+
+    def on_candle_close(self, timeframe: int, candle: Candle):
+        self.stores[timeframe].append(candle)
+        self.redis_manager.publish_event(CandleBarEvent, candle)
+        if timeframe == self.tf:
             self.values.append(candle)
             self.values = self.values[-self.max_nb_candles:]
             self.send_last_candle()
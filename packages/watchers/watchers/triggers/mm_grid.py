@@ -10,6 +10,7 @@ from ta.volatility import AverageTrueRange
 
 from arb_defines.event_types import EventTypes
 from arb_utils.resolver import resolve_instruments
+from redis_manager.order_store import OrderStore
 from redis_manager.redis_wrappers import InstrumentRedis
 from arb_utils.args_parser import instruments_args_parser
 from watchers.sentinels.atr_sentinel import AtrSentinel
@@ -73,28 +74,32 @@ class MMGrid(TriggerBase):
         return self.config.volat_len if self.config and self.config.volat_len else 10
 
     @property
-    def buy_orders(self):
-        return sorted([
-            o for o in self.redis_manager.orders_manager.orders.values()
-            if o.side == BUY
-        ],
-                      key=lambda o: o.price,
-                      reverse=True)
+    def order_store(self) -> OrderStore:
+        return self.redis_manager.orders_manager.store
 
     @property
-    def sell_orders(self):
-        return sorted([
-            o for o in self.redis_manager.orders_manager.orders.values()
-            if o.side == SELL
-        ],
-                      key=lambda o: o.price)
+    def buy_orders(self) -> list[Order]:
+        """Highest price first"""
+        return self.order_store.side_orders(self.instr.id, BUY)
+
+    @property
+    def sell_orders(self) -> list[Order]:
+        """Lowest price first"""
+        return self.order_store.side_orders(self.instr.id, SELL)
+
+    def _edge_prices(self, side) -> tuple[float, float]:
+        nearest = self.order_store.nearest(self.instr.id, side)
+        farthest = self.order_store.farthest(self.instr.id, side)
+        return (nearest.price if nearest else None,
+                farthest.price if farthest else None)
 
     def subscribe_to_events(self):
         super().subscribe_to_events()
         self.redis_manager.heartbeat_event(60, self.update_state, is_pile=True)
         self.redis_manager.subscribe_event(TradeEvent(self.instruments),
                                            self.on_trade_event)
-        self.redis_manager.subscribe_event(OrderBookEvent(self.instruments))
+        self.redis_manager.subscribe_event(OrderBookEvent(self.instruments),
+                                           conflate=True)
         self.redis_manager.subscribe_event(TradeExecEvent(self.instruments),
                                            self.on_trade_exec_event)
         # self.redis_manager.subscribe_event(SentinelEvent(self.instruments, AtrSentinel.sentinel_name),
@@ -225,14 +230,15 @@ class MMGrid(TriggerBase):
 
         bid, _ = self.instrument.orderbook.bid()
         ask, _ = self.instrument.orderbook.ask()
-        nearest_buy = self.buy_orders[0].price if self.buy_orders else None
-        furthest_buy = self.buy_orders[-1].price if self.buy_orders else None
-        nearest_sell = self.sell_orders[0].price if self.sell_orders else None
-        furthest_sell = self.sell_orders[-1].price if self.sell_orders else None
+        nearest_buy, furthest_buy = self._edge_prices(BUY)
+        nearest_sell, furthest_sell = self._edge_prices(SELL)
         self.logger.debug(
             f'nearest buy: {nearest_buy} furthest buy: {furthest_buy}')
         self.logger.debug(
             f'nearest sell: {nearest_sell} furthest sell: {furthest_sell}')
+        self.logger.debug(
+            f'open orders: {self.order_store.open_count(self.instr.id)} '
+            f'notional: {self.order_store.open_notional(self.instr.id)}')
         for a in range(self.config.nb_orders):
             qty = self._get_order_qty(a, BUY)
             price, step = self._get_order_price(a, BUY)
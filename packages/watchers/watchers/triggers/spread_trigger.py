@@ -15,7 +15,7 @@ from arb_utils.resolver import resolve_instruments
 from redis_manager.redis_events import OrderBookEvent
 from arb_utils.args_parser import instruments_args_parser
 from watchers.trigger_base import TriggerBase, TriggerClient
-from arb_defines.arb_dataclasses import AggrBook, Instrument, Order, OrderBook, TriggerPayload
+from arb_defines.arb_dataclasses import IncrAggrBook, Instrument, Order, OrderBook, TriggerPayload
 
 
 @dataclass
@@ -48,7 +48,7 @@ class SpreadTrigger(TriggerBase):
 
         super().__init__(instruments)
 
-        self.aggrbook = AggrBook()
+        self.aggrbook = IncrAggrBook()
         self.config: SpreadTriggerConfig = None
         self.trigger_timestamp = None
         self.side = None
@@ -56,7 +56,8 @@ class SpreadTrigger(TriggerBase):
     def subscribe_to_events(self):
         super().subscribe_to_events()
         self.redis_manager.subscribe_event(OrderBookEvent(self.instruments),
-                                           self.on_order_book_event)
+                                           self.on_order_book_event,
+                                           conflate=True)
 
     def on_order_book_event(self, orderbook: OrderBook):
         instr = self.instruments.get(orderbook.instr_id)
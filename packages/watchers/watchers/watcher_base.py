@@ -3,6 +3,7 @@ import logging
 
 from arb_logger.logger import get_logger
 from redis_manager.redis_manager import RedisManager
+from redis_manager.latency import LATENCY_FLUSH_SECONDS, LATENCY_TRACE
 from redis_manager.redis_wrappers import ExchangeRedis, InstrumentRedis
 
 
@@ -60,4 +61,8 @@ class WatcherBase:
 
     def run(self):
         self.subscribe_to_events()
+        if LATENCY_TRACE:
+            self.redis_manager.heartbeat_event(
+                LATENCY_FLUSH_SECONDS,
+                self.redis_manager.redis_handler.flush_latencies)
         self.redis_manager.run()
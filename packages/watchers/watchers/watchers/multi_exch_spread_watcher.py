@@ -7,7 +7,7 @@ from watchers.watcher_base import WatcherBase
 from arb_utils.resolver import resolve_instruments
 from redis_manager.redis_events import OrderBookEvent
 from arb_utils.args_parser import instruments_args_parser
-from arb_defines.arb_dataclasses import AggrBook, Instrument
+from arb_defines.arb_dataclasses import IncrAggrBook, Instrument
 
 
 @dataclass
@@ -30,7 +30,7 @@ class MultiExchSpreadWatcher(WatcherBase):
         super().__init__(instruments)
 
         self.all_spreads: dict[str, SpreadInfo] = {}
-        self.aggr_books = defaultdict(AggrBook)
+        self.aggr_books = defaultdict(IncrAggrBook)
 
     def subscribe_to_events(self):
         super().subscribe_to_events()